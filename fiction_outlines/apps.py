@@ -6,4 +6,4 @@ class FictionOutlinesConfig(AppConfig):  # pragma: no cover
     verbose_name = 'Fiction Outlines'
 
     def ready(self):  # pragma: no cover
-        from . import receivers  # noqa: F401
+        from . import receivers, arc_templates  # noqa: F401
@@ -0,0 +1,133 @@
+'''
+A library of templates that new arcs can be built from.
+
+A template is a tree of arc elements, given as a list of ``(arc_element_type, description)``
+or ``(arc_element_type, description, children)`` tuples for the children of the arc root.
+Each template is validated against :data:`fiction_outlines.models.ARC_NODE_ELEMENT_DEFINITIONS`
+and the arc structure rules once, when it is registered, and compiled into a batch of paths,
+types, and descriptions. Applying it to any number of arcs then only has to prefix those paths
+with each arc's root path. See :meth:`fiction_outlines.models.ArcElementNode.create_template_trees`.
+
+To add a template of your own, register it from the ``ready()`` method of your app config:
+
+.. code-block:: python
+
+   register_arc_template(ArcTemplate('house_style', 'House style', [
+       ('mile_hook', 'Open on the status quo.'),
+       ('tf', 'Complications.', [('beat', 'One thing goes wrong.')]),
+       ('mile_reso', 'Close on the new status quo.'),
+   ]))
+'''
+
+from collections import OrderedDict
+from django.utils.translation import gettext_lazy as _
+from .models import Arc, ArcElementNode, ArcIntegrityError, MilestoneSequenceError, ARC_NODE_ELEMENT_DEFINITIONS
+
+
+class ArcTemplate(object):
+    '''
+    A named tree of arc elements. ``batch`` holds the compiled nodes as ``(path, depth,
+    numchild, arc_element_type, description)`` tuples in tree order, with paths relative to
+    the arc root, and ``root_numchild`` is the number of children of the root.
+
+    :raises: :class:`fiction_outlines.models.ArcIntegrityError` if the template does not
+        describe a valid arc.
+    '''
+
+    def __init__(self, name, label, elements):
+        self.name = name
+        self.label = label
+        self.root_numchild = len(elements)
+        self.batch = tuple(self._compile(elements))
+        self.validate()
+
+    def __str__(self):
+        return str(self.label)
+
+    def _compile(self, elements, parent_path='', depth=2):
+        for position, element in enumerate(elements, 1):
+            arc_element_type, description = element[:2]
+            children = element[2] if len(element) > 2 else []
+            if arc_element_type not in ARC_NODE_ELEMENT_DEFINITIONS or arc_element_type == 'root':
+                raise ArcIntegrityError(_('Unknown arc element type %s in template %s.') % (arc_element_type,
+                                                                                            self.name))
+            path = ArcElementNode._get_path(parent_path, depth - 1, position)
+            yield path, depth, len(children), arc_element_type, description
+            yield from self._compile(children, path, depth + 1)
+
+    def validate(self):
+        '''
+        Checks the compiled tree with the same rules as :meth:`fiction_outlines.models.Arc.fetch_arc_errors`,
+        and that no milestone appears twice.
+        '''
+        arc = Arc(name=self.name)
+        root_path = ArcElementNode._get_path(None, 1, 1)
+        nodes = [ArcElementNode(arc=arc, arc_element_type='root', path=root_path, depth=1)]
+        nodes.extend(ArcElementNode(arc=arc, arc_element_type=arc_element_type, path=root_path + path, depth=depth)
+                     for path, depth, numchild, arc_element_type, description in self.batch)
+        milestones = [node.arc_element_type for node in nodes if node.is_milestone]
+        if len(milestones) != len(set(milestones)):
+            raise ArcIntegrityError(_('Template %s has the same milestone more than once.') % self.name)
+        if not arc._root_children(nodes) or arc.validate_first_element(nodes) or arc.validate_last_element(nodes):
+            raise MilestoneSequenceError(_('Template %s must start with the hook and end with the resolution.') %
+                                         self.name)
+        arc.validate_generations(nodes)
+        if arc.validate_milestones(nodes):
+            raise MilestoneSequenceError(_('The milestones of template %s are out of sequence.') % self.name)
+
+
+ARC_TEMPLATES = OrderedDict()
+
+
+def register_arc_template(template):
+    '''
+    Adds a compiled :class:`ArcTemplate` to the library, replacing any template of the same name.
+    '''
+    ARC_TEMPLATES[template.name] = template
+    return template
+
+
+def get_arc_template(name):
+    '''
+    Returns the registered template of the given name.
+
+    :raises: :class:`KeyError` if there is no such template.
+    '''
+    return ARC_TEMPLATES[name]
+
+
+def arc_template_choices():
+    '''
+    Returns the registered templates as choices for a form field.
+    '''
+    return [(name, template.label) for name, template in ARC_TEMPLATES.items()]
+
+
+register_arc_template(ArcTemplate('seven_point', _('Seven Point Story Structure'), [
+    (key, value['template_description']) for key, value in ARC_NODE_ELEMENT_DEFINITIONS.items() if value['milestone']
+]))
+
+register_arc_template(ArcTemplate('three_act', _('Three Act Structure'), [
+    ('mile_hook', _('Act one: the setup. Who, where, and what is at stake.')),
+    ('mile_pt1', _('The inciting incident that ends act one and commits the arc to its course.')),
+    ('tf', _('Act two: rising action as obstacles mount.')),
+    ('mile_mid', _('The midpoint, where the arc stops reacting and starts acting.')),
+    ('tf', _('The stakes rise and plans fall apart.')),
+    ('mile_pt2', _('The crisis that ends act two. The darkest moment, and the way through it.')),
+    ('mile_reso', _('Act three: the climax and resolution.')),
+]))
+
+register_arc_template(ArcTemplate('heros_journey', _("Hero's Journey"), [
+    ('mile_hook', _('The ordinary world.')),
+    ('beat', _('The call to adventure.')),
+    ('beat', _('Refusal of the call.')),
+    ('beat', _('Meeting the mentor.')),
+    ('mile_pt1', _('Crossing the first threshold.')),
+    ('tf', _('Tests, allies, and enemies.')),
+    ('mile_pnch1', _('Approach to the inmost cave.')),
+    ('mile_mid', _('The ordeal.')),
+    ('beat', _('The reward.')),
+    ('mile_pnch2', _('The road back.')),
+    ('mile_pt2', _('The resurrection.')),
+    ('mile_reso', _('Return with the elixir.')),
+]))
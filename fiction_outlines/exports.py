@@ -0,0 +1,291 @@
+'''
+Serializers used by :class:`fiction_outlines.views.OutlineExport`.
+
+The streaming JSON export produces the same document as the in-memory export,
+but reads the outline in chunks so that memory use does not grow with the size
+of the outline. The OPML and Markdown exports are always generated this way,
+reading the story tree in a single ordered query.
+'''
+
+import json
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.forms.models import model_to_dict
+from django.template.defaultfilters import date as date_filter
+from django.utils.html import escape
+from django.utils.timezone import template_localtime
+from .models import ArcElementNode, StoryElementNode, CharacterInstance, LocationInstance
+from .tracing import traced
+
+EXPORT_CHUNK_SIZE = 500
+
+# Fields derived from the rest of the outline, which are left out of the exported nodes.
+DERIVED_FIELDS = {
+    ArcElementNode: ('outline',),
+    StoryElementNode: ('impact_rating',),
+}
+
+
+def outline_to_dict(outline):
+    '''
+    Returns the outline and its series as a dict, without any of the related
+    characters, locations, arcs, or story tree.
+    '''
+    outline_dict = model_to_dict(outline)
+    outline_dict.pop('tags')
+    outline_dict['tags'] = list(outline.tags.names())
+    if outline.series:
+        outline_dict['series'] = model_to_dict(outline.series)
+        outline_dict['series']['tags'] = list(outline.series.tags.names())
+    return outline_dict
+
+
+def character_instance_to_dict(cint):
+    '''
+    Returns a character instance as a dict for export.
+    '''
+    character_dict = model_to_dict(cint.character)
+    character_dict['outline_key'] = cint.pk
+    character_dict['tags'] = list(cint.character.tags.names())
+    character_dict['role_properties'] = {
+        'main_character': cint.main_character,
+        'pov_character': cint.pov_character,
+        'protagonist': cint.protagonist,
+        'antagonist': cint.antagonist,
+        'villain': cint.villain,
+        'obstacle': cint.obstacle,
+    }
+    return character_dict
+
+
+def location_instance_to_dict(lint):
+    '''
+    Returns a location instance as a dict for export.
+    '''
+    location_dict = model_to_dict(lint.location)
+    location_dict['tags'] = list(lint.location.tags.names())
+    location_dict['outline_key'] = lint.pk
+    return location_dict
+
+
+def iter_tree_chunks(model, path, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yields the nodes of the branch starting at ``path`` in tree order, as lists
+    of at most ``chunk_size`` nodes with their M2M relations prefetched.
+    '''
+    prefetches = [Prefetch(field.name, queryset=field.remote_field.model.objects.only('pk'))
+                  for field in model._meta.local_many_to_many]
+    last_path = None
+    while True:
+        chunk = model.objects.filter(path__startswith=path).order_by('path')
+        if last_path is not None:
+            chunk = chunk.filter(path__gt=last_path)
+        chunk = list(chunk.prefetch_related(*prefetches)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_path = chunk[-1].path
+
+
+def iter_dumped_nodes(model, path, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yields ``(depth, json)`` for each node in the branch starting at ``path``,
+    where ``json`` is the node as it appears in :meth:`treebeard.mp_tree.MP_Node.dump_bulk`
+    without its ``children``.
+    '''
+    pk_field = model._meta.pk.attname
+    for chunk in iter_tree_chunks(model, path, chunk_size):
+        for pyobj in serializers.serialize('python', chunk):
+            fields = pyobj['fields']
+            depth = len(fields['path']) // model.steplen
+            del fields['depth']
+            del fields['path']
+            del fields['numchild']
+            fields.pop(pk_field, None)
+            for name in DERIVED_FIELDS.get(model, ()):
+                del fields[name]
+            yield depth, json.dumps({'data': fields, pk_field: pyobj['pk']}, cls=DjangoJSONEncoder)
+
+
+def dump_tree(model, parent):
+    '''
+    Returns the branch starting at ``parent`` as :meth:`treebeard.mp_tree.MP_Node.dump_bulk`
+    does, without the ``DERIVED_FIELDS`` of its nodes.
+    '''
+    tree = model.dump_bulk(parent=parent)
+    nodes = list(tree)
+    while nodes:
+        node = nodes.pop()
+        for name in DERIVED_FIELDS.get(model, ()):
+            del node['data'][name]
+        nodes.extend(node.get('children', []))
+    return tree
+
+
+def stream_tree(model, path, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yields the JSON for the branch starting at ``path``, matching
+    ``json.dumps(dump_tree(model, node))``. An empty list is returned
+    if ``path`` is ``None``.
+    '''
+    yield '['
+    if path is not None:
+        open_depths = []
+        previous = None
+        for depth, node_json in iter_dumped_nodes(model, path, chunk_size):
+            if previous is not None:
+                previous_depth, previous_json = previous
+                if depth > previous_depth:
+                    yield previous_json[:-1] + ', "children": ['
+                    open_depths.append(previous_depth)
+                else:
+                    yield previous_json
+                    while open_depths and open_depths[-1] >= depth:
+                        open_depths.pop()
+                        yield ']}'
+                    yield ', '
+            previous = (depth, node_json)
+        if previous is not None:
+            yield previous[1]
+        for depth in open_depths:
+            yield ']}'
+    yield ']'
+
+
+def _stream_list(items, to_dict):
+    '''
+    Yields a JSON list built from an iterable, one item at a time.
+    '''
+    yield '['
+    for index, item in enumerate(items):
+        if index:
+            yield ', '
+        yield json.dumps(to_dict(item), cls=DjangoJSONEncoder)
+    yield ']'
+
+
+@traced('export')
+def stream_outline_json(outline, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yields the JSON export of an outline in pieces, producing the same output as
+    ``JsonResponse`` does for the in-memory export.
+    '''
+    head = json.dumps(outline_to_dict(outline), cls=DjangoJSONEncoder)
+    yield head[:-1]
+    separator = ', ' if head != '{}' else ''
+
+    def key(name):
+        return separator + json.dumps(name) + ': '
+
+    characters = CharacterInstance.objects.filter(outline=outline).select_related('character')
+    if characters.exists():
+        yield key('characters')
+        yield from _stream_list(characters.iterator(chunk_size=chunk_size), character_instance_to_dict)
+        separator = ', '
+    locations = LocationInstance.objects.filter(outline=outline).select_related('location')
+    if locations.exists():
+        yield key('locations')
+        yield from _stream_list(locations.iterator(chunk_size=chunk_size), location_instance_to_dict)
+        separator = ', '
+    arcs = outline.arc_set.all()
+    if arcs.exists():
+        root_paths = dict(ArcElementNode.objects.filter(outline=outline, depth=1).values_list('arc_id', 'path'))
+        yield key('arcs')
+        yield '['
+        for index, arc in enumerate(arcs.iterator(chunk_size=chunk_size)):
+            if index:
+                yield ', '
+            arc_json = json.dumps(model_to_dict(arc), cls=DjangoJSONEncoder)
+            yield arc_json[:-1] + (', ' if arc_json != '{}' else '') + '"nodes": '
+            yield from stream_tree(ArcElementNode, root_paths.get(arc.pk), chunk_size)
+            yield '}'
+        yield ']'
+        separator = ', '
+    story_root_path = StoryElementNode.objects.filter(outline=outline, depth=1).values_list(
+        'path', flat=True).first()
+    yield key('story_tree')
+    yield from stream_tree(StoryElementNode, story_root_path, chunk_size)
+    yield '}'
+
+
+def iter_story_tree(outline, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yields ``(node, has_children)`` for every node of the outline's story tree in
+    tree order, from a single query.
+    '''
+    nodes = StoryElementNode.objects.filter(outline=outline).order_by('path').only(
+        'path', 'depth', 'name', 'description', 'story_element_type').iterator(chunk_size=chunk_size)
+    previous = None
+    for node in nodes:
+        if previous is not None:
+            yield previous, node.depth > previous.depth
+        previous = node
+    if previous is not None:
+        yield previous, False
+
+
+@traced('export')
+def stream_outline_opml(outline, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yields the OPML export of an outline in pieces.
+    '''
+    yield "<?xml version='1.0' encoding='UTF-8'?>\n<opml version=\"2.0\">\n  <head>\n"
+    yield '    <title>%s</title>\n' % escape(outline.title)
+    if outline.series:
+        yield '    <series>%s</series>\n' % escape(outline.series.title)
+    tags = [tag.name for tag in outline.tags.all()]
+    if tags:
+        yield '    <tags>%s</tags>\n' % escape(', '.join(tags))
+    yield '    <ownerName>%s</ownerName>\n' % escape(getattr(outline.user, 'name', None) or outline.user.username)
+    if getattr(outline.user, 'homepage_url', None):
+        yield '    <ownerId>%s</ownerId>\n' % escape(outline.user.homepage_url)
+    yield '    <dateCreated>%s</dateCreated>\n' % date_filter(
+        template_localtime(outline.created), 'DATETIME_FORMAT')
+    yield '    <dateModified>%s</dateModified>\n' % date_filter(
+        template_localtime(outline.modified), 'DATETIME_FORMAT')
+    yield '  </head>\n  <body>\n'
+    yield '    <outline text="%s" _notes="%s">\n' % (escape(outline.title), escape(outline.description))
+    open_depths = []
+    for node, has_children in iter_story_tree(outline, chunk_size):
+        if node.depth == 1:
+            continue
+        while open_depths and open_depths[-1] >= node.depth:
+            open_depths.pop()
+            yield '  ' * (len(open_depths) + 3) + '</outline>\n'
+        indent = '  ' * (len(open_depths) + 3)
+        attributes = 'text="%s" _notes="%s"' % (escape(node.name), escape(node.description))
+        if has_children:
+            yield '%s<outline %s>\n' % (indent, attributes)
+            open_depths.append(node.depth)
+        else:
+            yield '%s<outline %s />\n' % (indent, attributes)
+    while open_depths:
+        open_depths.pop()
+        yield '  ' * (len(open_depths) + 3) + '</outline>\n'
+    yield '    </outline>\n  </body>\n</opml>\n'
+
+
+MARKDOWN_HEADINGS = {
+    'book': '##',
+    'act': '###',
+    'part': '####',
+}
+
+
+@traced('export')
+def stream_outline_markdown(outline, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yields the Markdown export of an outline in pieces.
+    '''
+    yield '# %s\n\n%s\n' % (escape(outline.title), escape(outline.description))
+    for node, has_children in iter_story_tree(outline, chunk_size):
+        if node.story_element_type == 'root':
+            heading = ''
+        elif node.story_element_type == 'ss':
+            heading = '**%s**' % escape(node.name)
+        else:
+            heading = '%s %s' % (MARKDOWN_HEADINGS.get(node.story_element_type, '#####'), escape(node.name))
+        scene_break = '\n----\n' if node.story_element_type == 'ss' else ''
+        yield '\n%s\n\n%s\n%s\n' % (heading, escape(node.description), scene_break)
+    yield '\n'
@@ -6,13 +6,17 @@ from .models import CharacterInstance, LocationInstance, Outline
 from .models import Character, Location, Series, ArcElementNode, StoryElementNode
 
 logger = logging.getLogger('forms')
-logger.setLevel(logging.DEBUG)
 
 
 class OutlineMoveNodeForm(tforms.MoveNodeForm):
     '''
     Subclass of base ``treebeard`` move node form allowing us to restrict
     target node options to within a single tree.
+
+    If a ``choices_url`` is given, the target node is entered as a pk instead of being
+    picked from a list of the whole tree, and is validated with a single query. The
+    widget carries the url in its ``data-choices-url`` attribute, for a script to fetch
+    the choices from one level or search at a time.
     '''
 
     __position_choices_sorted = (
@@ -44,13 +48,15 @@ class OutlineMoveNodeForm(tforms.MoveNodeForm):
         root_node = kwargs.pop('root_node')
         if not root_node:
             raise KeyError(_('A root node must be specified'))  # pragma: no cover
+        self.root_node = root_node
+        self.choices_url = kwargs.pop('choices_url', None)
         if isinstance(root_node, ArcElementNode):
             type = 'ArcElementNode'
         elif isinstance(root_node, StoryElementNode):
             type = 'StoryElementNode'
         else:
             type = 'Unknown'  # pragma: no cover
-        logger.debug("OutlineMoveNodeForm was fed a root node of type: %s - pk %s" % (type, root_node.pk))
+        logger.debug('OutlineMoveNodeForm was fed a root node of type: %s - pk %s', type, root_node.pk)
         # Beginning ``treebeard`` boilerplate.
         opts = self._meta
         if opts.model is None:  # pragma: no cover
@@ -66,9 +72,10 @@ class OutlineMoveNodeForm(tforms.MoveNodeForm):
 
         # Here's where things get different as we need to ensure we only call our altered methods
         # Update _ref_node_id choices
-        choices = self.__class__.mk_dropdown_tree(opts.model, root_node=root_node, for_node=instance)
-        logger.debug("Length of choices is %d" % len(choices))
-        self.declared_fields['_ref_node_id'].choices = choices
+        if not self.choices_url:
+            choices = self.__class__.mk_dropdown_tree(opts.model, root_node=root_node, for_node=instance)
+            logger.debug('Length of choices is %d', len(choices))
+            self.declared_fields['_ref_node_id'].choices = choices
 
         # More ``treebeard`` boilerplate.
         # Put initial data  data for fields into a map, update map with initial data,
@@ -83,6 +90,28 @@ class OutlineMoveNodeForm(tforms.MoveNodeForm):
 
         forms.ModelForm.__init__(self, data, files, auto_id, prefix, initial_, error_class, label_suffix,
                                  empty_permitted, instance, **kwargs)
+        if self.choices_url:
+            self.fields['_ref_node_id'] = forms.CharField(
+                required=True, label=_("Relative to"),
+                widget=forms.TextInput(attrs={'data-choices-url': self.choices_url}))
+
+    def clean__ref_node_id(self):
+        '''
+        Without a list of choices, checks that the target node is in the tree in a single query.
+        '''
+        value = self.cleaned_data['_ref_node_id']
+        if not self.choices_url:
+            return value
+        model = self._meta.model
+        try:
+            pk = model._meta.pk.to_python(value)
+        except forms.ValidationError:
+            pk = None
+        if pk is None or not model.objects.filter(
+                pk=pk, path__startswith=self.root_node.path, depth__gt=self.root_node.depth).exists():
+            raise forms.ValidationError(_('Select a valid choice. That choice is not one of the available choices.'),
+                                        code='invalid_choice')
+        return str(pk)
 
     @classmethod
     def mk_dropdown_tree(cls, model, root_node, for_node=None):
@@ -91,7 +120,7 @@ class OutlineMoveNodeForm(tforms.MoveNodeForm):
         '''
         options = []
         # The difference is that we only generate the subtree for the current root.
-        logger.debug("Using root node pk of %s" % root_node.pk)
+        logger.debug('Using root node pk of %s', root_node.pk)
         cls.add_subtree(for_node, root_node, options)
         return options[1:]
 
@@ -222,7 +251,7 @@ class ArcNodeForm(forms.ModelForm):
         arc = kwargs.pop('arc')
         super().__init__(*args, **kwargs)
         if arc:
-            outline = arc.outline
+            outline = arc.outline_id
             self.fields['assoc_characters'].queryset = CharacterInstance.objects.filter(outline=outline)
             self.fields['assoc_locations'].queryset = LocationInstance.objects.filter(outline=outline)
             self.fields['story_element_node'].queryset = StoryElementNode.objects.filter(outline=outline, depth__gt=1)
@@ -0,0 +1,46 @@
+'''
+Headlines for arc elements, derived from their descriptions.
+
+The headline is the first line of the description, cut to ``HEADLINE_WORDS`` words and then
+to ``HEADLINE_LENGTH`` characters. These functions give the same result as the
+``truncatewords`` and ``truncatechars`` template filters would, but only read as far into the
+description as the headline needs. The manager of :class:`fiction_outlines.models.ArcElementNode`
+uses them to fill in headlines for bulk writes, which send no ``pre_save`` signal.
+'''
+
+from django.template.defaultfilters import truncatechars
+
+HEADLINE_WORDS = 20
+HEADLINE_LENGTH = 250
+TRUNCATED_WORDS = ' …'
+
+
+def generate_headline(description):
+    '''
+    Returns the headline for a description.
+    '''
+    end = description.find('\n')
+    words = (description if end == -1 else description[:end]).split(None, HEADLINE_WORDS)
+    if len(words) > HEADLINE_WORDS:
+        headline = ' '.join(words[:HEADLINE_WORDS])
+        if not headline.endswith(TRUNCATED_WORDS):
+            headline += TRUNCATED_WORDS
+    else:
+        headline = ' '.join(words)
+    if headline[:-1] == '…':
+        headline = truncatechars(headline.replace(TRUNCATED_WORDS, ''), HEADLINE_LENGTH)
+    else:
+        headline = truncatechars(headline, HEADLINE_LENGTH)
+    return headline
+
+
+def generate_headlines(descriptions):
+    '''
+    Returns a list of the headlines for a list of descriptions. Repeated descriptions, such
+    as those of a template, are only worked out once.
+    '''
+    headlines = {}
+    for description in descriptions:
+        if description not in headlines:
+            headlines[description] = generate_headline(description)
+    return [headlines[description] for description in descriptions]
@@ -0,0 +1,258 @@
+'''
+Import of outlines from the JSON produced by :class:`fiction_outlines.views.OutlineExport`.
+
+An import is written in a single transaction with bulk inserts. Tree paths are computed
+directly instead of through treebeard's one node at a time inserts, and the rules that the
+signal receivers enforce are checked in memory before anything is written, so none of those
+receivers run for the imported records.
+'''
+
+import json
+from collections import defaultdict
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.utils.translation import gettext_lazy as _
+from taggit.models import Tag
+from .models import Outline, Series, Character, CharacterInstance, Location, LocationInstance
+from .models import Arc, ArcElementNode, StoryElementNode, UUIDCharacterTag, UUIDLocationTag, UUIDOutlineTag
+from .models import MACE_TYPES, ARC_NODE_ELEMENT_DEFINITIONS, STORY_NODE_ELEMENT_DEFINITIONS, next_root_step
+
+ROLE_PROPERTIES = ('main_character', 'pov_character', 'protagonist', 'antagonist', 'villain', 'obstacle')
+
+
+class OutlineImportError(IntegrityError):
+    '''
+    Raised when import data is invalid. ``errors`` lists every problem found.
+    '''
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(str(error) for error in errors))
+
+
+def walk_tree(nodes):
+    '''
+    Yields ``(node, parent, depth, position)`` for every node of a tree in the
+    :meth:`treebeard.mp_tree.MP_Node.dump_bulk` format, in tree order. ``position``
+    counts from 1 among the node's siblings.
+    '''
+    stack = [(node, None, 1, position) for position, node in reversed(list(enumerate(nodes, 1)))]
+    while stack:
+        node, parent, depth, position = stack.pop()
+        yield node, parent, depth, position
+        for child_position, child in reversed(list(enumerate(node.get('children', []), 1))):
+            stack.append((child, node, depth + 1, child_position))
+
+
+def validate_import_data(data):
+    '''
+    Checks export data against the rules normally enforced as each record is saved.
+
+    :raises: :class:`OutlineImportError` listing every problem found.
+    '''
+    errors = []
+    if not data.get('title'):
+        errors.append(_('The outline must have a title.'))
+    instance_keys = {}
+    for kind in ('characters', 'locations'):
+        for item in data.get(kind, []):
+            if not item.get('name'):
+                errors.append(_('Every entry in %s must have a name.' % kind))
+            if item.get('outline_key') in instance_keys:
+                errors.append(_('Outline key %s is used more than once.' % item.get('outline_key')))
+            instance_keys[item.get('outline_key')] = kind
+    story_tree = data.get('story_tree', [])
+    story_node_ids = {None}
+    if len(story_tree) != 1 or story_tree[0].get('data', {}).get('story_element_type') != 'root':
+        errors.append(_('The story tree must have a single root node.'))
+    for node, parent, depth, position in walk_tree(story_tree):
+        node_type = node.get('data', {}).get('story_element_type')
+        story_node_ids.add(node.get('id'))
+        if node_type not in STORY_NODE_ELEMENT_DEFINITIONS:
+            errors.append(_('%s is not a valid story element type.' % node_type))
+        elif parent is not None:
+            parent_type = parent.get('data', {}).get('story_element_type')
+            if parent_type not in STORY_NODE_ELEMENT_DEFINITIONS[node_type]['allowed_parents']:
+                errors.append(_('%s is not an allowed child of %s' % (node_type, parent_type)))
+        errors.extend(_validate_instance_links(node, instance_keys))
+    for arc in data.get('arcs', []):
+        if arc.get('mace_type') not in dict(MACE_TYPES):
+            errors.append(_('%s is not a valid MACE type.' % arc.get('mace_type')))
+        nodes = arc.get('nodes', [])
+        if len(nodes) > 1 or (nodes and nodes[0].get('data', {}).get('arc_element_type') != 'root'):
+            errors.append(_('Arc %s must have a single root node.' % arc.get('name')))
+        milestones = set()
+        for node, parent, depth, position in walk_tree(nodes):
+            node_data = node.get('data', {})
+            node_type = node_data.get('arc_element_type')
+            if node_type not in ARC_NODE_ELEMENT_DEFINITIONS:
+                errors.append(_('%s is not a valid arc element type.' % node_type))
+                continue
+            if node_type == 'root' and parent is not None:
+                errors.append(_('Only the first node of arc %s can be its root.' % arc.get('name')))
+            if 'mile' in node_type:
+                if parent is not None and 'mile' in parent.get('data', {}).get('arc_element_type', ''):
+                    errors.append(_('You cannot have a milestone as a child to another milestone.'))
+                if node_type in milestones:
+                    errors.append(_('You cannot have two of the same milestone in the same arc.'))
+                milestones.add(node_type)
+            if node_data.get('story_element_node') not in story_node_ids:
+                errors.append(_('An arc cannot be associated with an story element from another outline.'))
+            errors.extend(_validate_instance_links(node, instance_keys))
+    if errors:
+        raise OutlineImportError(errors)
+
+
+def _validate_instance_links(node, instance_keys):
+    '''
+    Returns errors for any characters or locations of a node that are not part of the import.
+    '''
+    errors = []
+    for field, kind in (('assoc_characters', 'characters'), ('assoc_locations', 'locations')):
+        for key in node.get('data', {}).get(field, []):
+            if instance_keys.get(key) != kind:
+                errors.append(_('%s %s must be from the same outline as the node.' % (kind.capitalize(), key)))
+    return errors
+
+
+def build_tree(model, nodes, root_step, **kwargs):
+    '''
+    Returns unsaved instances of ``model`` for a tree in the :meth:`treebeard.mp_tree.MP_Node.dump_bulk`
+    format, with their paths computed from ``root_step``, as a list of ``(node_dict, instance)``
+    tuples in tree order. ``kwargs`` are passed to every instance.
+    '''
+    built = []
+    paths = {}
+    for node, parent, depth, position in walk_tree(nodes):
+        parent_path = paths[id(parent)] if parent is not None else None
+        path = model._get_path(parent_path, depth, position + root_step - 1 if parent is None else position)
+        paths[id(node)] = path
+        instance = model(path=path, depth=depth, numchild=len(node.get('children', [])), **kwargs)
+        built.append((node, instance))
+    return built
+
+
+def bulk_tag(tagged):
+    '''
+    Takes a list of ``(through_model, instance, tag_names)`` tuples and adds the tags with
+    one insert per through model, creating any tags that don't exist yet.
+    '''
+    names = {name for through, instance, tag_names in tagged for name in tag_names}
+    if not names:
+        return
+    tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    for name in names - tags.keys():
+        tags[name] = Tag.objects.create(name=name)
+    rows = defaultdict(list)
+    for through, instance, tag_names in tagged:
+        content_type = ContentType.objects.get_for_model(instance)
+        for name in dict.fromkeys(tag_names):
+            rows[through].append(through(tag=tags[name], content_type=content_type, object_id=instance.pk))
+    for through, through_rows in rows.items():
+        through.objects.bulk_create(through_rows)
+
+
+def bulk_link(model, field_name, links):
+    '''
+    Inserts the ``(instance_pk, related_pk)`` pairs for a many to many field in a single query.
+    '''
+    field = model._meta.get_field(field_name)
+    through = field.remote_field.through
+    source, target = field.m2m_field_name() + '_id', field.m2m_reverse_field_name() + '_id'
+    through.objects.bulk_create([through(**{source: pk, target: related_pk}) for pk, related_pk in sorted(links)])
+
+
+@transaction.atomic
+def import_outline(data, user):
+    '''
+    Creates a new outline owned by ``user`` from export data, given either as the JSON
+    document or as the parsed dict. The series, characters, and locations are created as
+    new records for the user as well. Every table is written with bulk inserts, so the number
+    of queries does not grow with the size of the outline, beyond the batching of very large
+    inserts.
+
+    Returns the new :class:`fiction_outlines.models.Outline`.
+
+    :raises: :class:`OutlineImportError` if the data is invalid, in which case nothing is written.
+    '''
+    if isinstance(data, (str, bytes, bytearray)):
+        data = json.loads(data)
+    validate_import_data(data)
+    tagged = []
+    series = None
+    if data.get('series'):
+        series = Series(title=data['series'].get('title'), description=data['series'].get('description'), user=user)
+        Series.objects.bulk_create([series])
+        tagged.append((UUIDOutlineTag, series, data['series'].get('tags', [])))
+    outline = Outline(title=data['title'], description=data.get('description'), series=series, user=user)
+    Outline.objects.bulk_create([outline])
+    tagged.append((UUIDOutlineTag, outline, data.get('tags', [])))
+
+    instances = {}
+    characters, character_instances = [], []
+    for item in data.get('characters', []):
+        character = Character(name=item['name'], description=item.get('description'), user=user)
+        instance = CharacterInstance(character=character, outline=outline,
+                                     **{role: bool(item.get('role_properties', {}).get(role))
+                                        for role in ROLE_PROPERTIES})
+        characters.append(character)
+        character_instances.append(instance)
+        instances[item['outline_key']] = instance
+        tagged.append((UUIDCharacterTag, character, item.get('tags', [])))
+    locations, location_instances = [], []
+    for item in data.get('locations', []):
+        location = Location(name=item['name'], description=item.get('description'), user=user)
+        instance = LocationInstance(location=location, outline=outline)
+        locations.append(location)
+        location_instances.append(instance)
+        instances[item['outline_key']] = instance
+        tagged.append((UUIDLocationTag, location, item.get('tags', [])))
+    Character.objects.bulk_create(characters)
+    Location.objects.bulk_create(locations)
+    CharacterInstance.objects.bulk_create(character_instances)
+    LocationInstance.objects.bulk_create(location_instances)
+
+    story_nodes = build_tree(StoryElementNode, data['story_tree'], next_root_step(StoryElementNode), outline=outline)
+    story_nodes_by_key = {}
+    for node, instance in story_nodes:
+        instance.name = node['data'].get('name')
+        instance.description = node['data'].get('description')
+        instance.story_element_type = node['data']['story_element_type']
+        if instance.story_element_type == 'root':
+            instance.impact_rating = 0
+        story_nodes_by_key[node['id']] = instance
+
+    arcs, arc_nodes = [], []
+    root_step = next_root_step(ArcElementNode)
+    for item in data.get('arcs', []):
+        arc = Arc(mace_type=item['mace_type'], name=item.get('name'), outline=outline)
+        arcs.append(arc)
+        nodes = item.get('nodes', [])
+        arc_nodes.extend(build_tree(ArcElementNode, nodes, root_step, arc=arc, outline=outline))
+        root_step += len(nodes)
+    links = defaultdict(set)
+    for node, instance in arc_nodes:
+        instance.arc_element_type = node['data']['arc_element_type']
+        instance.description = node['data'].get('description') or ''
+        instance.story_element_node = story_nodes_by_key.get(node['data'].get('story_element_node'))
+        for field in ('assoc_characters', 'assoc_locations'):
+            related_pks = {instances[key].pk for key in node['data'].get(field, [])}
+            links[ArcElementNode, field] |= {(instance.pk, pk) for pk in related_pks}
+            if instance.story_element_node is not None:
+                # Story nodes carry the characters and locations of their arc elements.
+                links[StoryElementNode, field] |= {(instance.story_element_node.pk, pk) for pk in related_pks}
+    for node, instance in story_nodes:
+        for field in ('assoc_characters', 'assoc_locations'):
+            links[StoryElementNode, field] |= {(instance.pk, instances[key].pk)
+                                               for key in node['data'].get(field, [])}
+
+    StoryElementNode.objects.bulk_create([instance for node, instance in story_nodes])
+    Arc.objects.bulk_create(arcs)
+    ArcElementNode.objects.bulk_create([instance for node, instance in arc_nodes])
+    for (model, field), field_links in links.items():
+        if field_links:
+            bulk_link(model, field, field_links)
+    bulk_tag(tagged)
+    outline.refresh_impact_ratings()
+    outline.refresh_from_db()
+    return outline
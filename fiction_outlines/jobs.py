@@ -0,0 +1,150 @@
+'''
+Background export jobs.
+
+Exports are rendered by a pool of worker threads and the resulting files are kept
+in the Django cache, keyed by the outline, the export format, and the outline's
+``modified`` timestamp. Receivers keep ``Outline.modified`` current as anything in
+the outline changes, so a cached file is served until the outline is edited. They touch
+the outline when the transaction commits, or when an export key is worked out, whichever
+comes first.
+
+The following settings are supported:
+
+``FICTION_OUTLINES_EXPORT_CACHE``
+    Alias of the cache used for export files. Defaults to ``'default'``.
+``FICTION_OUTLINES_EXPORT_TIMEOUT``
+    Seconds to keep export files and job statuses. Defaults to 3600.
+``FICTION_OUTLINES_EXPORT_WORKERS``
+    Number of worker threads. Defaults to 2.
+``FICTION_OUTLINES_EXPORT_JOBS_INLINE``
+    Run jobs immediately in the calling thread instead, e.g. for tests. Defaults to ``False``.
+'''
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.utils.text import slugify
+from . import exports
+from .models import Outline
+from .receivers import flush_outline_touches
+
+logger = logging.getLogger('fiction_outlines')
+
+EXPORT_JOB_FORMATS = {
+    'json': (exports.stream_outline_json, 'application/json'),
+    'opml': (exports.stream_outline_opml, 'text/xml'),
+    'md': (exports.stream_outline_markdown, 'text/markdown; charset="UTF-8"'),
+}
+
+NOT_STARTED = 'not_started'
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_setting(name, default):
+    return getattr(settings, 'FICTION_OUTLINES_EXPORT_%s' % name, default)
+
+
+def get_cache():
+    return caches[get_setting('CACHE', 'default')]
+
+
+def get_executor():
+    '''
+    Returns the worker pool, creating it on first use.
+    '''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_setting('WORKERS', 2),
+                                           thread_name_prefix='fiction_outlines_export')
+        return _executor
+
+
+def export_key(outline, format):
+    '''
+    Returns the cache key for an export of the outline as it currently stands.
+    '''
+    flush_outline_touches()
+    modified = Outline.objects.filter(pk=outline.pk).values_list('modified', flat=True).get()
+    return 'fiction_outlines:export:%s:%s:%s' % (outline.pk, format, modified.isoformat())
+
+
+def get_export_artifact(outline, format):
+    '''
+    Returns the cached export of the outline as a dict of ``content``, ``content_type``
+    and ``filename``, or ``None`` if there isn't one for the current version of the outline.
+    '''
+    return get_cache().get(export_key(outline, format))
+
+
+def get_export_status(outline, format):
+    '''
+    Returns the status of the export job for the current version of the outline.
+    '''
+    key = export_key(outline, format)
+    cache = get_cache()
+    if cache.get(key) is not None:
+        return READY
+    return cache.get(key + ':status', NOT_STARTED)
+
+
+def enqueue_export(outline, format):
+    '''
+    Starts an export of the outline in the background, unless one for the current
+    version of the outline is already cached or running. Returns the job status.
+    '''
+    if format not in EXPORT_JOB_FORMATS:
+        raise ValueError('Unsupported export format: %s' % format)
+    key = export_key(outline, format)
+    cache = get_cache()
+    if cache.get(key) is not None:
+        return READY
+    status_key = key + ':status'
+    if cache.get(status_key) == FAILED:
+        cache.delete(status_key)
+    if not cache.add(status_key, PENDING, get_setting('TIMEOUT', 3600)):
+        return cache.get(status_key, PENDING)
+    if get_setting('JOBS_INLINE', False):
+        run_export(outline.pk, format, key)
+    else:
+        get_executor().submit(_run_export_in_worker, outline.pk, format, key)
+    return cache.get(status_key, PENDING)
+
+
+def run_export(outline_id, format, key):
+    '''
+    Renders an export and stores it in the cache under ``key``.
+    '''
+    cache = get_cache()
+    timeout = get_setting('TIMEOUT', 3600)
+    try:
+        outline = Outline.objects.select_related('series', 'user').get(pk=outline_id)
+        serializer, content_type = EXPORT_JOB_FORMATS[format]
+        artifact = {
+            'content': ''.join(serializer(outline)),
+            'content_type': content_type,
+            'filename': '{}.{}'.format(slugify(outline.title), format),
+        }
+        cache.set(key, artifact, timeout)
+        cache.set(key + ':status', READY, timeout)
+    except Exception:
+        logger.exception('Export of outline %s as %s failed', outline_id, format)
+        cache.set(key + ':status', FAILED, timeout)
+
+
+def _run_export_in_worker(outline_id, format, key):
+    '''
+    Runs an export on a worker thread, closing the thread's database connections afterwards.
+    '''
+    try:
+        run_export(outline_id, format, key)
+    finally:
+        connections.close_all()
@@ -0,0 +1,110 @@
+'''
+Managers that apply the permission predicates of :mod:`fiction_outlines.rules` as
+database filters, so that many records can be authorized in a single query.
+
+Each model names the path from itself to the user that owns it in ``owner_lookup``.
+'''
+
+from django.db import models
+from treebeard.mp_tree import MP_NodeManager, MP_NodeQuerySet
+from .headlines import generate_headline, generate_headlines
+
+
+class OwnedQuerySet(models.QuerySet):
+    '''
+    Queryset that filters records by the permissions a user has on them.
+    '''
+
+    def owned_by(self, user):
+        '''
+        Returns the records owned by the user. Anonymous users own nothing.
+        '''
+        if not user.is_authenticated:
+            return self.none()
+        return self.filter(**{self.model.owner_lookup: user.pk})
+
+    def visible_to(self, user):
+        '''
+        Returns the records the user has the ``view_*`` permission for.
+        '''
+        return self.owned_by(user)
+
+    def editable_by(self, user):
+        '''
+        Returns the records the user has the ``edit_*`` permission for.
+        '''
+        return self.owned_by(user)
+
+    def deletable_by(self, user):
+        '''
+        Returns the records the user has the ``delete_*`` permission for.
+        '''
+        return self.owned_by(user)
+
+
+OwnedManager = models.Manager.from_queryset(OwnedQuerySet, 'OwnedManager')
+
+
+class OwnedNodeQuerySet(OwnedQuerySet, MP_NodeQuerySet):
+    '''
+    Permission filtering for tree nodes, keeping treebeard's handling of deletes.
+    '''
+
+
+class OwnedNodeManager(MP_NodeManager.from_queryset(OwnedNodeQuerySet)):
+    '''
+    Tree node manager with permission filtering. Like treebeard's manager, results are in tree order.
+    '''
+
+    def get_queryset(self):
+        return self._queryset_class(self.model, using=self._db).order_by('path')
+
+
+class ArcElementNodeQuerySet(OwnedNodeQuerySet):
+    '''
+    Fills in the headlines of arc elements for bulk writes, which skip the ``pre_save`` receiver
+    that does it for single saves.
+    '''
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj, headline in zip(objs, generate_headlines([obj.description for obj in objs])):
+            obj.headline = headline
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'description' in fields:
+            objs = list(objs)
+            for obj, headline in zip(objs, generate_headlines([obj.description for obj in objs])):
+                obj.headline = headline
+            fields = list(fields) + ([] if 'headline' in fields else ['headline'])
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if isinstance(kwargs.get('description'), str):
+            kwargs['headline'] = generate_headline(kwargs['description'])
+        return super().update(**kwargs)
+
+
+ArcElementNodeManager = OwnedNodeManager.from_queryset(ArcElementNodeQuerySet, 'ArcElementNodeManager')
+
+
+class StoryElementNodeQuerySet(OwnedNodeQuerySet):
+    '''
+    Refreshes the stored impact ratings of the parents the deleted nodes leave behind, once for
+    each deletion. Nodes deleted along with their outline don't come through here.
+    '''
+
+    def delete(self, *args, **kwargs):
+        steplen = self.model.steplen
+        parent_paths = {path[:-steplen] for path in self.filter(depth__gt=2).values_list('path', flat=True)}
+        result = super().delete(*args, **kwargs)
+        if parent_paths:
+            # Parents deleted along with their children are no longer found.
+            self.model.refresh_impact_ratings(self.model.objects.filter(path__in=parent_paths).values('pk'))
+        return result
+
+    delete.alters_data = True
+
+
+StoryElementNodeManager = OwnedNodeManager.from_queryset(StoryElementNodeQuerySet, 'StoryElementNodeManager')
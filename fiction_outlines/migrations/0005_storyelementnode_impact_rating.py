@@ -0,0 +1,125 @@
+# Generated by Django 4.0.10 on 2026-10-17 02:03
+
+from collections import defaultdict
+from django.db import migrations, models
+
+# The impact rules as they stood when this migration was written. They are copied here so that
+# later changes to the models don't change what the migration does.
+IMPACT_VALUES = {
+    'base': 0.5,
+    'mile': 2,
+    'beat': 0.5,
+    'tf': 0.5,
+    'mile_child': 0.5,
+}
+
+IMPACT_BLEED = {
+    'mile': 0.5,
+    'tf_beat': 0.25,
+}
+
+MILESTONES = ('mile_hook', 'mile_pt1', 'mile_pnch1', 'mile_mid', 'mile_pnch2', 'mile_pt2', 'mile_reso')
+
+
+def parent_path(path, depth):
+    '''
+    Returns the path of a node's parent, working out the step length from the node itself.
+    '''
+    return path[:len(path) // depth * (depth - 1)]
+
+
+def local_impact(arc_elements):
+    '''
+    Returns ``(base_impact, add_impact, mile_impact)`` for ``(arc_element_type, parent_type)`` tuples.
+    '''
+    mile_impact = 0
+    add_impact = 0
+    milestone_counts = defaultdict(int)
+    for arc_element_type, parent_type in arc_elements:
+        if arc_element_type in MILESTONES:
+            milestone_counts[arc_element_type] += 1
+            mile_impact += IMPACT_VALUES['mile']
+        else:
+            if parent_type in MILESTONES:
+                add_impact += IMPACT_VALUES['mile_child']
+            if arc_element_type == 'beat':
+                add_impact += IMPACT_VALUES['beat']
+            if arc_element_type == 'tf':
+                add_impact += IMPACT_VALUES['tf']
+    for count in milestone_counts.values():
+        if count > 1:
+            add_impact += (count - 1) * .5
+    return IMPACT_VALUES['base'], add_impact, mile_impact
+
+
+def impact_ratings(story_nodes, local_impacts):
+    '''
+    Returns a dict of ``pk: impact_rating`` for ``(pk, path, depth)`` tuples sorted by path.
+    '''
+    default_impact = (IMPACT_VALUES['base'], 0, 0)
+    pk_by_path = {path: pk for pk, path, depth in story_nodes}
+    depths = {pk: depth for pk, path, depth in story_nodes}
+    parents = {pk: pk_by_path.get(parent_path(path, depth)) for pk, path, depth in story_nodes}
+    down_add = defaultdict(float)
+    down_mile = defaultdict(float)
+    for pk, path, depth in reversed(story_nodes):
+        parent = parents[pk]
+        if parent is not None:
+            base, add, mile = local_impacts.get(pk, default_impact)
+            down_add[parent] += IMPACT_BLEED['tf_beat'] * (add + down_add[pk])
+            down_mile[parent] += IMPACT_BLEED['mile'] * (mile + down_mile[pk])
+    up_add = defaultdict(float)
+    up_mile = defaultdict(float)
+    ratings = {}
+    for pk, path, depth in story_nodes:
+        if depth == 1:
+            ratings[pk] = 0
+            continue
+        parent = parents[pk]
+        if parent is not None and depths[parent] > 1:
+            base, add, mile = local_impacts.get(parent, default_impact)
+            up_add[pk] = IMPACT_BLEED['tf_beat'] * (add + up_add[parent])
+            up_mile[pk] = IMPACT_BLEED['mile'] * (mile + up_mile[parent])
+        base, add, mile = local_impacts.get(pk, default_impact)
+        ratings[pk] = base + add + mile + down_add[pk] + down_mile[pk] + up_add[pk] + up_mile[pk]
+    return ratings
+
+
+def populate_impact_ratings(apps, schema_editor):
+    '''
+    Calculate the stored impact rating for every existing story node.
+    '''
+    StoryElementNode = apps.get_model('fiction_outlines', 'StoryElementNode')
+    ArcElementNode = apps.get_model('fiction_outlines', 'ArcElementNode')
+    Outline = apps.get_model('fiction_outlines', 'Outline')
+    arc_types_by_path = dict(ArcElementNode.objects.values_list('path', 'arc_element_type'))
+    for outline_id in Outline.objects.values_list('pk', flat=True):
+        story_nodes = list(StoryElementNode.objects.filter(outline_id=outline_id).order_by('path').values_list(
+            'pk', 'path', 'depth'))
+        arc_elements = defaultdict(list)
+        for path, depth, arc_element_type, story_node_id in ArcElementNode.objects.filter(
+                story_element_node__outline_id=outline_id).values_list(
+                    'path', 'depth', 'arc_element_type', 'story_element_node_id'):
+            arc_elements[story_node_id].append((arc_element_type, arc_types_by_path.get(parent_path(path, depth))))
+        local_impacts = {pk: local_impact(elements) for pk, elements in arc_elements.items()}
+        ratings = impact_ratings(story_nodes, local_impacts)
+        StoryElementNode.objects.bulk_update(
+            [StoryElementNode(pk=pk, impact_rating=rating) for pk, rating in ratings.items()],
+            ['impact_rating'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fiction_outlines', '0004_auto_20180419_1154'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storyelementnode',
+            name='impact_rating',
+            field=models.FloatField(default=0.5, editable=False,
+                                    help_text='Stored impact rating, kept current by signal receivers.'),
+        ),
+        migrations.RunPython(populate_impact_ratings, migrations.RunPython.noop),
+    ]
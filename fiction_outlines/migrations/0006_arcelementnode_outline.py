@@ -0,0 +1,39 @@
+# Generated by Django 4.0.10 on 2026-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_arc_node_outlines(apps, schema_editor):
+    '''
+    Copy the outline of each arc to its nodes.
+    '''
+    Arc = apps.get_model('fiction_outlines', 'Arc')
+    ArcElementNode = apps.get_model('fiction_outlines', 'ArcElementNode')
+    ArcElementNode.objects.update(
+        outline_id=models.Subquery(Arc.objects.filter(pk=models.OuterRef('arc_id')).values('outline_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fiction_outlines', '0005_storyelementnode_impact_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arcelementnode',
+            name='outline',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    to='fiction_outlines.outline',
+                                    help_text='Outline of the parent arc, kept in sync by signal receivers.'),
+        ),
+        migrations.RunPython(populate_arc_node_outlines, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='arcelementnode',
+            name='outline',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE,
+                                    to='fiction_outlines.outline',
+                                    help_text='Outline of the parent arc, kept in sync by signal receivers.'),
+        ),
+    ]
@@ -1,12 +1,13 @@
 import uuid
 import logging
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from django.db.models.functions import Now
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models, IntegrityError, transaction
-from django.db.models import Q
+from django.db.models import Q, Exists, OuterRef
 from django.conf import settings
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.utils.functional import cached_property
 from model_utils.models import TimeStampedModel as LegacyTimeStampedModel
@@ -15,9 +16,11 @@ from treebeard.mp_tree import MP_Node
 from taggit.managers import TaggableManager
 from taggit.models import GenericUUIDTaggedItemBase, TaggedItemBase
 from .signals import tree_manipulation
+from .nesting import find_conflicting_arcs
+from .managers import OwnedManager, ArcElementNodeManager, StoryElementNodeManager
+from .tracing import traced
 
 logger = logging.getLogger('MS_Models')
-logger.setLevel('DEBUG')
 
 # Create your models here
 
@@ -50,6 +53,55 @@ class TimeStampedModel(LegacyTimeStampedModel):
         abstract = True
 
 
+class DirtyFieldsMixin(models.Model):
+    '''
+    Remembers the values of ``tracked_fields`` (by attname) as they were loaded from the
+    database, so that signal receivers can skip work for fields a save doesn't change.
+    '''
+    tracked_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance._tracked_values()
+        return instance
+
+    def _tracked_values(self, fields=None):
+        '''
+        Returns the current values of the tracked fields that are loaded, limited to ``fields`` if given.
+        '''
+        if fields is not None:
+            fields = {self._meta.get_field(name).attname for name in fields}
+        return {name: self.__dict__[name] for name in self.tracked_fields
+                if name in self.__dict__ and (fields is None or name in fields)}
+
+    def get_loaded_values(self):
+        '''
+        Returns a dict of the tracked fields as they were last loaded or saved. Fields that
+        were deferred, and all fields of an unsaved instance, are missing.
+        '''
+        return dict(getattr(self, '_loaded_values', {}))
+
+    def get_dirty_fields(self):
+        '''
+        Returns the set of tracked fields that have changed since the instance was loaded or
+        saved. Fields without a loaded value always count as changed.
+        '''
+        loaded = self.get_loaded_values()
+        return {name for name in self.tracked_fields if name not in loaded or getattr(self, name) != loaded[name]}
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {**self.get_loaded_values(), **self._tracked_values(kwargs.get('update_fields'))}
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._loaded_values = {**self.get_loaded_values(), **self._tracked_values(fields)}
+
+
 user_relation = settings.AUTH_USER_MODEL
 
 MACE_TYPES = (
@@ -163,6 +215,102 @@ STORY_NODE_ELEMENT_DEFINITIONS = {
     'book': {'allowed_children': ('act', 'part', 'chapter', 'ss'), 'allowed_parents': ('root',)},
 }
 
+IMPACT_VALUES = {
+    'base': 0.5,
+    'mile': 2,
+    'beat': 0.5,
+    'tf': 0.5,
+    'mile_child': 0.5,
+    'same_mile': 2.5,
+}
+
+IMPACT_BLEED = {
+    'mile': 0.5,  # A milestone extends it's influence by 50% per generation
+    'tf_beat': 0.25,
+}
+
+
+def next_root_step(model):
+    '''
+    Returns the step of the first free root path in the model's tree.
+    '''
+    last_root_path = model.objects.filter(depth=1).order_by('-path').values_list('path', flat=True).first()
+    return model._str2int(last_root_path) + 1 if last_root_path else 1
+
+
+def calculate_local_impact(arc_elements):
+    '''
+    Calculates the local impact of a single story node from the arc elements associated with it.
+
+    :param arc_elements: An iterable of ``(arc_element_type, parent_arc_element_type)`` tuples.
+    :returns: A tuple of ``(base_impact, add_impact, mile_impact)``.
+    '''
+    base_impact = IMPACT_VALUES['base']
+    mile_impact = 0
+    add_impact = 0
+    arc_element_types = {}
+    for type_name in ARC_NODE_ELEMENT_DEFINITIONS.keys():
+        arc_element_types[type_name] = 0
+    for arc_element_type, parent_type in arc_elements:
+        arc_element_types[arc_element_type] += 1
+        if ARC_NODE_ELEMENT_DEFINITIONS[arc_element_type]['milestone']:
+            mile_impact += IMPACT_VALUES['mile']
+        else:
+            if parent_type and ARC_NODE_ELEMENT_DEFINITIONS[parent_type]['milestone']:
+                add_impact += IMPACT_VALUES['mile_child']
+            if arc_element_type == 'beat':
+                add_impact += IMPACT_VALUES['beat']
+            if arc_element_type == 'tf':
+                add_impact += IMPACT_VALUES['tf']
+    for key, value in arc_element_types.items():
+        if ARC_NODE_ELEMENT_DEFINITIONS[key]['milestone'] and value > 1:
+            add_impact += (value - 1) * .5
+    return base_impact, add_impact, mile_impact
+
+
+def calculate_impact_ratings(story_nodes, local_impacts, steplen=5):
+    '''
+    Calculates the impact rating of every node in a story tree without touching the database.
+
+    Local impact is pushed up the tree in one bottom-up pass to collect the bleed from descendants,
+    and down the tree in one top-down pass to collect the bleed from ancestors. The result is identical
+    to evaluating :attr:`StoryElementNode.impact_rating` for each node.
+
+    :param story_nodes: An iterable of ``(pk, path, depth)`` tuples sorted by path.
+    :param local_impacts: A dict of ``pk: (base_impact, add_impact, mile_impact)``. Nodes
+        that are missing are assumed to have no associated arc elements.
+    :param steplen: The ``steplen`` of the tree.
+    :returns: A dict of ``pk: impact_rating``.
+    '''
+    nodes = list(story_nodes)
+    default_impact = (IMPACT_VALUES['base'], 0, 0)
+    pk_by_path = {path: pk for pk, path, depth in nodes}
+    depths = {pk: depth for pk, path, depth in nodes}
+    parents = {pk: pk_by_path.get(path[:-steplen]) for pk, path, depth in nodes}
+    down_add = defaultdict(float)
+    down_mile = defaultdict(float)
+    for pk, path, depth in reversed(nodes):
+        parent = parents[pk]
+        if parent is not None:
+            base, add, mile = local_impacts.get(pk, default_impact)
+            down_add[parent] += IMPACT_BLEED['tf_beat'] * (add + down_add[pk])
+            down_mile[parent] += IMPACT_BLEED['mile'] * (mile + down_mile[pk])
+    up_add = defaultdict(float)
+    up_mile = defaultdict(float)
+    ratings = {}
+    for pk, path, depth in nodes:
+        if depth == 1:
+            ratings[pk] = 0
+            continue
+        parent = parents[pk]
+        if parent is not None and depths[parent] > 1:
+            base, add, mile = local_impacts.get(parent, default_impact)
+            up_add[pk] = IMPACT_BLEED['tf_beat'] * (add + up_add[parent])
+            up_mile[pk] = IMPACT_BLEED['mile'] * (mile + up_mile[parent])
+        base, add, mile = local_impacts.get(pk, default_impact)
+        ratings[pk] = (base + add + mile + down_add[pk] + down_mile[pk] + up_add[pk] + up_mile[pk])
+    return ratings
+
 
 class ArcIntegrityError(IntegrityError):
     '''
@@ -244,6 +392,9 @@ class Character(TimeStampedModel):
     user = models.ForeignKey(user_relation, on_delete=models.CASCADE,
                              help_text='The user that created this character.')
 
+    objects = OwnedManager()
+    owner_lookup = 'user'
+
     def __str__(self):
         return self.name
 
@@ -272,12 +423,15 @@ class CharacterInstance(TimeStampedModel):
     outline = models.ForeignKey('Outline', on_delete=models.CASCADE,
                                 help_text='Outline this instance is associated with.')
 
+    objects = OwnedManager()
+    owner_lookup = 'character__user'
+
     def __str__(self):
         return "%s (%s)" % (self.character.name, self.outline.title)
 
     def get_absolute_url(self):
         return reverse_lazy('fiction_outlines:character_instance_detail',
-                            kwargs={'character': self.character.pk, 'instance': self.pk})
+                            kwargs={'character': self.character_id, 'instance': self.pk})
 
     class Meta:
         unique_together = ('outline', 'character')
@@ -294,6 +448,9 @@ class Location(TimeStampedModel):
     tags = TaggableManager(through=UUIDLocationTag, blank=True, help_text='Tags for this location.')
     user = models.ForeignKey(user_relation, on_delete=models.CASCADE, help_text='The user that created this location.')
 
+    objects = OwnedManager()
+    owner_lookup = 'user'
+
     def __str__(self):
         return self.name  # pragma: no cover
 
@@ -310,12 +467,15 @@ class LocationInstance(TimeStampedModel):
     outline = models.ForeignKey('Outline', on_delete=models.CASCADE,
                                 help_text="Outline this object is associated with.")
 
+    objects = OwnedManager()
+    owner_lookup = 'location__user'
+
     def __str__(self):
         return "%s (%s)" % (self.location.name, self.outline.title)
 
     def get_absolute_url(self):
         return reverse_lazy('fiction_outlines:location_instance_detail',
-                            kwargs={'location': self.location.pk, 'instance': self.pk})
+                            kwargs={'location': self.location_id, 'instance': self.pk})
 
     class Meta:
         unique_together = ('location', 'outline')
@@ -332,6 +492,9 @@ class Series (TimeStampedModel):
     tags = TaggableManager(through=UUIDOutlineTag, blank=True, help_text='Tags for the series.')
     user = models.ForeignKey(user_relation, on_delete=models.CASCADE, help_text='The user that created this Series.')
 
+    objects = OwnedManager()
+    owner_lookup = 'user'
+
     def __str__(self):
         return self.title
 
@@ -361,6 +524,9 @@ class Outline (TimeStampedModel):
     user = models.ForeignKey(user_relation, on_delete=models.CASCADE,
                              help_text='The user that created this outline.')
 
+    objects = OwnedManager()
+    owner_lookup = 'user'
+
     def __str__(self):
         return self.title
 
@@ -406,156 +572,250 @@ class Outline (TimeStampedModel):
             except KeyError:  # pragma: no cover
                 pass
 
-    @transaction.atomic
-    def create_arc(self, mace_type, name):
+    def create_arc(self, mace_type, name, template='seven_point'):
         '''
         Creates the story arc and initial tree for that arc
         for the current outline. Returns the resulting Arc
         instance.
         '''
-        arc = Arc(mace_type=mace_type, outline=self, name=name)
-        arc.save()
-        milestone_count = arc.generate_template_arc_tree()
-        if milestone_count == 7:  # pragma: no cover
-            arc.refresh_from_db()
-            return arc
-        else:
-            raise ArcIntegrityError('Something went wrong during arc template generation')  # pragma: no cover
+        return self.create_arcs([(mace_type, name)], template)[0]
 
+    @transaction.atomic
+    def create_arcs(self, arcs, template='seven_point'):
+        '''
+        Creates several story arcs for the current outline at once, each with the initial
+        tree of the template, given by name or as a :class:`fiction_outlines.arc_templates.ArcTemplate`.
+        ``arcs`` is a list of ``(mace_type, name)`` tuples. The arcs and their trees are each
+        written with a single ``bulk_create``. Returns the list of resulting Arc instances.
+        '''
+        arcs = [Arc(mace_type=mace_type, outline=self, name=name) for mace_type, name in arcs]
+        Arc.objects.bulk_create(arcs)
+        for arc in arcs:
+            arc._loaded_values = arc._tracked_values()
+        # The template was validated when it was registered, so every tree built from it is valid.
+        ArcElementNode.create_template_trees(arcs, template)
+        # Bulk inserts send no signals, so the outline is marked as modified here.
+        Outline.objects.filter(pk=self.pk).update(modified=timezone.now())
+        return arcs
+
+    @transaction.atomic
+    def clone(self, title=None):
+        '''
+        Creates a copy of the outline for the same user, with its tags, character and location
+        instances, arcs, and both trees, along with every link between them. The copy uses the
+        same characters, locations, and series. Each table is copied with one query to read it
+        and a bulk insert to write it, and no signals are sent for the copied records.
+
+        Tree paths are copied as they are, except for the first step, which is the position
+        of the tree's root among all the roots of that model.
+
+        Returns the new Outline.
+        '''
+        now = timezone.now()
+        outline = Outline(title=self.title if title is None else title, description=self.description,
+                          series_id=self.series_id, user_id=self.user_id)
+        Outline.objects.bulk_create([outline])
+        UUIDOutlineTag.objects.bulk_create([
+            UUIDOutlineTag(tag_id=tag_id, content_type_id=content_type_id, object_id=outline.pk)
+            for tag_id, content_type_id in UUIDOutlineTag.objects.filter(object_id=self.pk).values_list(
+                'tag_id', 'content_type_id')])
+
+        def copy_records(queryset, **changes):
+            # Returns a dict of the new pk of each copied record by its old pk.
+            records, pks = list(queryset), {}
+            for record in records:
+                old_pk = record.pk
+                record.pk = uuid.uuid4()
+                record.created = now
+                record._state.adding = True
+                for attname, change in changes.items():
+                    setattr(record, attname, change(record) if callable(change) else change)
+                pks[old_pk] = record.pk
+            queryset.model.objects.bulk_create(records)
+            return pks
+
+        character_pks = copy_records(CharacterInstance.objects.filter(outline=self), outline_id=outline.pk)
+        location_pks = copy_records(LocationInstance.objects.filter(outline=self), outline_id=outline.pk)
+        story_root = StoryElementNode._get_path(None, 1, next_root_step(StoryElementNode))
+        story_pks = copy_records(StoryElementNode.objects.filter(outline=self), outline_id=outline.pk,
+                                 path=lambda node: story_root + node.path[StoryElementNode.steplen:])
+        arc_pks = copy_records(Arc.objects.filter(outline=self), outline_id=outline.pk)
+        arc_root_step = next_root_step(ArcElementNode)
+        arc_roots = {}
+        for path in ArcElementNode.objects.filter(outline=self, depth=1).order_by('path').values_list(
+                'path', flat=True):
+            arc_roots[path] = ArcElementNode._get_path(None, 1, arc_root_step + len(arc_roots))
+        arc_node_pks = copy_records(
+            ArcElementNode.objects.filter(outline=self), outline_id=outline.pk,
+            arc_id=lambda node: arc_pks[node.arc_id],
+            story_element_node_id=lambda node: story_pks.get(node.story_element_node_id),
+            path=lambda node: arc_roots[node.path[:ArcElementNode.steplen]] + node.path[ArcElementNode.steplen:])
+
+        for model, node_pks in ((StoryElementNode, story_pks), (ArcElementNode, arc_node_pks)):
+            for field_name, related_pks in (('assoc_characters', character_pks), ('assoc_locations', location_pks)):
+                field = model._meta.get_field(field_name)
+                through = field.remote_field.through
+                source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+                links = through.objects.filter(**{'%s__outline' % source: self}).values_list(
+                    source + '_id', target + '_id')
+                through.objects.bulk_create([
+                    through(**{source + '_id': node_pks[node_pk], target + '_id': related_pks[related_pk]})
+                    for node_pk, related_pk in links])
+        return outline
+
+    @traced('impact')
+    def compute_impact_ratings(self):
+        '''
+        Calculates the impact rating of every node in the outline's story tree
+        using a constant number of queries. Returns a dict of ``{node_pk: rating}``
+        with the same values as :attr:`StoryElementNode.impact_rating`.
+        '''
+        story_nodes = StoryElementNode.objects.filter(outline=self).values_list('pk', 'path', 'depth')
+        arc_nodes = ArcElementNode.objects.filter(outline=self).values_list(
+            'path', 'arc_element_type', 'story_element_node_id')
+        arc_types_by_path = {}
+        linked_arc_nodes = []
+        for path, arc_element_type, story_node_id in arc_nodes:
+            arc_types_by_path[path] = arc_element_type
+            if story_node_id is not None:
+                linked_arc_nodes.append((path, arc_element_type, story_node_id))
+        arc_elements = defaultdict(list)
+        for path, arc_element_type, story_node_id in linked_arc_nodes:
+            parent_type = arc_types_by_path.get(path[:-ArcElementNode.steplen])
+            arc_elements[story_node_id].append((arc_element_type, parent_type))
+        local_impacts = {pk: calculate_local_impact(elements) for pk, elements in arc_elements.items()}
+        return calculate_impact_ratings(story_nodes, local_impacts, steplen=StoryElementNode.steplen)
+
+    def compute_story_tree_instances(self):
+        '''
+        Collects the character and location instances associated with every node in the
+        outline's story tree, including those of each node's descendants, in three queries.
+        Returns a dict of ``{node_pk: {'characters': set, 'locations': set}}`` holding
+        instance pks, matching :attr:`StoryElementNode.all_characters` and
+        :attr:`StoryElementNode.all_locations` for every node.
+        '''
+        story_nodes = list(StoryElementNode.objects.filter(outline=self).order_by('path').values_list('pk', 'path'))
+        instances = {pk: {'characters': set(), 'locations': set()} for pk, path in story_nodes}
+        character_links = StoryElementNode.assoc_characters.through.objects.filter(
+            storyelementnode__outline=self).values_list('storyelementnode_id', 'characterinstance_id')
+        for node_id, instance_id in character_links:
+            instances[node_id]['characters'].add(instance_id)
+        location_links = StoryElementNode.assoc_locations.through.objects.filter(
+            storyelementnode__outline=self).values_list('storyelementnode_id', 'locationinstance_id')
+        for node_id, instance_id in location_links:
+            instances[node_id]['locations'].add(instance_id)
+        # Walk the tree from the bottom up so each node hands its totals to its parent.
+        pks_by_path = {path: pk for pk, path in story_nodes}
+        for pk, path in reversed(story_nodes):
+            parent_pk = pks_by_path.get(path[:-StoryElementNode.steplen])
+            if parent_pk is not None:
+                instances[parent_pk]['characters'] |= instances[pk]['characters']
+                instances[parent_pk]['locations'] |= instances[pk]['locations']
+        return instances
+
+    @traced('impact')
+    def refresh_impact_ratings(self):
+        '''
+        Recalculates the stored impact rating for every node in the story tree, only
+        writing the nodes whose value has changed. Returns the number of updated nodes.
+        '''
+        ratings = self.compute_impact_ratings()
+        stored = StoryElementNode.objects.filter(outline=self).values_list('pk', 'impact_rating')
+        changed = [StoryElementNode(pk=pk, impact_rating=ratings[pk]) for pk, current in stored
+                   if pk in ratings and current != ratings[pk]]
+        if changed:
+            StoryElementNode.objects.bulk_update(changed, ['impact_rating'])
+        return len(changed)
+
+    @traced('nesting')
     def validate_nesting(self):
         '''
         Reviews the story tree and validates associated arc
         elements are nested appropriately. Returns a dict of errors.
+
+        The story tree and its arc elements are fetched in two queries
+        and evaluated in memory.
         '''
         error_dict = {}
-        story_root = self.story_tree_root
-        story_nodes = story_root.get_descendants().prefetch_related('arcelementnode_set').filter(depth=2)
-
-        def parse_children(node_object, seq=0):
-            '''
-            Recursive method to check all generations of a node for arc
-            elements.
-            '''
-            returnable_ae_dict = {}
-            if node_object.get_children_count():
-                for node in node_object.get_children().prefetch_related('arcelementnode_set'):
-                    if node.get_children_count():
-                        local_ae_dict, newseq = parse_children(node, seq)
-                        for arc in local_ae_dict.keys():
-                            if arc not in returnable_ae_dict.keys():
-                                returnable_ae_dict[arc] = []
-                            returnable_ae_dict[arc] = returnable_ae_dict[arc] + (local_ae_dict[arc])
-                        seq = newseq
-                    else:
-                        local_arc_elements = node.arcelementnode_set.all()
-                        for ae in local_arc_elements:
-                            if ae.is_milestone:
-                                logger.debug('Found a milestone to sequence.')
-                                if ae.arc not in returnable_ae_dict.keys():
-                                    returnable_ae_dict[ae.arc] = []
-                                returnable_ae_dict[ae.arc].append({
-                                    ae.arc_element_type: seq,
-                                })
-                                logger.debug('Appended an element of type %s  from arc %s at sequence %d' % (
-                                    ae.arc_element_type,
-                                    ae.arc.name,
-                                    seq))
-                        seq += 1
-            return returnable_ae_dict, seq
+        story_nodes = list(StoryElementNode.objects.filter(outline=self, depth__gt=1).order_by('path'))
+        arc_elements_by_node = defaultdict(list)
+        for story_node_id, arc_id, arc_element_type in ArcElementNode.objects.filter(
+                story_element_node__outline=self).order_by('story_element_node__path', 'path').values_list(
+                    'story_element_node_id', 'arc_id', 'arc_element_type'):
+            arc_elements_by_node[story_node_id].append((arc_id, arc_element_type))
+
+        # Milestones are sequenced by the leaf nodes beneath the top level of the story tree,
+        # in the order they appear in the outline.
+        arc_milestone_elements = OrderedDict()
+        seq = 0
+        for node in story_nodes:
+            if node.depth < 3 or node.numchild:
+                continue
+            for arc_id, arc_element_type in arc_elements_by_node[node.pk]:
+                if ARC_NODE_ELEMENT_DEFINITIONS[arc_element_type]['milestone']:
+                    logger.debug('Appended an element of type %s from arc %s at sequence %d',
+                                 arc_element_type, arc_id, seq)
+                    arc_milestone_elements.setdefault(arc_id, {})[arc_element_type] = seq
+            seq += 1
 
         arcs_out_of_sequence = []
-        arc_milestone_elements = {}
-        x = 0
-        arcs_with_nest_conflicts = []
-        for node in story_nodes:
-            arc_elements_found, x = parse_children(node, x)
-            for arc in arc_elements_found.keys():
-                if arc not in arc_milestone_elements.keys():
-                    arc_milestone_elements[arc] = []
-                arc_milestone_elements[arc] = arc_milestone_elements[arc] + arc_elements_found[arc]
         arc_entry_exit = {}
-        for arc, elements in arc_milestone_elements.items():
-            z = {}
+        for arc_id, milestones in arc_milestone_elements.items():
             last_local_seq = 0
-            logger.debug("There are %d elements to parse" % len(elements))
-            for ae_elements in elements:
-                logger.debug('Parsing %s' % ae_elements)
-                for k, v in ae_elements.items():
-                    z[k] = v
-            logger.debug('%s' % OrderedDict(sorted(z.items(), key=lambda t: t[1])))
-            for key, value in OrderedDict(sorted(z.items(), key=lambda t: t[1])).items():
+            for key, value in sorted(milestones.items(), key=lambda t: t[1]):
                 if last_local_seq > ARC_NODE_ELEMENT_DEFINITIONS[key]['milestone_seq']:
-                    arcs_out_of_sequence.append(arc)
+                    arcs_out_of_sequence.append(arc_id)
                     break
                 last_local_seq = ARC_NODE_ELEMENT_DEFINITIONS[key]['milestone_seq']
-                if 'mile_hook' in z.keys() and 'mile_reso' in z.keys():
-                    arc_entry_exit[arc] = {
-                        'entry': z['mile_hook'],
-                        'exit': z['mile_reso'],
-                    }
-        if arc_entry_exit:
-            temp_ent = {}
-            temp_ex = {}
-            for en_arc, enter in arc_entry_exit.items():
-                temp_ent[en_arc] = enter['entry']
-            for ex_arc, leave in arc_entry_exit.items():
-                temp_ex[ex_arc] = leave['exit']
-            arc_entries = OrderedDict(sorted(temp_ent.items(), key=lambda t: t[1]))
-            arc_exits = OrderedDict(sorted(temp_ex.items(), key=lambda t: t[1], reverse=True))
-            logger.debug("Evaluating entries vs exits: %s vs %s" % (arc_entries, arc_exits))
-            index_num = 0
-            for entrance in arc_entries.keys():
-                test_exit = list(arc_exits.keys())[index_num]
-                logger.debug('Checking %s vs %s arcs' % (entrance, test_exit))
-                if entrance != test_exit:
-                    logger.debug("Different arcs.. making sure they don't share an entry/exist point")
-                    if (arc_entry_exit[entrance]['entry'] != arc_entry_exit[test_exit]['entry'] and
-                        arc_entry_exit[entrance]['exit'] != arc_entry_exit[test_exit]['exit']):
-                        if ((arc_entry_exit[entrance]['entry'] < arc_entry_exit[test_exit]['entry'] and
-                                arc_entry_exit[entrance]['exit'] > arc_entry_exit[test_exit]['exit']) or
-                            (arc_entry_exit[entrance]['entry'] > arc_entry_exit[test_exit]['entry'] and
-                             arc_entry_exit[entrance]['exit'] < arc_entry_exit[test_exit]['exit'])):
-                            logger.debug("No same entry point, but the nest is still valid.")
-                        else:
-                            logger.debug("nesting error found: %s should resole before %s" % (entrance, test_exit))
-                            if entrance not in arcs_with_nest_conflicts:
-                                arcs_with_nest_conflicts.append(entrance)
-                            if test_exit not in arcs_with_nest_conflicts:
-                                arcs_with_nest_conflicts.append(test_exit)
-                    else:
-                        logger.debug('Arcs share an entry/exit point so nesting error is ignored.')
-                index_num += 1
-        unique_nest_errors = list(set(arcs_with_nest_conflicts))
-        logger.debug("%d arcs with nesting errors found" % len(unique_nest_errors))
-        logger.debug('Arcs with nesting errors: %s' % unique_nest_errors)
-        story_tree = story_root.get_descendants().prefetch_related('arcelementnode_set')
+            if 'mile_hook' in milestones and 'mile_reso' in milestones:
+                arc_entry_exit[arc_id] = (milestones['mile_hook'], milestones['mile_reso'])
+
+        arcs_with_nest_conflicts = find_conflicting_arcs(arc_entry_exit)
+        logger.debug('%d arcs with nesting errors found', len(arcs_with_nest_conflicts))
+
+        def nodes_with_elements(arc_ids, arc_element_type=None):
+            '''
+            Returns the story nodes, in tree order, linked to elements of the given arcs.
+            '''
+            return [node for node in story_nodes if any(
+                arc_id in arc_ids and (arc_element_type is None or element_type == arc_element_type)
+                for arc_id, element_type in arc_elements_by_node[node.pk])]
+
         if arcs_out_of_sequence:
+            logger.debug('There are %d arcs out of internal sequence', len(arcs_out_of_sequence))
             error_dict['nest_arc_seq'] = {
                 'error_message': "Arc element milestones are out of sequence",
-                'offending_arcs': []
+                'offending_arcs': [{'offending_nodes': nodes_with_elements({arc_id})}
+                                   for arc_id in arcs_out_of_sequence],
             }
-            logger.debug('There are %d arcs out of internal sequence' % len(arcs_out_of_sequence))
-            arc_sequence_error_dict = {}
-            story_root.refresh_from_db()
-            for arc in arcs_out_of_sequence:
-                arc_sequence_error_dict['offending_nodes'] = story_tree.filter(arcelementnode__arc=arc)
-            error_dict['nest_arc_seq']['offending_arcs'].append(arc_sequence_error_dict)
-        if unique_nest_errors:
+        if arcs_with_nest_conflicts:
             error_dict['nest_reso_error'] = {
                 'error_message': "Arcs should resolve in the opposite order that they were introduced",
-                'offending_nodes': story_tree.filter(
-                    arcelementnode__arc__in=unique_nest_errors,
-                    arcelementnode__arc_element_type='mile_reso'
-                )
+                'offending_nodes': nodes_with_elements(set(arcs_with_nest_conflicts), 'mile_reso'),
             }
         return error_dict
 
+    @traced('arc_validation')
+    def validate_all_arcs(self):
+        '''
+        Validates every arc in the outline from a single query. Returns a dict of
+        error lists, as provided by :meth:`Arc.fetch_arc_errors`, keyed by arc pk.
+        '''
+        arcs = {}
+        nodes_by_arc = defaultdict(list)
+        for node in ArcElementNode.objects.filter(outline=self).select_related('arc').order_by('path'):
+            arc = arcs.setdefault(node.arc_id, node.arc)
+            node.arc = arc
+            nodes_by_arc[arc.pk].append(node)
+        return {arc_id: arcs[arc_id].fetch_arc_errors(nodes) for arc_id, nodes in nodes_by_arc.items()}
+
 
-class Arc (TimeStampedModel):
+class Arc (DirtyFieldsMixin, TimeStampedModel):
     '''
     A MACE arc for a outline.
     '''
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tracked_fields = ('outline_id',)
     mace_type = models.CharField(max_length=10, choices=MACE_TYPES, db_index=True,
                                  help_text='The MACE type of the Arc.')
     outline = models.ForeignKey("Outline", on_delete=models.CASCADE,
@@ -563,11 +823,14 @@ class Arc (TimeStampedModel):
     name = models.CharField(max_length=255, db_index=True,
                             help_text="Name of this Arc (makes it easier for you to keep track of it.)")
 
+    objects = OwnedManager()
+    owner_lookup = 'outline__user'
+
     def __str__(self):
         return "%s (%s)" % (self.name, self.outline.title)
 
     def get_absolute_url(self):
-        return reverse_lazy('fiction_outlines:arc_detail', kwargs={'outline': self.outline.pk, 'arc': self.pk})
+        return reverse_lazy('fiction_outlines:arc_detail', kwargs={'outline': self.outline_id, 'arc': self.pk})
 
     @cached_property
     def current_errors(self):
@@ -599,86 +862,101 @@ class Arc (TimeStampedModel):
                 pass
 
     @transaction.atomic
-    def generate_template_arc_tree(self):
-        '''
-        Generate a seven point template in this arc. Arc must be empty.
-        '''
-        arc_root = self.arc_root_node
-        if not arc_root:
-            arc_root = ArcElementNode.add_root(
-                arc_element_type='root',
-                description='root of arc %s' % self.name,
-                arc=self
-            )
-        if arc_root.get_children():
-            raise ArcIntegrityError(_("This arc already has elements. You cannot build a template on top of it"))
-        for key, value in ARC_NODE_ELEMENT_DEFINITIONS.items():
-            if value['milestone']:
-                arc_root.add_child(arc_element_type=key, description=value['template_description'])
-                arc_root.refresh_from_db()
-        return ArcElementNode.objects.get(pk=arc_root.pk).get_children().count()
+    def generate_template_arc_tree(self, template='seven_point'):
+        '''
+        Generate a template in this arc, by default the seven point template. Arc must be empty.
+        Returns the number of elements directly beneath the root.
+        '''
+        nodes = ArcElementNode.create_template_trees([self], template)
+        self.refresh_from_db()
+        return len([node for node in nodes if node.depth == 2])
 
-    def fetch_arc_errors(self):
+    def fetch_arc_nodes(self):
+        '''
+        Returns the full ArcElementNode tree of this arc, including the root, as a list in tree order.
+        '''
+        nodes = list(ArcElementNode.objects.filter(arc=self).order_by('path'))
+        for node in nodes:
+            node.arc = self
+        return nodes
+
+    @traced('arc_validation')
+    def fetch_arc_errors(self, nodes=None):
         '''
         Evaluates the current tree of the arc and provides a list of errors that
-        the user should correct.
+        the user should correct. The tree is fetched in a single query unless
+        ``nodes`` is supplied, as returned by :meth:`fetch_arc_nodes`.
         '''
+        if nodes is None:
+            nodes = self.fetch_arc_nodes()
         error_list = []
-        hnode = self.validate_first_element()
+        hnode = self.validate_first_element(nodes)
         if hnode:
             error_list.append({'hook_error': hnode})
-        rnode = self.validate_last_element()
+        rnode = self.validate_last_element(nodes)
         if rnode:
             error_list.append({'reso_error': rnode})
         try:
-            self.validate_generations()
+            self.validate_generations(nodes)
         except ArcGenerationError as ag:
             error_list.append({'generation_error': str(ag)})
-        milecheck = self.validate_milestones()
+        milecheck = self.validate_milestones(nodes)
         if milecheck:
             error_list.append({'mseq_error': milecheck})
         return error_list
 
-    def validate_first_element(self):
+    def _root_children(self, nodes):
+        '''
+        Returns the direct descendants of the arc root from a list of arc nodes.
+        '''
+        if nodes is None:
+            nodes = self.fetch_arc_nodes()
+        return [node for node in nodes if node.depth == 2]
+
+    def validate_first_element(self, nodes=None):
         '''
         Ensures that the first node for the direct decendents of root is the hook.
         '''
-        first_child = self.arc_root_node.get_first_child()
-        if first_child.arc_element_type == 'mile_hook':
+        children = self._root_children(nodes)
+        if not children or children[0].arc_element_type == 'mile_hook':
             return None
-        return first_child
+        return children[0]
 
-    def validate_last_element(self):
+    def validate_last_element(self, nodes=None):
         '''
         Ensures that the last element of the arc is the resolution.
         '''
-        last_child = self.arc_root_node.get_last_child()
-        if last_child.arc_element_type == 'mile_reso':
+        children = self._root_children(nodes)
+        if not children or children[-1].arc_element_type == 'mile_reso':
             return None
-        return last_child
+        return children[-1]
 
-    def validate_generations(self):
+    def validate_generations(self, nodes=None):
         '''
         Make sure that the descendent depth is valid.
         '''
-        nodes = self.arc_root_node.get_descendants()
+        if nodes is None:
+            nodes = self.fetch_arc_nodes()
+        nodes_by_path = {node.path: node for node in nodes}
         for node in nodes:
-            logger.debug("Checking parent for node of type %s" % node.arc_element_type)
-            parent = ArcElementNode.objects.get(pk=node.pk).get_parent(update=True)
-            if 'mile' in node.arc_element_type and parent.get_depth() > 1:
+            if node.depth < 2:
+                continue
+            logger.debug('Checking parent for node of type %s', node.arc_element_type)
+            parent = nodes_by_path[node.path[:-node.steplen]]
+            if 'mile' in node.arc_element_type and parent.depth > 1:
                 logger.debug("Milestone node... with leaf parent")
                 raise ArcGenerationError(_("Milestones cannot be descendants of anything besides the root!"))
-            if (parent.get_depth() > 1 and
+            if (parent.depth > 1 and
                 parent.arc_element_type not in ARC_NODE_ELEMENT_DEFINITIONS[node.arc_element_type]['allowed_parents']):
                 raise ArcGenerationError(_("Node %s cannot be a descendant of node %s" % (node, parent)))
         return None
 
-    def validate_milestones(self):
+    def validate_milestones(self, nodes=None):
         '''
         Reviews the arc element tree to ensure that milestones appear in the right
         order.
         '''
-        milestones = self.arc_root_node.get_children().filter(arc_element_type__contains='mile')
+        milestones = [node for node in self._root_children(nodes) if 'mile' in node.arc_element_type]
         current_cursor = 0
         for mile in milestones:
             seq = mile.milestone_seq
@@ -688,16 +966,19 @@ class Arc (TimeStampedModel):
         return None
 
 
-class ArcElementNode(TimeStampedModel, MP_Node):
+class ArcElementNode(DirtyFieldsMixin, TimeStampedModel, MP_Node):
     '''
     Tree nodes for the arc elements.
     '''
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     steplen = 5
+    tracked_fields = ('arc_element_type', 'description', 'story_element_node_id', 'arc_id')
     arc_element_type = models.CharField(max_length=15, db_index=True, choices=ARC_NODE_TYPES_CHOICES,
                                         help_text='What part of the arc does this represent?')
     arc = models.ForeignKey(Arc, on_delete=models.CASCADE, help_text='Parent arc.')
+    outline = models.ForeignKey(Outline, on_delete=models.CASCADE, editable=False,
+                                help_text='Outline of the parent arc, kept in sync by signal receivers.')
     headline = models.CharField(max_length=255, blank=True, null=True, help_text=_('Autogenerated from description'))
     description = models.TextField(help_text='Describe what happens at this moment in the story...')
     story_element_node = models.ForeignKey('StoryElementNode', on_delete=models.SET_NULL, blank=True, null=True,
@@ -709,12 +990,15 @@ class ArcElementNode(TimeStampedModel, MP_Node):
                                              help_text='M2M relation with location instances.',
                                              verbose_name='Associated Locations')
 
+    objects = ArcElementNodeManager()
+    owner_lookup = 'outline__user'
+
     def __str__(self):
         return "[%s: %s]" % (self.arc.name, self.get_arc_element_type_display())
 
     def get_absolute_url(self):
         return reverse_lazy('fiction_outlines:arcnode_detail',
-                            kwargs={'outline': self.parent_outline.pk, 'arc': self.arc.pk, 'arcnode': self.pk})
+                            kwargs={'outline': self.outline_id, 'arc': self.arc_id, 'arcnode': self.pk})
 
     @property
     def milestone_seq(self):
@@ -735,7 +1019,89 @@ class ArcElementNode(TimeStampedModel, MP_Node):
         '''
         Private method to fetch parent outline.
         '''
-        return self.arc.outline
+        return self.outline
+
+    @classmethod
+    def propagate_characters_and_locations(cls, arc_node_ids, fields=('assoc_characters', 'assoc_locations')):
+        '''
+        Adds the characters and locations of the given arc elements to their story nodes where
+        they are missing. The missing links are found with one query per field and inserted
+        in bulk, so no ``m2m_changed`` signals are sent for them. Returns the number of links added.
+
+        :raises: :class:`django.db.IntegrityError` if any of the links would cross outlines.
+        '''
+        added = 0
+        for field_name in fields:
+            arc_field = cls._meta.get_field(field_name)
+            story_field = StoryElementNode._meta.get_field(field_name)
+            arc_through = arc_field.remote_field.through
+            story_through = story_field.remote_field.through
+            arc_node, related = arc_field.m2m_field_name(), arc_field.m2m_reverse_field_name()
+            story_node = story_field.m2m_field_name()
+            linked = story_through.objects.filter(**{
+                story_node: OuterRef('%s__story_element_node' % arc_node),
+                related: OuterRef(related),
+            })
+            missing = set(arc_through.objects.filter(**{
+                '%s__in' % arc_node: arc_node_ids,
+                '%s__story_element_node__isnull' % arc_node: False,
+            }).exclude(Exists(linked)).values_list(
+                '%s__story_element_node' % arc_node, related,
+                '%s__story_element_node__outline' % arc_node, '%s__outline' % related))
+            crossing = sorted(str(related_pk) for story_pk, related_pk, story_outline, related_outline in missing
+                              if story_outline != related_outline)
+            if crossing:
+                raise IntegrityError(_('%s must be from the same outline as story node. Offending records: %s' % (
+                    story_field.verbose_name, ', '.join(crossing))))
+            story_through.objects.bulk_create([
+                story_through(**{story_node + '_id': story_pk, related + '_id': related_pk})
+                for story_pk, related_pk, story_outline, related_outline in missing
+            ], ignore_conflicts=True)
+            added += len(missing)
+        return added
+
+    @classmethod
+    def create_template_trees(cls, arcs, template='seven_point'):
+        '''
+        Adds the elements of an arc template to each of the given saved arcs, along with the
+        root of the arc's tree if it doesn't have one yet. ``template`` is the name of a
+        template in :mod:`fiction_outlines.arc_templates`, or the template itself. The template's
+        paths are compiled in advance, and the nodes for every arc are inserted with a single
+        ``bulk_create``, so no signals are sent for them. Returns the created nodes.
+
+        :raises: :class:`ArcIntegrityError` if any of the arcs already has elements.
+        '''
+        # The templates are compiled from these models, so the library can only be imported once they are defined.
+        from .arc_templates import get_arc_template
+        if isinstance(template, str):
+            template = get_arc_template(template)
+        roots = {root.arc_id: root for root in cls.objects.filter(arc__in=arcs, depth=1)}
+        if any(not root.is_leaf() for root in roots.values()):
+            raise ArcIntegrityError(_("This arc already has elements. You cannot build a template on top of it"))
+        elements = [(path, depth, numchild, arc_element_type, str(description))
+                    for path, depth, numchild, arc_element_type, description in template.batch]
+        root_step = None
+        created = []
+        for arc in arcs:
+            root = roots.get(arc.pk)
+            if root is None:
+                if root_step is None:
+                    root_step = next_root_step(cls)
+                description = 'root of arc %s' % arc.name
+                root = cls(arc=arc, outline_id=arc.outline_id, arc_element_type='root', description=description,
+                           path=cls._get_path(None, 1, root_step), depth=1)
+                root_step += 1
+                created.append(root)
+            root.numchild = template.root_numchild
+            for path, depth, numchild, arc_element_type, description in elements:
+                created.append(cls(arc=arc, outline_id=arc.outline_id, arc_element_type=arc_element_type,
+                                   description=description, path=root.path + path, depth=depth, numchild=numchild))
+        cls.objects.bulk_create(created)
+        if roots:
+            cls.objects.bulk_update(list(roots.values()), ['numchild'])
+        for node in created:
+            node._loaded_values = node._tracked_values()
+        return created
 
     def add_child(self, arc_element_type, description=None, story_element_node=None, **kwargs):
         '''
@@ -777,16 +1143,40 @@ class ArcElementNode(TimeStampedModel, MP_Node):
             story_element_node=story_element_node
         )
 
+    def move(self, target, pos=None):
+        '''
+        An override of the treebeard api in order to send signals around the move.
+        '''
+        tree_manipulation.send(
+            sender=self.__class__,
+            instance=self,
+            action='move',
+            target_node_type=None,
+            target_node=target,
+            pos=pos
+        )
+        result = super().move(target, pos)
+        tree_manipulation.send(
+            sender=self.__class__,
+            instance=self,
+            action='post_move',
+            target_node_type=None,
+            target_node=target,
+            pos=pos
+        )
+        return result
+
 
 ArcElementNode._meta.get_field('path').max_length = 1024
 
 
-class StoryElementNode(TimeStampedModel, MP_Node):
+class StoryElementNode(DirtyFieldsMixin, TimeStampedModel, MP_Node):
     '''
     Tree nodes for the overall outline of the story.
     '''
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     steplen = 5
+    tracked_fields = ('story_element_type',)
     name = models.CharField(max_length=255, null=True, blank=True,
                             help_text='Optional name/title for this element of the story.')
     description = models.TextField(null=True, blank=True,
@@ -805,12 +1195,17 @@ class StoryElementNode(TimeStampedModel, MP_Node):
     assoc_locations = models.ManyToManyField(LocationInstance, blank=True,
                                              help_text='Location instances associated with this node.',
                                              verbose_name='Associated Locations')
+    impact_rating = models.FloatField(default=IMPACT_VALUES['base'], editable=False,
+                                      help_text='Stored impact rating, kept current by signal receivers.')
+
+    objects = StoryElementNodeManager()
+    owner_lookup = 'outline__user'
 
     def __str__(self):
         return "[%s : %s] %s" % (self.outline.title, self.get_story_element_type_display(), self.name)
 
     def get_absolute_url(self):
-        return reverse_lazy('fiction_outlines:storynode_detail', kwargs={'outline': self.outline.pk,
+        return reverse_lazy('fiction_outlines:storynode_detail', kwargs={'outline': self.outline_id,
                                                                          'storynode': self.pk})
 
     @property
@@ -819,16 +1214,13 @@ class StoryElementNode(TimeStampedModel, MP_Node):
         Returns a queryset of all characters associated with this node and its descendants,
         excluding any duplicates.
         '''
-        qs = self.assoc_characters.all()
-        for node in self.get_descendants():
-            qs2 = node.assoc_characters.all()
-            qs = qs.union(qs2)
-        return qs
+        return CharacterInstance.objects.filter(
+            storyelementnode__path__startswith=self.path).select_related('character').distinct()
 
-    @property
-    def impact_rating(self):
+    @traced('impact')
+    def calculate_impact_rating(self):
         '''
-        Returns the impact rating for this node. Impact rating is a measure
+        Calculates the impact rating for this node. Impact rating is a measure
         of how powerful this moment in the story is by evaluting how many simultaneous
         arc elements are associated with it. There is also a generational bleed element,
         where the impact score creates shockwaves throughout their direct ancestor and
@@ -837,44 +1229,45 @@ class StoryElementNode(TimeStampedModel, MP_Node):
 
         Currently, the impact bleed does not extend to sibling nodes.
 
+        This walks the related nodes one query at a time. Use the stored ``impact_rating``
+        field for reads, which is kept current by :meth:`refresh_impact_ratings`.
+
         WARNING: Here be dragons.
         '''
         if self.depth == 1:
             logger.debug('Root node. Skipping.')
             return 0  # pragma: no cover
-        impact_bleed = {
-            'mile': 0.5,  # A milestone extends it's influence by 50% per generation
-            'tf_beat': 0.25,
-        }
+        impact_bleed = IMPACT_BLEED
         inherited_impact = 0
         base_impact, add_impact, mile_impact = self._local_impact_rating()
         local_impact = base_impact + add_impact + mile_impact
-        logger.debug("Local impact is %f" % local_impact)
+        logger.debug('Local impact is %f', local_impact)
         parents = self.get_ancestors().filter(depth__gt=1)
         children = self.get_descendants()
-        logger.debug('Found %d parents and %d children' % (parents.count(), children.count()))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Found %d parents and %d children', parents.count(), children.count())
         for node in parents | children:
             if node.depth == 1:
                 logger.debug("Skipping root node...")
             else:
                 logger.debug('Checking a related node...')
                 b, a, m = node._local_impact_rating()
-                logger.debug('Related node has %f of additional impact and %f of milestone impact.' % (a, m))
+                logger.debug('Related node has %f of additional impact and %f of milestone impact.', a, m)
                 if (a + m) > 0:
                     if node.depth > self.depth:
                         depth_diff = node.depth - self.depth
                     else:
                         depth_diff = self.depth - node.depth
-                    logger.debug('There is a generational difference of %f. Adjusting impact bleed.' % depth_diff)
+                    logger.debug('There is a generational difference of %f. Adjusting impact bleed.', depth_diff)
                     for x in range(depth_diff):
                         a = a * impact_bleed['tf_beat']
                         m = m * impact_bleed['mile']
-                    logger.debug('Additional impact bleed of %f. Milestone impact bleed of %f' % (a, m))
+                    logger.debug('Additional impact bleed of %f. Milestone impact bleed of %f', a, m)
                     inherited_impact += a + m
-                    logger.debug('Final impact bleed of %f. Adding to inherited impact.' % inherited_impact)
+                    logger.debug('Final impact bleed of %f. Adding to inherited impact.', inherited_impact)
                 else:
                     logger.debug('Node had 0 bleedworthy impact. Skipping...')
-        logger.debug('Inherited impact of %f. Adding to local impact of %f' % (inherited_impact, local_impact))
+        logger.debug('Inherited impact of %f. Adding to local impact of %f', inherited_impact, local_impact)
         return local_impact + inherited_impact
 
     def _local_impact_rating(self):
@@ -882,33 +1275,27 @@ class StoryElementNode(TimeStampedModel, MP_Node):
         Traverses the generations to evaluate the impact/power
         of the arc elements associated with each node.
         '''
-        impact_values = {
-            'base': 0.5,
-            'mile': 2,
-            'beat': 0.5,
-            'tf': 0.5,
-            'mile_child': 0.5,
-            'same_mile': 2.5,
-        }
+        impact_values = IMPACT_VALUES
         base_impact = impact_values['base']
         mile_impact = 0
         add_impact = 0
         direct_arc_nodes = self.arcelementnode_set.all()
-        logger.debug('Found %d associated arc nodes...' % direct_arc_nodes.count())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Found %d associated arc nodes...', direct_arc_nodes.count())
         arc_element_types = {}
         logger.debug('Preloading arc element types...')
         for type_name, values in ARC_NODE_ELEMENT_DEFINITIONS.items():
             arc_element_types[type_name] = 0
         for node in direct_arc_nodes:
             arc_element_types[node.arc_element_type] += 1
-            logger.debug('Found an node of type %s' % node.arc_element_type)
+            logger.debug('Found an node of type %s', node.arc_element_type)
             if ARC_NODE_ELEMENT_DEFINITIONS[node.arc_element_type]['milestone']:
-                logger.debug('node is a milestone of type %s. Adding bonus' % node.arc_element_type)
+                logger.debug('node is a milestone of type %s. Adding bonus', node.arc_element_type)
                 mile_impact += impact_values['mile']
             else:
                 logger.debug('Checking node parent.')
                 parent_type = node.get_parent().arc_element_type
-                logger.debug('Direct parent is of type %s' % parent_type)
+                logger.debug('Direct parent is of type %s', parent_type)
                 if ARC_NODE_ELEMENT_DEFINITIONS[node.get_parent().arc_element_type]['milestone']:
                     logger.debug('Impact calc: adding a bonus for being direct child of milestone.')
                     add_impact += impact_values['mile_child']
@@ -923,17 +1310,54 @@ class StoryElementNode(TimeStampedModel, MP_Node):
                 add_impact += (value - 1) * .5
         return base_impact, add_impact, mile_impact
 
+    @classmethod
+    @traced('impact')
+    def refresh_impact_ratings(cls, node_ids):
+        '''
+        Recalculates the stored impact rating for the given nodes, their ancestors, and their
+        descendants. Only the top-level branches containing those nodes are read, and only
+        the nodes on the affected ancestor/descendant paths are written. Returns the number
+        of updated nodes.
+        '''
+        seed_paths = list(cls.objects.filter(pk__in=node_ids).values_list('path', flat=True))
+        if not seed_paths:
+            return 0
+        # Ratings never bleed across the children of the root, so the top-level branch is all we need.
+        branch_filter = Q()
+        arc_filter = Q()
+        for prefix in {path[:cls.steplen * 2] for path in seed_paths}:
+            branch_filter |= Q(path__startswith=prefix)
+            arc_filter |= Q(story_element_node__path__startswith=prefix)
+        branch = list(cls.objects.filter(branch_filter).values_list('pk', 'path', 'depth', 'impact_rating'))
+        linked_arc_nodes = list(ArcElementNode.objects.filter(arc_filter).values_list(
+            'path', 'arc_element_type', 'story_element_node_id'))
+        parent_paths = {arc_path[:-ArcElementNode.steplen] for arc_path, arc_type, story_id in linked_arc_nodes}
+        parent_types = dict(ArcElementNode.objects.filter(path__in=parent_paths).values_list(
+            'path', 'arc_element_type'))
+        arc_elements = defaultdict(list)
+        for path, arc_element_type, story_node_id in linked_arc_nodes:
+            arc_elements[story_node_id].append((arc_element_type, parent_types.get(path[:-ArcElementNode.steplen])))
+        local_impacts = {pk: calculate_local_impact(elements) for pk, elements in arc_elements.items()}
+        ratings = calculate_impact_ratings([(pk, path, depth) for pk, path, depth, c in branch],
+                                           local_impacts, steplen=cls.steplen)
+        changed = []
+        for pk, path, depth, current in branch:
+            affected = any(path.startswith(seed) or seed.startswith(path) for seed in seed_paths)
+            if affected and current != ratings[pk]:
+                changed.append(cls(pk=pk, impact_rating=ratings[pk]))
+        if changed:
+            cls.objects.bulk_update(changed, ['impact_rating'])
+        logger.debug('Refreshed impact ratings for %d nodes', len(changed))
+        return len(changed)
+
     @property
     def all_locations(self):
         '''
         Returns a queryset of all locations associated with this node and its descendants,
         excluding any duplicates.
         '''
-        qs = self.assoc_locations.all()
-        for node in self.get_descendants():
-            qs2 = node.assoc_locations.all()
-            qs = qs.union(qs2)
-        return qs
+        return LocationInstance.objects.filter(
+            storyelementnode__path__startswith=self.path).select_related('location').distinct()
 
     def move(self, target, pos=None):
         '''
@@ -949,7 +1373,16 @@ class StoryElementNode(TimeStampedModel, MP_Node):
             target_node=target,
             pos=pos
         )
-        return super().move(target, pos)
+        result = super().move(target, pos)
+        tree_manipulation.send(
+            sender=self.__class__,
+            instance=self,
+            action='post_move',
+            target_node_type=None,
+            target_node=target,
+            pos=pos
+        )
+        return result
 
     def add_child(self, story_element_type=None, outline=None, name=None, description=None, **kwargs):
         '''
@@ -967,13 +1400,22 @@ class StoryElementNode(TimeStampedModel, MP_Node):
             target_node=None,
             pos=None
         )
-        return super().add_child(
+        new_node = super().add_child(
             story_element_type=story_element_type,
             outline=outline,
             name=name,
             description=description,
             **kwargs
         )
+        tree_manipulation.send(
+            sender=self.__class__,
+            instance=self,
+            action='post_add_child',
+            target_node_type=story_element_type,
+            target_node=new_node,
+            pos=None
+        )
+        return new_node
 
     def add_sibling(self, story_element_type=None, outline=None, name=None, description=None, pos=None, **kwargs):
         '''
@@ -991,7 +1433,7 @@ class StoryElementNode(TimeStampedModel, MP_Node):
             target_node=None,
             pos=pos
         )
-        return super().add_sibling(
+        new_node = super().add_sibling(
             story_element_type=story_element_type,
             outline=outline,
             name=name,
@@ -999,6 +1441,15 @@ class StoryElementNode(TimeStampedModel, MP_Node):
             pos=pos,
             **kwargs
         )
+        tree_manipulation.send(
+            sender=self.__class__,
+            instance=self,
+            action='post_add_sibling',
+            target_node_type=story_element_type,
+            target_node=new_node,
+            pos=pos
+        )
+        return new_node
 
 
 StoryElementNode._meta.get_field('path').max_length = 1024
@@ -0,0 +1,121 @@
+'''
+Analysis of how arcs nest within a story.
+
+Arcs are described as intervals of ``(entry, exit)`` sequence numbers, i.e. the
+position of their hook and resolution milestones in the story tree. Nothing in
+here touches the database, so it can be used on synthetic data as easily as on
+an outline.
+
+Arcs should resolve in the opposite order that they were introduced. A pair of
+arcs is in conflict when the arc introduced first also resolves first. Arcs that
+share an entry or exit point are never in conflict with each other.
+'''
+
+
+def _sorted_by_entry(intervals):
+    '''
+    Returns the interval items sorted by entry, then exit.
+    '''
+    return sorted(intervals.items(), key=lambda t: t[1])
+
+
+def find_conflicting_arcs(intervals):
+    '''
+    Takes a dict mapping arc keys to ``(entry, exit)`` tuples and returns a list
+    of the keys for every arc involved in at least one conflict, ordered by entry.
+
+    Runs in O(n log n).
+    '''
+    items = _sorted_by_entry(intervals)
+    count = len(items)
+    # Lowest exit among arcs with a strictly earlier entry, and highest exit among
+    # arcs with a strictly later entry.
+    earlier_min_exit = [None] * count
+    later_max_exit = [None] * count
+    running, group_start = None, 0
+    for index in range(count):
+        if items[index][1][0] != items[group_start][1][0]:
+            for member in range(group_start, index):
+                running = _min(running, items[member][1][1])
+            group_start = index
+        earlier_min_exit[index] = running
+    running, group_end = None, count - 1
+    for index in range(count - 1, -1, -1):
+        if items[index][1][0] != items[group_end][1][0]:
+            for member in range(group_end, index, -1):
+                running = _max(running, items[member][1][1])
+            group_end = index
+        later_max_exit[index] = running
+    conflicting = []
+    for index, (key, (entry, exit)) in enumerate(items):
+        if ((earlier_min_exit[index] is not None and earlier_min_exit[index] < exit) or
+                (later_max_exit[index] is not None and later_max_exit[index] > exit)):
+            conflicting.append(key)
+    return conflicting
+
+
+def find_conflicting_pairs(intervals):
+    '''
+    Takes a dict mapping arc keys to ``(entry, exit)`` tuples and returns a list
+    of ``(first, second)`` key tuples for every pair of arcs in conflict, where
+    ``first`` is the arc introduced earlier. Pairs are ordered by their first arc,
+    then their second, with arcs ordered by entry, then exit.
+
+    Runs in O(n log n + k log n), where k is the number of pairs reported.
+    '''
+    items = _sorted_by_entry(intervals)
+    count = len(items)
+    size = 1
+    while size < count:
+        size *= 2
+    # A segment tree of the highest exit in each run of arcs, in entry order. Leaf i is items[i].
+    highest_exit = [None] * (2 * size)
+    for index, (_, (_, exit)) in enumerate(items):
+        highest_exit[size + index] = exit
+    for node in range(size - 1, 0, -1):
+        # Unused leaves are all on the right, so a right child without an exit defers to the left.
+        left, right = highest_exit[2 * node], highest_exit[2 * node + 1]
+        highest_exit[node] = left if right is None else _max(left, right)
+    pairs = []
+    group_end = 0
+    for index, (key, (entry, exit)) in enumerate(items):
+        if index == group_end:
+            while group_end < count and items[group_end][1][0] == entry:
+                group_end += 1
+        for later in _later_exits(highest_exit, size, group_end, exit):
+            pairs.append((key, items[later][0]))
+    return pairs
+
+
+def _later_exits(highest_exit, size, start, exit):
+    '''
+    Yields, in order, the leaves from ``start`` onwards whose exit is later than ``exit``,
+    skipping every subtree without one.
+    '''
+    # The subtrees that exactly cover the leaves from start to the end, from left to right.
+    roots = []
+    low, high = start + size, 2 * size
+    while low < high:
+        if low & 1:
+            roots.append(low)
+            low += 1
+        low //= 2
+        high //= 2
+    stack = roots[::-1]
+    while stack:
+        node = stack.pop()
+        if highest_exit[node] is None or highest_exit[node] <= exit:
+            continue
+        if node >= size:
+            yield node - size
+        else:
+            stack.append(2 * node + 1)
+            stack.append(2 * node)
+
+
+def _min(current, value):
+    return value if current is None or value < current else current
+
+
+def _max(current, value):
+    return value if current is None or value > current else current
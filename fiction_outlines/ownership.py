@@ -0,0 +1,149 @@
+'''
+Resolves the user that owns an object, for use by the permission predicates in
+:mod:`fiction_outlines.rules`.
+
+Owners are found through ``*_id`` columns rather than by loading each related object,
+and are remembered for the duration of a request when
+:class:`OwnershipCacheMiddleware` is installed. Before checking permissions over many
+objects, call :func:`prime` to resolve all of their owners with at most one query
+per model.
+'''
+
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .models import Outline, Series, Character, Location, Arc, ArcElementNode, StoryElementNode
+from .models import CharacterInstance, LocationInstance
+
+# Models that belong to a user through another model, as ``(parent field, parent model)``. The owner
+# itself is found through each model's ``owner_lookup``.
+OWNER_PARENTS = {
+    Arc: ('outline', Outline),
+    ArcElementNode: ('outline', Outline),
+    StoryElementNode: ('outline', Outline),
+    CharacterInstance: ('character', Character),
+    LocationInstance: ('location', Location),
+}
+
+# Models with a ``user`` column of their own.
+OWNED_MODELS = (Outline, Series, Character, Location)
+
+_current_resolver = ContextVar('fiction_outlines_ownership', default=None)
+
+
+class OwnershipResolver(object):
+    '''
+    Maps objects to the pk of the user that owns them, remembering every owner it has seen.
+    '''
+
+    def __init__(self):
+        self._owners = {}
+
+    @staticmethod
+    def _key(model, pk):
+        return model._meta.concrete_model, pk
+
+    def _owner_from_instance(self, obj):
+        '''
+        Returns the owner of an object from what is already loaded, or ``None`` if a query is needed.
+        '''
+        model = obj._meta.concrete_model
+        if model in OWNED_MODELS or model not in OWNER_PARENTS:
+            return obj.user_id
+        field_name, parent_model = OWNER_PARENTS[model]
+        parent_key = self._key(parent_model, getattr(obj, field_name + '_id'))
+        if parent_key in self._owners:
+            return self._owners[parent_key]
+        field = model._meta.get_field(field_name)
+        if field.is_cached(obj):
+            return self._owner_from_instance(field.get_cached_value(obj))
+        return None
+
+    def prime(self, objects):
+        '''
+        Resolves the owners of all of the objects, using at most one query per model.
+        '''
+        pending = defaultdict(set)
+        for obj in objects:
+            key = self._key(type(obj), obj.pk)
+            if key in self._owners or obj._state.adding:
+                continue
+            owner_id = self._owner_from_instance(obj)
+            if owner_id is None:
+                pending[key[0]].add(obj.pk)
+            else:
+                self._owners[key] = owner_id
+        for model, pks in pending.items():
+            field_name, parent_model = OWNER_PARENTS[model]
+            rows = model.objects.filter(pk__in=pks).values_list('pk', field_name, model.owner_lookup)
+            for pk, parent_pk, owner_id in rows:
+                self._owners[self._key(model, pk)] = owner_id
+                self._owners[self._key(parent_model, parent_pk)] = owner_id
+
+    def owner_id(self, obj):
+        '''
+        Returns the pk of the user that owns the object, or ``None`` if there is no object.
+        '''
+        if obj is None:
+            return None
+        if obj._state.adding:
+            # Unsaved objects can't be looked up by pk, so go through their parent instead.
+            owner_id = self._owner_from_instance(obj)
+            if owner_id is None:
+                owner_id = self.owner_id(getattr(obj, OWNER_PARENTS[obj._meta.concrete_model][0]))
+            return owner_id
+        key = self._key(type(obj), obj.pk)
+        if key not in self._owners:
+            self.prime([obj])
+        return self._owners.get(key)
+
+
+def get_resolver():
+    '''
+    Returns the resolver for the current request. Outside of a request, or of
+    :func:`ownership_cache`, a new resolver is returned each time, so nothing is remembered.
+    '''
+    return _current_resolver.get() or OwnershipResolver()
+
+
+def prime(objects):
+    '''
+    Resolves the owners of the objects for the current request, with at most one query per model.
+    '''
+    get_resolver().prime(objects)
+
+
+def is_owner(user, obj):
+    '''
+    Returns whether the user owns the object.
+    '''
+    owner_id = get_resolver().owner_id(obj)
+    return owner_id is not None and owner_id == user.pk
+
+
+@contextmanager
+def ownership_cache():
+    '''
+    Remembers resolved owners until the block exits. Nested blocks share the outer cache.
+    '''
+    if _current_resolver.get() is not None:
+        yield _current_resolver.get()
+        return
+    token = _current_resolver.set(OwnershipResolver())
+    try:
+        yield _current_resolver.get()
+    finally:
+        _current_resolver.reset(token)
+
+
+class OwnershipCacheMiddleware(object):
+    '''
+    Remembers resolved owners for the duration of each request.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with ownership_cache():
+            return self.get_response(request)
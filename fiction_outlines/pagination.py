@@ -0,0 +1,136 @@
+'''
+Keyset (cursor) pagination for list views.
+
+Instead of skipping rows with ``OFFSET``, each page after the first starts after the
+sort key of the last record on the page before it. Fetching a page then costs the
+same however far into the list it is. The cursor is an opaque string that encodes
+that sort key, along with the record's pk to break ties.
+'''
+
+import base64
+import binascii
+import json
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.translation import gettext_lazy as _
+
+
+class KeysetPage(object):
+    '''
+    A page of records along with the cursor for the next page, if there is one.
+    '''
+
+    def __init__(self, object_list, next_cursor=None, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values):
+    '''
+    Encodes a list of sort key values as a URL safe string.
+    '''
+    data = json.dumps(values, default=_json_default, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    '''
+    Decodes a cursor into a list of values, one for each of the model fields given.
+
+    :raises: :class:`ValueError` if the cursor is malformed.
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError('Cursor does not match the ordering.')
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (binascii.Error, UnicodeDecodeError, ValidationError) as error:
+        raise ValueError(str(error))
+
+
+def paginate_keyset(queryset, ordering, page_size, cursor=None):
+    '''
+    Returns a :class:`KeysetPage` of up to ``page_size`` records from the queryset, sorted
+    by ``ordering`` (a field name, prefixed with ``-`` for descending order) and then pk.
+    The ordering field must not be nullable. Pass the ``next_cursor`` of a page as ``cursor``
+    to get the page after it.
+
+    :raises: :class:`ValueError` if the cursor is malformed.
+    '''
+    descending = ordering.startswith('-')
+    field_name = ordering.lstrip('-')
+    fields = [queryset.model._meta.get_field(field_name), queryset.model._meta.pk]
+    queryset = queryset.order_by(ordering, '-pk' if descending else 'pk')
+    if cursor:
+        value, pk = decode_cursor(cursor, fields)
+        lookup = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{'%s__%s' % (field_name, lookup): value}) | Q(**{field_name: value, 'pk__%s' % lookup: pk}))
+    records = list(queryset[:page_size + 1])
+    if len(records) <= page_size:
+        return KeysetPage(records, cursor=cursor)
+    records = records[:page_size]
+    next_cursor = encode_cursor([getattr(records[-1], field.attname) for field in fields])
+    return KeysetPage(records, next_cursor, cursor)
+
+
+def related_count(queryset, field):
+    '''
+    Returns an expression counting the records of ``queryset`` whose ``field`` refers to the
+    outer record. Unlike an annotated ``Count``, this is a subquery that is only evaluated for
+    the records on the page, rather than a join over everything related to every record.
+    '''
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class KeysetPaginationMixin(object):
+    '''
+    Paginates a ``ListView`` by cursor. The ``order`` query parameter picks a key of
+    ``orderings``, and the ``cursor`` parameter picks the page. ``page_obj`` in the
+    context is a :class:`KeysetPage`, and ``ordering`` is the key of the ordering in use.
+    '''
+    paginate_by = 50
+    orderings = {'modified': '-modified', 'title': 'title'}
+    default_ordering = 'modified'
+    ordering_kwarg = 'order'
+    cursor_kwarg = 'cursor'
+
+    def get_ordering_key(self):
+        key = self.request.GET.get(self.ordering_kwarg)
+        return key if key in self.orderings else self.default_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = paginate_keyset(queryset, self.orderings[self.get_ordering_key()], page_size,
+                                   self.request.GET.get(self.cursor_kwarg) or None)
+        except ValueError:
+            raise Http404(_('Invalid cursor.'))
+        return None, page, page.object_list, page.has_next() or page.has_previous()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['ordering'] = self.get_ordering_key()
+        return context
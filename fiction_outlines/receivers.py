@@ -3,18 +3,81 @@ Recieving methods for signals go here.
 '''
 
 import logging
-from django.db.models.signals import pre_save, post_save, m2m_changed
-from django.db import IntegrityError
+import operator
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import reduce
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.utils import timezone
+from django.db import IntegrityError, transaction
 from django.utils.translation import gettext_lazy as _
-from django.template.defaultfilters import truncatewords, truncatechars
 from django.dispatch import receiver
 from .models import Outline, StoryElementNode, ArcElementNode, CharacterInstance, LocationInstance
+from .models import Arc, Character, Location, Series, UUIDCharacterTag, UUIDLocationTag, UUIDOutlineTag
 from .models import STORY_NODE_ELEMENT_DEFINITIONS, ArcIntegrityError
+from .headlines import generate_headline
 from .signals import tree_manipulation
 
 
 logger = logging.getLogger(name='Signals')
 
+_batch_in_progress = ContextVar('batch_in_progress', default=False)
+
+
+@contextmanager
+def batch_tree_changes():
+    '''
+    Suspends the per-record receiver that touches the outline for saved and deleted records
+    while a batch of tree changes is written. The batch is then responsible for refreshing
+    impact ratings and sending a single ``tree_manipulation`` signal when it is done.
+    '''
+    token = _batch_in_progress.set(True)
+    try:
+        yield
+    finally:
+        _batch_in_progress.reset(token)
+
+
+def pending_commit_callbacks(cls):
+    '''
+    Returns the callbacks of the given class that are waiting for the current transaction to commit.
+    Callbacks registered in a savepoint that was rolled back are no longer among them.
+    '''
+    return [entry[1] for entry in transaction.get_connection().run_on_commit if isinstance(entry[1], cls)]
+
+
+class DeletedOutline(object):
+    '''
+    Marks an outline as deleted for the rest of the transaction that deletes it. It is registered
+    as a callback that does nothing on commit, so that it is discarded along with the deletion if
+    that is rolled back.
+    '''
+
+    def __init__(self, pk):
+        self.pk = pk
+
+    def __call__(self):
+        pass
+
+
+def outline_being_deleted(outline_id):
+    '''
+    Returns whether the outline is being deleted in the current transaction. The receivers skip
+    their upkeep for the records deleted along with it.
+    '''
+    return any(marker.pk == outline_id for marker in pending_commit_callbacks(DeletedOutline))
+
+
+@receiver(pre_delete, sender=Outline)
+def mark_outline_deleted(sender, instance, *args, **kwargs):
+    '''
+    Records that an outline is being deleted, before the records it contains are.
+    '''
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(DeletedOutline(instance.pk))
+
 # Model-based signal logic appears below here.
 
 
@@ -23,13 +86,9 @@ def generate_headline_from_description(sender, instance, *args, **kwargs):
     '''
     Auto generate the headline of the node from the first lines of the description.
     '''
-    lines = instance.description.split('\n')
-    headline = truncatewords(lines[0], 20)
-    if headline[:-1] == '…':
-        headline = truncatechars(headline.replace(' …', ''), 250)  # Just in case the words exceed char limit.
-    else:
-        headline = truncatechars(headline, 250)
-    instance.headline = headline
+    if instance.headline is not None and 'description' not in instance.get_dirty_fields():
+        return
+    instance.headline = generate_headline(instance.description)
 
 
 @receiver(post_save, sender=Outline)
@@ -39,7 +98,7 @@ def story_root_for_new_outline(sender, instance, created, *args, **kwargs):
     the root node of the story tree.
     '''
     if created and isinstance(instance, Outline):
-        streeroot = StoryElementNode.add_root(outline=instance, story_element_type='root')
+        streeroot = StoryElementNode.add_root(outline=instance, story_element_type='root', impact_rating=0)
         streeroot.save()
         instance.refresh_from_db()
 
@@ -64,32 +123,10 @@ def arc_node_edit_add_missing_characters_and_locations_to_related_story_node(
     '''
     if action == 'post_add':
         logger.debug("Updating nodes after character or location change.")
-        if reverse:
-            logger.debug("Searching backwards from character or location to arc node")
-            # We are going to need to be querying the arc element node.
-            for arcnode in instance.arcelementnode_set.all().select_related('story_element_node'):
-                logger.debug("Scanning arc node...")
-                if arcnode.story_element_node:
-                    logger.debug("Found story node to update...")
-                    story_node = arcnode.story_element_node
-                    if isinstance(instance, CharacterInstance):
-                        logger.debug("Updating characters...")
-                        story_node.assoc_characters.add(instance)
-                    if isinstance(instance, LocationInstance):
-                        logger.debug("updating locations...")
-                        story_node.assoc_locations.add(instance)
-        else:
-            # We already have the arc_element_node
-            logger.debug('Scanning arcnode instance...')
-            if instance.story_element_node:
-                logger.debug("found story node to update...")
-                story_node = instance.story_element_node
-                if sender == ArcElementNode.assoc_characters.through:
-                    logger.debug('Adding character')
-                    story_node.assoc_characters.add(*pk_set)
-                if sender == ArcElementNode.assoc_locations.through:
-                    logger.debug('Adding locations')
-                    story_node.assoc_locations.add(*pk_set)
+        field_name = 'assoc_characters' if sender == ArcElementNode.assoc_characters.through else 'assoc_locations'
+        # In reverse, the arc nodes are the ones that were added to the character or location.
+        arc_node_ids = pk_set if reverse else [instance.pk]
+        ArcElementNode.propagate_characters_and_locations(arc_node_ids, fields=[field_name])
 
 
 @receiver(post_save, sender=ArcElementNode)
@@ -97,24 +134,75 @@ def story_node_add_arc_element_update_characters_locations(sender, instance, cre
     '''
     If an arc element is added to a story element node, add any missing elements or locations.
     '''
-    arc_node = ArcElementNode.objects.get(pk=instance.pk)
-    logger.debug('Scanning arc_node %s' % arc_node)
-    if arc_node.arc_element_type == 'root':
-        logger.debug("root node. skipping...")
-    else:
-        logger.debug('Checking arc node for story element relationship...')
-        if arc_node.story_element_node:
-            logger.debug('Found a story element node for arc element...')
-            # This change was initiated by the arc element node as opposed to the story node.
-            story_node = arc_node.story_element_node
-            if arc_node.assoc_characters.count() > 0:
-                logger.debug('Found %d characters to add...' % arc_node.assoc_characters.count())
-                for character in arc_node.assoc_characters.all():
-                    story_node.assoc_characters.add(character)
-            if arc_node.assoc_locations.count() > 0:
-                logger.debug('Found %d locations to add...' % arc_node.assoc_locations.count())
-                for location in arc_node.assoc_locations.all():
-                    story_node.assoc_locations.add(location)
+    if (created or instance.arc_element_type == 'root' or not instance.story_element_node_id or
+            'story_element_node_id' not in instance.get_dirty_fields()):
+        # A new arc node has no characters or locations yet, and an unchanged link has none missing.
+        return
+    logger.debug('Propagating characters and locations of arc_node %s', instance.pk)
+    ArcElementNode.propagate_characters_and_locations([instance.pk])
+
+
+@receiver(pre_save, sender=ArcElementNode)
+def record_arc_node_impact_fields(sender, instance, *args, **kwargs):
+    '''
+    Remembers the story node and element type an existing arc node had before this save,
+    so that impact ratings can be refreshed wherever they changed.
+    '''
+    instance._impact_previous = None
+    if not instance._state.adding:
+        loaded = instance.get_loaded_values()
+        if 'story_element_node_id' in loaded and 'arc_element_type' in loaded:
+            instance._impact_previous = (loaded['story_element_node_id'], loaded['arc_element_type'])
+        else:
+            instance._impact_previous = ArcElementNode.objects.filter(pk=instance.pk).values_list(
+                'story_element_node_id', 'arc_element_type').first()
+
+
+@receiver(post_save, sender=ArcElementNode)
+def refresh_impact_ratings_for_arc_node(sender, instance, created, *args, **kwargs):
+    '''
+    If an arc element is linked to a different story node, or changes type, refresh the stored
+    impact ratings of the story nodes affected.
+    '''
+    previous_story_node_id, previous_type = getattr(instance, '_impact_previous', None) or (None, None)
+    story_node_ids = set()
+    if created or previous_story_node_id != instance.story_element_node_id:
+        story_node_ids.update([previous_story_node_id, instance.story_element_node_id])
+    if not created and previous_type != instance.arc_element_type:
+        # The impact of child elements depends on whether their parent is a milestone.
+        story_node_ids.add(instance.story_element_node_id)
+        story_node_ids.update(instance.get_children().values_list('story_element_node_id', flat=True))
+    story_node_ids.discard(None)
+    if story_node_ids:
+        logger.debug('Arc node change affects impact of %d story nodes', len(story_node_ids))
+        StoryElementNode.refresh_impact_ratings(story_node_ids)
+
+
+@receiver(post_delete, sender=ArcElementNode)
+def refresh_impact_ratings_for_deleted_arc_node(sender, instance, *args, **kwargs):
+    '''
+    Removing an arc element lowers the impact of the story node it was linked to.
+    '''
+    if instance.story_element_node_id and not outline_being_deleted(instance.outline_id):
+        StoryElementNode.refresh_impact_ratings([instance.story_element_node_id])
+
+
+@receiver(pre_save, sender=ArcElementNode)
+def sync_arc_node_outline(sender, instance, *args, **kwargs):
+    '''
+    Copies the outline of the arc to a new arc node, or to one that has been moved to another arc.
+    '''
+    if instance.outline_id is None or 'arc_id' in instance.get_dirty_fields():
+        instance.outline_id = instance.arc.outline_id
+
+
+@receiver(post_save, sender=Arc)
+def sync_arc_node_outlines_for_moved_arc(sender, instance, created, *args, **kwargs):
+    '''
+    Moves the nodes of an arc along with it when the arc is assigned to another outline.
+    '''
+    if not created and 'outline_id' in instance.get_dirty_fields():
+        ArcElementNode.objects.filter(arc=instance).update(outline_id=instance.outline_id)
 
 
 @receiver(pre_save, sender=ArcElementNode)
@@ -122,11 +210,23 @@ def validate_arc_links_same_outline(sender, instance, *args, **kwargs):
     '''
     Evaluates attempts to link an arc to a story node from another outline.
     '''
-    if instance.story_element_node:
-        if instance.story_element_node.outline != instance.parent_outline:
+    if instance.story_element_node_id and 'story_element_node_id' in instance.get_dirty_fields():
+        if instance.story_element_node.outline_id != instance.outline_id:
             raise IntegrityError(_('An arc cannot be associated with an story element from another outline.'))
 
 
+def check_same_outline(model, pk_set, outline_id, message, outline_field='outline'):
+    '''
+    Fetches the outline of every ``model`` record in ``pk_set`` with a single query, and raises
+    an :class:`django.db.IntegrityError` listing all of the records that are not from the given outline.
+    '''
+    matching = {pk for pk, related_outline_id in model.objects.filter(pk__in=pk_set).values_list('pk', outline_field)
+                if related_outline_id == outline_id}
+    offending = sorted(str(pk) for pk in pk_set if pk not in matching)
+    if offending:
+        raise IntegrityError('%s Offending records: %s' % (message, ', '.join(offending)))
+
+
 @receiver(m2m_changed, sender=ArcElementNode.assoc_characters.through)
 def validate_character_instance_valid_for_arc(sender, instance, action, reverse, pk_set, *args, **kwargs):
     '''
@@ -136,15 +236,11 @@ def validate_character_instance_valid_for_arc(sender, instance, action, reverse,
     if action == 'pre_add':
         if reverse:
             # Fetch arc definition through link.
-            for apk in pk_set:
-                arc_node = ArcElementNode.objects.get(pk=apk)
-                if arc_node.parent_outline != instance.outline:
-                    raise IntegrityError(_('Character Instance and Arc Element must be from same outline.'))
+            check_same_outline(ArcElementNode, pk_set, instance.outline_id,
+                               _('Character Instance and Arc Element must be from same outline.'), 'outline')
         else:
-            for cpk in pk_set:
-                char_instance = CharacterInstance.objects.get(pk=cpk)
-                if char_instance.outline != instance.parent_outline:
-                    raise IntegrityError(_('Character Instance and Arc Element must be from the same outline.'))
+            check_same_outline(CharacterInstance, pk_set, instance.outline_id,
+                               _('Character Instance and Arc Element must be from the same outline.'))
 
 
 @receiver(m2m_changed, sender=ArcElementNode.assoc_locations.through)
@@ -155,15 +251,11 @@ def validate_location_instance_valid_for_arc(sender, instance, action, reverse,
     if action == 'pre_add':
         if reverse:
             # Fetch arc definition through link.
-            for apk in pk_set:
-                arc_node = ArcElementNode.objects.get(pk=apk)
-                if arc_node.parent_outline != instance.outline:
-                    raise IntegrityError(_('Location instance must be from same outline as arc element.'))
+            check_same_outline(ArcElementNode, pk_set, instance.outline_id,
+                               _('Location instance must be from same outline as arc element.'), 'outline')
         else:
-            for lpk in pk_set:
-                loc_instance = LocationInstance.objects.get(pk=lpk)
-                if loc_instance.outline != instance.parent_outline:
-                    raise IntegrityError(_('Location Instance must be from the same outline as arc element.'))
+            check_same_outline(LocationInstance, pk_set, instance.outline_id,
+                               _('Location Instance must be from the same outline as arc element.'))
 
 
 @receiver(m2m_changed, sender=StoryElementNode.assoc_characters.through)
@@ -173,15 +265,11 @@ def validate_character_for_story_element(sender, instance, action, reverse, pk_s
     '''
     if action == 'pre_add':
         if reverse:
-            for spk in pk_set:
-                story_node = StoryElementNode.objects.get(pk=spk)
-                if instance.outline != story_node.outline:
-                    raise IntegrityError(_('Character Instance must be from the same outline as story node.'))
+            check_same_outline(StoryElementNode, pk_set, instance.outline_id,
+                               _('Character Instance must be from the same outline as story node.'))
         else:
-            for cpk in pk_set:
-                char_instance = CharacterInstance.objects.get(pk=cpk)
-                if char_instance.outline != instance.outline:
-                    raise IntegrityError(_('Character Instance must be from the same outline as story node.'))
+            check_same_outline(CharacterInstance, pk_set, instance.outline_id,
+                               _('Character Instance must be from the same outline as story node.'))
 
 
 @receiver(m2m_changed, sender=StoryElementNode.assoc_locations.through)
@@ -191,15 +279,11 @@ def validate_location_for_story_element(sender, instance, action, reverse, pk_se
     '''
     if action == 'pre_add':
         if reverse:
-            for spk in pk_set:
-                story_node = StoryElementNode.objects.get(pk=spk)
-                if instance.outline != story_node.outline:
-                    raise IntegrityError(_('Location must be from same outline as story node.'))
+            check_same_outline(StoryElementNode, pk_set, instance.outline_id,
+                               _('Location must be from same outline as story node.'))
         else:
-            for lpk in pk_set:
-                loc_instance = LocationInstance.objects.get(pk=lpk)
-                if instance.outline != loc_instance.outline:
-                    raise IntegrityError(_('Location must be from the same outline as story node.'))
+            check_same_outline(LocationInstance, pk_set, instance.outline_id,
+                               _('Location must be from the same outline as story node.'))
 
 
 @receiver(tree_manipulation, sender=StoryElementNode)
@@ -221,7 +305,7 @@ def validate_generations_for_story_elements(
         if instance.story_element_type not in STORY_NODE_ELEMENT_DEFINITIONS[target_node_type]['allowed_parents']:
             raise IntegrityError(_('%s is not an allowed child of %s' % (target_node_type,
                                                                          instance.story_element_type)))
-    if action == 'update':
+    if action == 'update' and 'story_element_type' in instance.get_dirty_fields():
         parent = instance.get_parent()
         children = instance.get_children()
         if parent.story_element_type not in STORY_NODE_ELEMENT_DEFINITIONS[target_node_type]['allowed_parents']:
@@ -253,6 +337,46 @@ def validate_generations_for_story_elements(
                 )))
 
 
+@receiver(tree_manipulation, sender=StoryElementNode)
+def refresh_impact_ratings_for_tree_changes(
+        sender,
+        instance,
+        action,
+        target_node_type=None,
+        target_node=None,
+        pos=None,
+        *args,
+        **kwargs
+):
+    '''
+    Keeps stored impact ratings current as the story tree changes shape. Before a move, the
+    ancestry of the moving node is recorded so that the branch it leaves is refreshed too.
+    '''
+    if action == 'move':
+        instance._impact_previous_ancestors = list(
+            instance.get_ancestors().filter(depth__gt=1).values_list('pk', flat=True))
+    if action == 'post_move':
+        node_ids = [instance.pk] + getattr(instance, '_impact_previous_ancestors', [])
+        StoryElementNode.refresh_impact_ratings(node_ids)
+    if action in ('post_add_child', 'post_add_sibling'):
+        StoryElementNode.refresh_impact_ratings([target_node.pk])
+
+
+@receiver(tree_manipulation, sender=ArcElementNode)
+def refresh_impact_ratings_for_arc_moves(sender, instance, action, *args, **kwargs):
+    '''
+    The impact of an arc element depends on whether its parent is a milestone, so moving it
+    refreshes the stored impact ratings of the story nodes linked to it and its descendants.
+    '''
+    if action == 'post_move':
+        # The move rewrites the paths in the database, not on the instance.
+        path = ArcElementNode.objects.filter(pk=instance.pk).values_list('path', flat=True).get()
+        story_node_ids = set(ArcElementNode.objects.filter(path__startswith=path).exclude(
+            story_element_node=None).values_list('story_element_node_id', flat=True))
+        if story_node_ids:
+            StoryElementNode.refresh_impact_ratings(story_node_ids)
+
+
 @receiver(tree_manipulation, sender=ArcElementNode)
 def validate_against_prohibited_actions(
         sender,
@@ -263,10 +387,126 @@ def validate_against_prohibited_actions(
         pos=None,
         *args,
         **kwargs):
-    if action == 'update' and 'mile' in target_node_type:
+    if action == 'update' and 'mile' in target_node_type and 'arc_element_type' in instance.get_dirty_fields():
         milestones = ArcElementNode.objects.filter(
             arc=instance.arc,
             arc_element_type=instance.arc_element_type
         ).exclude(pk=instance.pk).count()
         if milestones:
             raise ArcIntegrityError(_("You cannot have two of the same milestone within the same arc."))
+
+
+# Keeping Outline.modified current, so that it reflects the latest change to anything the outline contains.
+
+class OutlineTouches(object):
+    '''
+    The outlines to mark as modified when the current transaction commits, as a set of
+    ``(lookup, value)`` filters. Calling it touches them all with a single query.
+    '''
+
+    def __init__(self):
+        self.filters = set()
+
+    def __call__(self):
+        values = defaultdict(set)
+        for lookup, value in self.filters:
+            values[lookup].add(value)
+        self.filters.clear()
+        if values:
+            query = reduce(operator.or_, (Q(**{lookup + '__in': value_set}) for lookup, value_set in values.items()))
+            Outline.objects.filter(query).update(modified=timezone.now())
+
+
+def touch_outlines(**filters):
+    '''
+    Sets ``modified`` to now on the outlines matching the filters, without sending signals. Inside
+    a transaction, this waits for it to commit, so that the outlines are touched once, after
+    every change in it has been written. The time is taken in Python rather than the database,
+    which may only store whole seconds.
+    '''
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        Outline.objects.filter(**filters).update(modified=timezone.now())
+        return
+    # Touches are collected per savepoint, so that those made in one that is rolled back are discarded with it.
+    savepoint_ids = set(connection.savepoint_ids)
+    touches = next((entry[1] for entry in connection.run_on_commit
+                    if isinstance(entry[1], OutlineTouches) and entry[0] == savepoint_ids), None)
+    if touches is None:
+        touches = OutlineTouches()
+        transaction.on_commit(touches)
+    touches.filters.update(filters.items())
+
+
+def flush_outline_touches():
+    '''
+    Touches the outlines that are waiting for the current transaction to commit straight away,
+    for code that reads ``Outline.modified`` before then.
+    '''
+    for touches in pending_commit_callbacks(OutlineTouches):
+        touches()
+
+
+def outline_filters_for(instance):
+    '''
+    Returns the filters that select the outlines containing an object.
+    '''
+    if isinstance(instance, Outline):
+        return {'pk': instance.pk}
+    if isinstance(instance, Character):
+        return {'characterinstance__character': instance.pk}
+    if isinstance(instance, Location):
+        return {'locationinstance__location': instance.pk}
+    if isinstance(instance, Series):
+        return {'series': instance.pk}
+    return {'pk': instance.outline_id}
+
+
+@receiver(post_save, sender=StoryElementNode)
+@receiver(post_save, sender=ArcElementNode)
+@receiver(post_save, sender=Arc)
+@receiver(post_save, sender=CharacterInstance)
+@receiver(post_save, sender=LocationInstance)
+@receiver(post_save, sender=Character)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Series)
+@receiver(post_delete, sender=StoryElementNode)
+@receiver(post_delete, sender=ArcElementNode)
+@receiver(post_delete, sender=Arc)
+@receiver(post_delete, sender=CharacterInstance)
+@receiver(post_delete, sender=LocationInstance)
+def touch_outline_for_saved_content(sender, instance, *args, **kwargs):
+    '''
+    Saving or deleting anything contained in an outline marks the outline as modified, unless
+    the outline is being deleted too.
+    '''
+    if _batch_in_progress.get() or outline_being_deleted(getattr(instance, 'outline_id', None)):
+        return
+    touch_outlines(**outline_filters_for(instance))
+
+
+@receiver(tree_manipulation, sender=StoryElementNode)
+@receiver(tree_manipulation, sender=ArcElementNode)
+def touch_outline_for_tree_changes(sender, instance, action, *args, **kwargs):
+    '''
+    Tree moves rewrite paths without saving the nodes, so they mark the outline as modified here,
+    once the change has been written.
+    '''
+    if action.startswith('post_'):
+        touch_outlines(**outline_filters_for(instance))
+
+
+@receiver(m2m_changed, sender=StoryElementNode.assoc_characters.through)
+@receiver(m2m_changed, sender=StoryElementNode.assoc_locations.through)
+@receiver(m2m_changed, sender=ArcElementNode.assoc_characters.through)
+@receiver(m2m_changed, sender=ArcElementNode.assoc_locations.through)
+@receiver(m2m_changed, sender=UUIDOutlineTag)
+@receiver(m2m_changed, sender=UUIDCharacterTag)
+@receiver(m2m_changed, sender=UUIDLocationTag)
+def touch_outline_for_relation_changes(sender, instance, action, *args, **kwargs):
+    '''
+    Changing the characters, locations, or tags linked to anything in an outline marks the
+    outline as modified. Either side of a link belongs to the same outline.
+    '''
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        touch_outlines(**outline_filters_for(instance))
@@ -3,53 +3,55 @@ Permission definitions for fiction_outlines
 '''
 
 import rules
+from .ownership import is_owner
 
 
-# First we define our predicates.
+# First we define our predicates. Owners are resolved through fiction_outlines.ownership,
+# which avoids loading related objects and remembers owners for the rest of the request.
 
 @rules.predicate
 def is_outline_owner(user, outline):
-    return outline.user == user
+    return is_owner(user, outline)
 
 
 @rules.predicate
 def is_series_owner(user, series):
-    return series.user == user
+    return is_owner(user, series)
 
 
 @rules.predicate
 def is_character_owner(user, character):
-    return character.user == user
+    return is_owner(user, character)
 
 
 @rules.predicate
 def is_location_owner(user, location):
-    return location.user == user
+    return is_owner(user, location)
 
 
 @rules.predicate
 def is_arc_owner(user, arc):
-    return arc.outline.user == user
+    return is_owner(user, arc)
 
 
 @rules.predicate
 def is_arc_element_node_owner(user, arc_node):
-    return arc_node.arc.outline.user == user
+    return is_owner(user, arc_node)
 
 
 @rules.predicate
 def is_story_node_owner(user, story_node):
-    return story_node.outline.user == user
+    return is_owner(user, story_node)
 
 
 @rules.predicate
 def is_character_instance_owner(user, character_instance):
-    return character_instance.character.user == user
+    return is_owner(user, character_instance)
 
 
 @rules.predicate
 def is_location_instance_owner(user, location_instance):
-    return location_instance.location.user == user
+    return is_owner(user, location_instance)
 
 
 rules.add_perm('fiction_outlines.view_outline', is_outline_owner)
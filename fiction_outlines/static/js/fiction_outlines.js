@@ -0,0 +1,86 @@
+/*
+ * Node picker for the move forms. Inputs with a data-choices-url attribute get a
+ * search box and a tree that loads one level at a time from that url. Picking a
+ * node fills its pk into the input.
+ */
+(function () {
+    'use strict';
+
+    function fetchChoices(url, params, callback) {
+        var query = Object.keys(params).filter(function (key) {
+            return params[key];
+        }).map(function (key) {
+            return encodeURIComponent(key) + '=' + encodeURIComponent(params[key]);
+        }).join('&');
+        var request = new XMLHttpRequest();
+        request.open('GET', url + (query ? '?' + query : ''));
+        request.onload = function () {
+            if (request.status === 200) {
+                callback(JSON.parse(request.responseText));
+            }
+        };
+        request.send();
+    }
+
+    function loadInto(list, input, params) {
+        fetchChoices(input.dataset.choicesUrl, params, function (data) {
+            data.results.forEach(function (node) {
+                var item = document.createElement('li');
+                var pick = document.createElement('a');
+                pick.href = '#';
+                pick.textContent = node.label;
+                pick.addEventListener('click', function (event) {
+                    event.preventDefault();
+                    input.value = node.id;
+                });
+                item.appendChild(pick);
+                if (node.has_children && !params.q) {
+                    var expand = document.createElement('button');
+                    expand.type = 'button';
+                    expand.textContent = '+';
+                    expand.addEventListener('click', function () {
+                        var children = document.createElement('ul');
+                        item.appendChild(children);
+                        expand.remove();
+                        loadInto(children, input, {parent: node.path});
+                    });
+                    item.insertBefore(expand, pick);
+                }
+                list.appendChild(item);
+            });
+            if (data.next) {
+                var more = document.createElement('button');
+                more.type = 'button';
+                more.textContent = '…';
+                more.addEventListener('click', function () {
+                    more.remove();
+                    loadInto(list, input, Object.assign({}, params, {cursor: data.next}));
+                });
+                list.appendChild(more);
+            }
+        });
+    }
+
+    function initPicker(input) {
+        var search = document.createElement('input');
+        var list = document.createElement('ul');
+        var timer = null;
+        search.type = 'search';
+        search.className = 'node-picker-search';
+        list.className = 'node-picker';
+        search.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                list.innerHTML = '';
+                loadInto(list, input, {q: search.value.trim()});
+            }, 250);
+        });
+        input.parentNode.insertBefore(search, input.nextSibling);
+        search.parentNode.insertBefore(list, search.nextSibling);
+        loadInto(list, input, {});
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        Array.prototype.forEach.call(document.querySelectorAll('input[data-choices-url]'), initPicker);
+    });
+})();
@@ -0,0 +1,177 @@
+'''
+Timings for the expensive parts of fiction_outlines: impact ratings, nesting validation,
+arc validation, and exports.
+
+Each of these runs inside a span. Spans are only timed while a trace is active, or while
+debug logging is enabled for the ``fiction_outlines.tracing`` logger, and otherwise cost a
+single check. Start a trace for a block of code with :func:`tracing`, or for a request with
+:class:`TracingMiddleware`, which reports the totals for each span in a ``Server-Timing``
+header.
+
+Settings:
+
+``FICTION_OUTLINES_TRACING``
+    Trace every request. Defaults to ``False``.
+
+``FICTION_OUTLINES_TRACE_PARAM``
+    A query parameter that turns on tracing for a single request by a staff user, or by
+    anyone when ``DEBUG`` is on. Defaults to ``'trace'``.
+'''
+
+import functools
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+logger = logging.getLogger('fiction_outlines.tracing')
+
+_current_trace = ContextVar('current_trace', default=None)
+
+
+class Trace(object):
+    '''
+    The spans recorded while a trace is active, as ``(name, seconds)`` tuples in the order they finished.
+    '''
+
+    def __init__(self):
+        self.spans = []
+        self.active = set()
+
+    def totals(self):
+        '''
+        Returns an ordered dict of ``{name: (count, seconds)}`` for the spans recorded.
+        '''
+        totals = OrderedDict()
+        for name, seconds in self.spans:
+            count, total = totals.get(name, (0, 0))
+            totals[name] = (count + 1, total + seconds)
+        return totals
+
+    def server_timing(self):
+        '''
+        Returns the totals as the value of a ``Server-Timing`` header.
+        '''
+        return ', '.join('%s;dur=%.3f;desc="%d calls"' % (name, total * 1000, count)
+                         for name, (count, total) in self.totals().items())
+
+
+def is_tracing():
+    '''
+    Returns whether spans are being timed.
+    '''
+    return _current_trace.get() is not None or logger.isEnabledFor(logging.DEBUG)
+
+
+@contextmanager
+def span(name):
+    '''
+    Times the block as a span called ``name``. A span inside another of the same name
+    counts as part of the outer one.
+    '''
+    trace = _current_trace.get()
+    if (trace is None and not logger.isEnabledFor(logging.DEBUG)) or (trace is not None and name in trace.active):
+        yield
+        return
+    if trace is not None:
+        trace.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if trace is not None:
+            trace.active.discard(name)
+            trace.spans.append((name, seconds))
+        logger.debug('Span %s took %.3f ms', name, seconds * 1000)
+
+
+def _traced_generator(name, generator):
+    # Only the time spent producing each item counts, not the time the consumer holds on to it.
+    trace = _current_trace.get()
+    seconds = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    finally:
+        if trace is not None:
+            trace.spans.append((name, seconds))
+        logger.debug('Span %s took %.3f ms', name, seconds * 1000)
+
+
+def traced(name):
+    '''
+    Decorator that runs a function in a span. For a generator function, the span covers the
+    time spent generating items.
+    '''
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not is_tracing():
+                    return func(*args, **kwargs)
+                return _traced_generator(name, func(*args, **kwargs))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not is_tracing():
+                    return func(*args, **kwargs)
+                with span(name):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def tracing():
+    '''
+    Records the spans in the block, and yields the :class:`Trace` they are recorded in.
+    Nested blocks share the outer trace.
+    '''
+    if _current_trace.get() is not None:
+        yield _current_trace.get()
+        return
+    token = _current_trace.set(Trace())
+    try:
+        yield _current_trace.get()
+    finally:
+        _current_trace.reset(token)
+
+
+class TracingMiddleware(object):
+    '''
+    Traces the requests that ask for it, adding a ``Server-Timing`` header to the response
+    and logging the totals. Place it after the authentication middleware.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def wants_trace(self, request):
+        if getattr(settings, 'FICTION_OUTLINES_TRACING', False):
+            return True
+        if getattr(settings, 'FICTION_OUTLINES_TRACE_PARAM', 'trace') not in request.GET:
+            return False
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or (user is not None and user.is_staff)
+
+    def __call__(self, request):
+        if not self.wants_trace(request):
+            return self.get_response(request)
+        with tracing() as trace:
+            response = self.get_response(request)
+        if trace.spans:
+            response['Server-Timing'] = trace.server_timing()
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('Traced %s %s: %s', request.method, request.path, response['Server-Timing'])
+        return response
@@ -0,0 +1,245 @@
+'''
+Batches of changes to the story tree of an outline.
+
+Each call to :meth:`fiction_outlines.models.StoryElementNode.add_child`, ``add_sibling`` or
+``move`` validates and rewrites paths on its own, so restructuring a large outline one node at a
+time takes hundreds of queries. :func:`apply_story_tree_operations` instead reads the tree once,
+applies a list of operations to it in memory, and writes the result in a single transaction
+with bulk queries. The operations are dicts of one of these forms:
+
+* ``{'op': 'add', 'parent': <node>, 'story_element_type': 'chapter', 'name': ..., 'description': ..., 'ref': ...,
+  'index': ...}``
+* ``{'op': 'move', 'node': <node>, 'parent': <node>, 'index': ...}``
+* ``{'op': 'delete', 'node': <node>}``
+
+A ``<node>`` is either the pk of a node in the outline, or the ``ref`` given to a node added
+earlier in the same batch. ``index`` is the position among the parent's children at that point
+in the batch, and defaults to the end. Only ``parent`` is required for an add.
+'''
+
+import logging
+import uuid
+from django.db import IntegrityError, models, transaction
+from django.utils.translation import gettext_lazy as _
+from .models import StoryElementNode, STORY_NODE_ELEMENT_DEFINITIONS
+from .receivers import batch_tree_changes
+from .signals import tree_manipulation
+
+logger = logging.getLogger(name='TreeOperations')
+
+
+class TreeOperationError(IntegrityError):
+    '''
+    Raised when an operation in a batch is invalid. ``index`` is the position of the operation
+    in the batch. Nothing from the batch is written.
+    '''
+
+    def __init__(self, index, message):
+        self.index = index
+        super().__init__(_('Operation %(index)d: %(message)s') % {'index': index, 'message': message})
+
+
+class _Node(object):
+    '''
+    The in-memory state of a story node while a batch is applied.
+    '''
+
+    def __init__(self, pk, path, depth, numchild, story_element_type, parent=None, fields=None):
+        self.pk = pk
+        self.path = path
+        self.depth = depth
+        self.numchild = numchild
+        self.story_element_type = story_element_type
+        self.parent = parent
+        self.children = []
+        self.fields = fields
+        self.deleted = False
+        self.new_path = self.new_depth = self.new_numchild = None
+
+    def is_descendant_of(self, node):
+        parent = self.parent
+        while parent is not None:
+            if parent is node:
+                return True
+            parent = parent.parent
+        return False
+
+
+def _load_tree(outline):
+    '''
+    Reads the outline's story tree with a single query and returns ``(root, nodes_by_pk)``.
+    '''
+    rows = StoryElementNode.objects.select_for_update().filter(outline=outline).order_by('path').values_list(
+        'pk', 'path', 'depth', 'numchild', 'story_element_type')
+    nodes = {}
+    by_path = {}
+    root = None
+    for pk, path, depth, numchild, story_element_type in rows:
+        node = _Node(pk, path, depth, numchild, story_element_type)
+        if depth == 1:
+            root = node
+        else:
+            node.parent = by_path[path[:-StoryElementNode.steplen]]
+            node.parent.children.append(node)
+        nodes[pk] = node
+        by_path[path] = node
+    return root, nodes
+
+
+class _TreeBatch(object):
+    '''
+    Applies operations to the in-memory tree, validating each one as it goes.
+    '''
+
+    def __init__(self, outline):
+        self.outline = outline
+        self.root, self.nodes = _load_tree(outline)
+        self.added = {}
+
+    def resolve(self, index, reference, key):
+        if reference is None:
+            raise TreeOperationError(index, _('%s is required.') % key)
+        if reference in self.added:
+            node = self.added[reference]
+        else:
+            try:
+                node = self.nodes.get(uuid.UUID(str(reference)))
+            except ValueError:
+                node = None
+        if node is None or node.deleted:
+            raise TreeOperationError(index, _('%(key)s %(ref)s is not a node of this outline.') % {
+                'key': key, 'ref': reference})
+        return node
+
+    def insert(self, index, node, parent, position):
+        if (parent.story_element_type not in
+                STORY_NODE_ELEMENT_DEFINITIONS[node.story_element_type]['allowed_parents']):
+            raise TreeOperationError(index, _('%s is not an allowed child of %s') % (
+                node.story_element_type, parent.story_element_type))
+        if position is None:
+            position = len(parent.children)
+        if not isinstance(position, int) or not 0 <= position <= len(parent.children):
+            raise TreeOperationError(index, _('Invalid index %s.') % position)
+        parent.children.insert(position, node)
+        node.parent = parent
+
+    def add(self, index, operation):
+        parent = self.resolve(index, operation.get('parent'), 'parent')
+        story_element_type = operation.get('story_element_type', 'ss')
+        if story_element_type not in STORY_NODE_ELEMENT_DEFINITIONS or story_element_type == 'root':
+            raise TreeOperationError(index, _('Unknown story element type %s.') % story_element_type)
+        ref = operation.get('ref')
+        if ref is not None and ref in self.added:
+            raise TreeOperationError(index, _('Duplicate ref %s.') % ref)
+        node = _Node(uuid.uuid4(), None, None, 0, story_element_type, fields={
+            'name': operation.get('name'),
+            'description': operation.get('description'),
+        })
+        self.insert(index, node, parent, operation.get('index'))
+        if ref is not None:
+            self.added[ref] = node
+        self.nodes[node.pk] = node
+
+    def move(self, index, operation):
+        node = self.resolve(index, operation.get('node'), 'node')
+        parent = self.resolve(index, operation.get('parent'), 'parent')
+        if node is self.root:
+            raise TreeOperationError(index, _('The root node cannot be moved.'))
+        if parent is node or parent.is_descendant_of(node):
+            raise TreeOperationError(index, _('A node cannot be moved inside itself.'))
+        node.parent.children.remove(node)
+        self.insert(index, node, parent, operation.get('index'))
+
+    def delete(self, index, operation):
+        node = self.resolve(index, operation.get('node'), 'node')
+        if node is self.root:
+            raise TreeOperationError(index, _('The root node cannot be deleted.'))
+        node.parent.children.remove(node)
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            current.deleted = True
+            stack.extend(current.children)
+
+    def apply(self, operations):
+        handlers = {'add': self.add, 'move': self.move, 'delete': self.delete}
+        for index, operation in enumerate(operations):
+            handler = handlers.get(operation.get('op'))
+            if handler is None:
+                raise TreeOperationError(index, _('Unknown operation %s.') % operation.get('op'))
+            handler(index, operation)
+
+    def final_nodes(self):
+        '''
+        Yields every surviving node in tree order, with its final path, depth and numchild set
+        as ``new_path``, ``new_depth`` and ``new_numchild``.
+        '''
+        self.root.new_path, self.root.new_depth = self.root.path, 1
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.new_numchild = len(node.children)
+            for position, child in enumerate(node.children, 1):
+                child.new_depth = node.new_depth + 1
+                child.new_path = StoryElementNode._get_path(node.new_path, child.new_depth, position)
+            stack.extend(reversed(node.children))
+            yield node
+
+    def write(self):
+        '''
+        Writes the tree, which must already be validated, to the database.
+        '''
+        deleted_ids = [pk for pk, node in self.nodes.items() if node.deleted and node.path is not None]
+        if deleted_ids:
+            # The treebeard queryset would adjust numchild for each deleted branch, which is rewritten below anyway.
+            models.QuerySet.delete(StoryElementNode.objects.filter(pk__in=deleted_ids))
+        created, repathed, changed = [], [], []
+        for node in self.final_nodes():
+            if node.path is None:
+                created.append(StoryElementNode(
+                    pk=node.pk, outline=self.outline, story_element_type=node.story_element_type,
+                    path=node.new_path, depth=node.new_depth, numchild=node.new_numchild, **node.fields))
+            elif (node.path, node.depth, node.numchild) != (node.new_path, node.new_depth, node.new_numchild):
+                if node.path != node.new_path:
+                    # Parked on a unique temporary path first, so no two rows share a path mid-update.
+                    repathed.append(StoryElementNode(pk=node.pk, path='~' + node.pk.hex))
+                changed.append(StoryElementNode(pk=node.pk, path=node.new_path, depth=node.new_depth,
+                                                numchild=node.new_numchild))
+        if repathed:
+            StoryElementNode.objects.bulk_update(repathed, ['path'])
+        if changed:
+            StoryElementNode.objects.bulk_update(changed, ['path', 'depth', 'numchild'])
+        if created:
+            StoryElementNode.objects.bulk_create(created)
+        logger.debug('Story tree batch deleted %d, moved %d and created %d nodes',
+                     len(deleted_ids), len(changed), len(created))
+
+
+def apply_story_tree_operations(outline, operations):
+    '''
+    Applies a list of add, move and delete operations to the story tree of an outline in a
+    single transaction. The operations are validated against
+    :data:`fiction_outlines.models.STORY_NODE_ELEMENT_DEFINITIONS` in order, before anything is
+    written. Stored impact ratings are refreshed once at the end, and a single
+    ``tree_manipulation`` signal is sent with the ``post_bulk_update`` action.
+
+    Returns a dict of ``{ref: pk}`` for the nodes added with a ``ref``.
+
+    :raises: :class:`TreeOperationError` for the first invalid operation.
+    '''
+    with transaction.atomic():
+        batch = _TreeBatch(outline)
+        batch.apply(operations)
+        with batch_tree_changes():
+            batch.write()
+        outline.refresh_impact_ratings()
+        root = StoryElementNode.objects.get(pk=batch.root.pk)
+        tree_manipulation.send(
+            sender=StoryElementNode,
+            instance=root,
+            action='post_bulk_update',
+            target_node_type=None,
+            target_node=None,
+            pos=None
+        )
+    return {ref: node.pk for ref, node in batch.added.items() if not node.deleted}
@@ -26,6 +26,12 @@ urlpatterns = [
     path('outlines/', views.OutlineListView.as_view(), name='outline_list'),
     path('outline/<uuid:outline>/', views.OutlineDetailView.as_view(), name='outline_detail'),
     path('outline/<uuid:outline>/export/<format>/', views.OutlineExport.as_view(), name='outline_export'),
+    path('outline/<uuid:outline>/export/<format>/stream/', views.OutlineExport.as_view(streaming_export=True),
+         name='outline_export_stream'),
+    path('outline/<uuid:outline>/export/<format>/job/', views.OutlineExportJobView.as_view(),
+         name='outline_export_job'),
+    path('outline/<uuid:outline>/export/<format>/download/', views.OutlineExportDownloadView.as_view(),
+         name='outline_export_download'),
     path('outline/<uuid:outline>/edit/', views.OutlineUpdateView.as_view(), name='outline_update'),
     path('outline/create/', views.OutlineCreateView.as_view(), name='outline_create'),
     path('outline/<uuid:outline>/delete/', views.OutlineDeleteView.as_view(), name='outline_delete'),
@@ -62,12 +68,16 @@ urlpatterns = [
          views.StoryNodeUpdateView.as_view(), name='storynode_update'),
     path('outline/<uuid:outline>/item/<uuid:storynode>/move/',
          views.StoryNodeMoveView.as_view(), name='storynode_move'),
+    path('outline/<uuid:outline>/item/<uuid:storynode>/move/choices/',
+         views.StoryNodeMoveChoicesView.as_view(), name='storynode_move_choices'),
     path('outline/<uuid:outline>/item/<uuid:storynode>/delete/',
          views.StoryNodeDeleteView.as_view(), name='storynode_delete'),
     path('outline/<uuid:outline>/arc/<uuid:arc>/item/<uuid:arcnode>/create/<pos>/',
          views.ArcNodeCreateView.as_view(), name='arcnode_create'),
     path('outline/<uuid:outline>/arc/<uuid:arc>/item/<uuid:arcnode>/move/',
          views.ArcNodeMoveView.as_view(), name='arcnode_move'),
+    path('outline/<uuid:outline>/arc/<uuid:arc>/item/<uuid:arcnode>/move/choices/',
+         views.ArcNodeMoveChoicesView.as_view(), name='arcnode_move_choices'),
     path('outline/<uuid:outline>/arc/<uuid:arc>/item/<uuid:arcnode>/',
          views.ArcNodeDetailView.as_view(), name='arcnode_detail'),
     path('outline/<uuid:outline>/arc/<uuid:arc>/item/<uuid:arcnode>/edit/',
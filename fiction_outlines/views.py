@@ -5,8 +5,10 @@ import logging
 from django.conf import settings
 from django.forms.models import model_to_dict
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponseRedirect, HttpResponseForbidden, Http404, JsonResponse
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden, Http404, JsonResponse
+from django.http import StreamingHttpResponse
 from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, Q
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -19,14 +21,18 @@ from rules.contrib.views import PermissionRequiredMixin
 from .models import Outline, Series, Character, CharacterInstance, Location, LocationInstance
 from .models import Arc, ArcElementNode, StoryElementNode, ArcIntegrityError
 from .signals import tree_manipulation
+from .pagination import KeysetPaginationMixin, paginate_keyset, related_count
+from .tracing import span
 from . import forms
+from . import exports
+from . import jobs
 
 # Create your views here.
 
 logger = logging.getLogger('fiction_outlines')
 
 
-class SeriesListView(LoginRequiredMixin, generic.ListView):
+class SeriesListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     '''
     Generic view for viewing a list of series objects.
     '''
@@ -35,8 +41,10 @@ class SeriesListView(LoginRequiredMixin, generic.ListView):
     context_object_name = 'series_list'
 
     def get_queryset(self):
-        return Series.objects.filter(user=self.request.user).prefetch_related(
-            'character_set', 'location_set', 'outline_set')
+        return Series.objects.visible_to(self.request.user).annotate(
+            num_outlines=related_count(Outline.objects.all(), 'series'),
+            num_characters=related_count(Character.objects.all(), 'series'),
+            num_locations=related_count(Location.objects.all(), 'series'))
 
 
 class SeriesCreateView(LoginRequiredMixin, generic.CreateView):
@@ -104,17 +112,18 @@ class SeriesDeleteView(LoginRequiredMixin, PermissionRequiredMixin, generic.edit
     pk_url_kwarg = 'series'
 
 
-class CharacterListView(LoginRequiredMixin, generic.ListView):
+class CharacterListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     '''
     Generic view for viewing character list.
     '''
     model = Character
     template_name = 'fiction_outlines/character_list.html'
     context_object_name = 'character_list'
+    orderings = {'modified': '-modified', 'title': 'name'}
 
     def get_queryset(self):
-        return Character.objects.filter(user=self.request.user).prefetch_related(
-            'characterinstance_set', 'characterinstance_set__outline', 'series')
+        return Character.objects.visible_to(self.request.user).annotate(
+            num_outlines=related_count(CharacterInstance.objects.all(), 'character')).prefetch_related('series')
 
 
 class CharacterCreateView(LoginRequiredMixin, generic.CreateView):
@@ -213,7 +222,7 @@ class CharacterInstanceListView(LoginRequiredMixin, PermissionRequiredMixin, gen
         return context
 
     def get_queryset(self):
-        return CharacterInstance.objects.filter(character=self.character).select_related(
+        return CharacterInstance.objects.visible_to(self.request.user).filter(character=self.character).select_related(
             'character', 'outline').prefetch_related('arcelementnode_set', 'storyelementnode_set')
 
 
@@ -346,16 +355,18 @@ class CharacterInstanceDeleteView(LoginRequiredMixin, PermissionRequiredMixin,
         return reverse_lazy('fiction_outlines:character_detail', kwargs={'character': self.character.pk})
 
 
-class LocationListView(LoginRequiredMixin, generic.ListView):
+class LocationListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     '''
     Generic view for locations.
     '''
     model = Location
     template_name = 'fiction_outlines/location_list.html'
     context_object_name = "location_list"
+    orderings = {'modified': '-modified', 'title': 'name'}
 
     def get_queryset(self):
-        return Location.objects.filter(user=self.request.user)
+        return Location.objects.visible_to(self.request.user).annotate(
+            num_outlines=related_count(LocationInstance.objects.all(), 'location')).prefetch_related('series')
 
 
 class LocationDetailView(LoginRequiredMixin, PermissionRequiredMixin,
@@ -462,7 +473,7 @@ class LocationInstanceListView(LoginRequiredMixin, PermissionRequiredMixin, gene
         return context
 
     def get_queryset(self):
-        return LocationInstance.objects.filter(location=self.location).select_related(
+        return LocationInstance.objects.visible_to(self.request.user).filter(location=self.location).select_related(
             'location', 'outline').prefetch_related('arcelementnode_set', 'storyelementnode_set')
 
 
@@ -599,19 +610,19 @@ class LocationInstanceDeleteView(LoginRequiredMixin, PermissionRequiredMixin,
 
 # TODO ArcElementNode, and StoryElementNode
 
-class OutlineListView(LoginRequiredMixin, SelectRelatedMixin,
-                      PrefetchRelatedMixin, generic.ListView):
+class OutlineListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     '''
     Generic view for Outline Outline list
     '''
     model = Outline
     template_name = 'fiction_outlines/outline_list.html'
-    select_related = ['series']
-    prefetch_related = ['arc_set', 'storyelementnode_set', 'characterinstance_set', 'locationinstance_set']
     context_object_name = 'outline_list'
 
     def get_queryset(self):
-        return Outline.objects.filter(user=self.request.user)
+        return Outline.objects.visible_to(self.request.user).select_related('series').annotate(
+            num_arcs=related_count(Arc.objects.all(), 'outline'),
+            num_characters=related_count(CharacterInstance.objects.all(), 'outline'),
+            num_locations=related_count(LocationInstance.objects.all(), 'outline'))
 
 
 class OutlineDetailView(LoginRequiredMixin, PermissionRequiredMixin,
@@ -623,7 +634,12 @@ class OutlineDetailView(LoginRequiredMixin, PermissionRequiredMixin,
     template_name = 'fiction_outlines/outline_detail.html'
     permission_required = 'fiction_outlines.view_outline'
     select_related = ['series']
-    prefetch_related = ['arc_set', 'characterinstance_set', 'locationinstance_set', 'storyelementnode_set']
+    prefetch_related = [
+        'arc_set',
+        'tags',
+        Prefetch('characterinstance_set', queryset=CharacterInstance.objects.select_related('character')),
+        Prefetch('locationinstance_set', queryset=LocationInstance.objects.select_related('location')),
+    ]
     pk_url_kwarg = 'outline'
     context_object_name = 'outline'
 
@@ -701,20 +717,22 @@ class ArcListView(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView)
         return super().dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Arc.objects.filter(outline=self.outline).select_related(
+        return Arc.objects.visible_to(self.request.user).filter(outline=self.outline).select_related(
             'outline').prefetch_related('arcelementnode_set')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['outline'] = self.outline
+        arc_errors = self.outline.validate_all_arcs()
+        for arc in context['arc_list']:
+            arc.__dict__['current_errors'] = arc_errors.get(arc.pk, [])
         return context
 
     def get_permission_object(self):
         return self.outline
 
 
-class ArcDetailView(LoginRequiredMixin, PermissionRequiredMixin,
-                    SelectRelatedMixin, PrefetchRelatedMixin, generic.DetailView):
+class ArcDetailView(LoginRequiredMixin, PermissionRequiredMixin, SelectRelatedMixin, generic.DetailView):
     '''
     Generic view for arc details.
     '''
@@ -722,7 +740,6 @@ class ArcDetailView(LoginRequiredMixin, PermissionRequiredMixin,
     permission_required = 'fiction_outlines.view_arc'
     template_name = 'fiction_outlines/arc_detail.html'
     select_related = ['outline']
-    prefetch_related = ['arcelementnode_set']
     pk_url_kwarg = 'arc'
     context_object_name = 'arc'
 
@@ -732,7 +749,10 @@ class ArcDetailView(LoginRequiredMixin, PermissionRequiredMixin,
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['annotated_list'] = ArcElementNode.get_annotated_list(parent=self.object.arc_root_node)
+        nodes = ArcElementNode.objects.filter(arc=self.object).annotate(
+            num_characters=Count('assoc_characters', distinct=True),
+            num_locations=Count('assoc_locations', distinct=True))
+        context['annotated_list'] = ArcElementNode.get_annotated_list_qs(nodes)
         return context
 
 
@@ -829,7 +849,7 @@ class ArcNodeDetailView(LoginRequiredMixin, PermissionRequiredMixin, SelectRelat
     template_name = 'fiction_outlines/arcnode_detail.html'
     pk_url_kwarg = 'arcnode'
     context_object_name = 'arcnode'
-    select_related = ['arc', 'arc__outline', 'story_element_node']
+    select_related = ['arc', 'story_element_node']
     prefetch_related = ['assoc_characters', 'assoc_locations']
 
 
@@ -861,7 +881,7 @@ class ArcNodeCreateView(LoginRequiredMixin, PermissionRequiredMixin, generic.Cre
     def get_success_url(self):
         if self.success_url:
             return self.success_url  # pragma: no cover
-        return reverse_lazy('fiction_outlines:arcnode_detail', kwargs={'outline': self.arc.outline.pk,
+        return reverse_lazy('fiction_outlines:arcnode_detail', kwargs={'outline': self.arc.outline_id,
                                                                        'arc': self.arc.pk, 'arcnode': self.object.pk})
 
     def form_valid(self, form):
@@ -912,7 +932,7 @@ class ArcNodeUpdateView(LoginRequiredMixin, PermissionRequiredMixin, SelectRelat
     template_name = 'fiction_outlines/arcnode_update.html'
     pk_url_kwarg = 'arcnode'
     context_object_name = 'arcnode'
-    select_related = ['arc', 'arc__outline', 'story_element_node']
+    select_related = ['arc', 'story_element_node']
     prefetch_related = ['assoc_characters', 'assoc_locations']
     form_class = forms.ArcNodeForm
     success_url = None
@@ -962,20 +982,22 @@ class ArcNodeMoveView(LoginRequiredMixin, PermissionRequiredMixin, generic.edit.
         if self.success_url:
             return self.success_url  # pragma: no cover
         url = self.object.get_absolute_url()
-        logger.debug("Found success url of %s" % url)
+        logger.debug('Found success url of %s', url)
         return url
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['root_node'] = self.object.get_root()
-        logger.debug('For object %s (%s, %s), found root node of %s (%s, %s)' % (
-            self.object.pk,
-            self.object.arc.name,
-            self.object.arc_element_type,
-            kwargs['root_node'].pk,
-            kwargs['root_node'].arc.name,
-            kwargs['root_node'].arc_element_type
-        ))
+        kwargs['choices_url'] = reverse_lazy('fiction_outlines:arcnode_move_choices', kwargs={
+            'outline': self.object.outline_id, 'arc': self.object.arc_id, 'arcnode': self.object.pk})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('For object %s (%s, %s), found root node of %s (%s, %s)',
+                         self.object.pk,
+                         self.object.arc.name,
+                         self.object.arc_element_type,
+                         kwargs['root_node'].pk,
+                         kwargs['root_node'].arc.name,
+                         kwargs['root_node'].arc_element_type)
         return kwargs
 
     def form_valid(self, form):
@@ -985,11 +1007,11 @@ class ArcNodeMoveView(LoginRequiredMixin, PermissionRequiredMixin, generic.edit.
                 self.object = form.save()
         except InvalidPosition as IP:
             form.add_error('_position', _("This is not a permitted position"))
-            logger.error(_('This is not a permitted position. \n Details: %s' % str(IP)))
+            logger.error('This is not a permitted position. \n Details: %s', IP)
             return self.form_invalid(form)
         except InvalidMoveToDescendant as IMD:
             form.add_error('_position', _("You cannot move an item to be a sibling or child of its own descendant."))
-            logger.debug(_("You cannot move item to be a sibling or child of own descendant. Details: %s" % str(IMD)))
+            logger.debug('You cannot move item to be a sibling or child of own descendant. Details: %s', IMD)
             return self.form_invalid(form)
         except PathOverflow as PO:
             form.add_error('_position', _('Apologies, there has been a database error. This has been logged.'))
@@ -998,6 +1020,74 @@ class ArcNodeMoveView(LoginRequiredMixin, PermissionRequiredMixin, generic.edit.
         return HttpResponseRedirect(self.get_success_url())
 
 
+class NodeMoveChoicesView(LoginRequiredMixin, PermissionRequiredMixin, generic.detail.BaseDetailView):
+    '''
+    Returns the nodes of a tree that a node can be moved relative to as JSON, for the lazy picker
+    of :class:`fiction_outlines.forms.OutlineMoveNodeForm`. Each response is either the children
+    of the ``parent`` path (by default, the top level below the root), or the nodes matching the
+    search in ``q``. Results are in tree order, ``paginate_by`` at a time, and ``next`` is the
+    ``cursor`` for the rest.
+
+    Each node is labelled by its ``type_field`` display value, followed by its ``name_field``
+    when that is set.
+    '''
+    paginate_by = 100
+    search_fields = ()
+    type_field = None
+    name_field = None
+
+    def get_permission_object(self):
+        self.object = self.get_object()
+        return self.object
+
+    def get_label(self, node):
+        type_label = str(getattr(node, 'get_%s_display' % self.type_field)())
+        name = getattr(node, self.name_field)
+        if name:
+            return '%s: %s' % (type_label, name)
+        return type_label
+
+    def get_choices_queryset(self):
+        steplen = self.model.steplen
+        root_path = self.object.path[:steplen]
+        queryset = self.model.objects.filter(path__startswith=root_path).only(
+            'id', 'path', 'depth', 'numchild', self.type_field, self.name_field)
+        query = self.request.GET.get('q', '').strip()
+        if query:
+            search = Q()
+            for field in self.search_fields:
+                search |= Q(**{'%s__icontains' % field: query})
+            return queryset.filter(search, depth__gt=1)
+        parent = self.request.GET.get('parent') or root_path
+        if not parent.startswith(root_path) or len(parent) % steplen:
+            raise Http404(_('Invalid parent.'))
+        return queryset.filter(path__startswith=parent, depth=len(parent) // steplen + 1)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            page = paginate_keyset(self.get_choices_queryset(), 'path', self.paginate_by,
+                                   request.GET.get('cursor') or None)
+        except ValueError:
+            raise Http404(_('Invalid cursor.'))
+        return JsonResponse({
+            'results': [{'id': str(node.pk), 'path': node.path, 'depth': node.depth,
+                         'has_children': node.numchild > 0, 'label': self.get_label(node)} for node in page],
+            'next': page.next_cursor,
+        })
+
+
+class ArcNodeMoveChoicesView(NodeMoveChoicesView):
+    '''
+    Choices for moving an arc node.
+    '''
+    model = ArcElementNode
+    permission_required = 'fiction_outlines.edit_arc_node'
+    pk_url_kwarg = 'arcnode'
+    search_fields = ('headline', 'description')
+    type_field = 'arc_element_type'
+    name_field = 'headline'
+
+
 class ArcNodeDeleteView(LoginRequiredMixin, PermissionRequiredMixin, SelectRelatedMixin,
                         PrefetchRelatedMixin, generic.edit.DeleteView):
     '''
@@ -1008,7 +1098,7 @@ class ArcNodeDeleteView(LoginRequiredMixin, PermissionRequiredMixin, SelectRelat
     template_name = 'fiction_outlines/arcnode_delete.html'
     pk_url_kwarg = 'arcnode'
     context_object_name = 'arcnode'
-    select_related = ['arc', 'arc__outline', 'story_element_node']
+    select_related = ['arc', 'story_element_node']
     prefetch_related = ['assoc_characters', 'assoc_locations']
     success_url = None
 
@@ -1188,6 +1278,8 @@ class StoryNodeMoveView(StoryNodeUpdateView):
         kwargs = super().get_form_kwargs()
         del kwargs['outline']
         kwargs['root_node'] = self.object.get_root()
+        kwargs['choices_url'] = reverse_lazy('fiction_outlines:storynode_move_choices', kwargs={
+            'outline': self.object.outline_id, 'storynode': self.object.pk})
         return kwargs
 
     def form_valid(self, form):
@@ -1215,6 +1307,18 @@ class StoryNodeMoveView(StoryNodeUpdateView):
         return HttpResponseRedirect(self.get_success_url())
 
 
+class StoryNodeMoveChoicesView(NodeMoveChoicesView):
+    '''
+    Choices for moving a story node.
+    '''
+    model = StoryElementNode
+    permission_required = 'fiction_outlines.edit_story_node'
+    pk_url_kwarg = 'storynode'
+    search_fields = ('name', 'description')
+    type_field = 'story_element_type'
+    name_field = 'name'
+
+
 class StoryNodeDeleteView(LoginRequiredMixin, PermissionRequiredMixin, SelectRelatedMixin,
                           PrefetchRelatedMixin, generic.edit.DeleteView):
     '''
@@ -1247,38 +1351,49 @@ class OutlineExport(LoginRequiredMixin, PermissionRequiredMixin, SelectRelatedMi
     Takes a url kwarg of ``outline`` as the pk of the :class:`fiction_outlines.models.Outline`
     The url kwarg of ``format`` determines the type returned.
     Current supported formats are ``opml``, ``json``, or ``md``.
+
+    If ``streaming_export`` is set, supported formats are streamed back to the client
+    while the outline is read in chunks, rather than built in memory first.
     '''
     model = Outline
     permission_required = 'fiction_outlines.view_outline'
-    template_name = 'fiction_outlines/outline.opml'
     pk_url_kwarg = 'outline'
     context_object_name = 'outline'
     select_related = ['series', 'user']
     prefetch_related = ['arc_set', 'storyelementnode_set', 'characterinstance_set', 'characterinstance_set__character',
                         'locationinstance_set', 'locationinstance_set__location', 'tags']
     default_format = 'json'
+    streaming_export = False
+    serialized_formats = ['opml', 'md']
 
     def dispatch(self, request, *args, **kwargs):
         logger.debug('Entering view!')
         self.format = self.default_format
         if 'format' in kwargs.keys():
-            logger.debug('format was specified as {}'.format(kwargs['format']))
+            logger.debug('format was specified as %s', kwargs['format'])
             self.format = kwargs['format']
+        if self.format in self.serialized_formats or (self.streaming_export and self.format == 'json'):
+            # Related records are read directly by the serializers instead.
+            self.prefetch_related = ['tags']
         return super().dispatch(request, *args, **kwargs)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['annotated_list'] = StoryElementNode.get_annotated_list(self.object.story_tree_root)
-        return context
+    def serialized_response(self, chunks, content_type, extension):
+        '''
+        Returns the output of one of the :mod:`fiction_outlines.exports` serializers as an
+        attachment, streamed if ``streaming_export`` is set.
+        '''
+        if self.streaming_export:
+            response = StreamingHttpResponse(chunks, content_type=content_type)
+        else:
+            response = HttpResponse(''.join(chunks), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(slugify(self.object.title), extension)
+        return response
 
     def return_opml_response(self, context, **response_kwargs):
         '''
         Returns export data as an opml file.
         '''
-        self.template_name = 'fiction_outlines/outline.opml'
-        response = super().render_to_response(context, content_type='text/xml', **response_kwargs)
-        response['Content-Disposition'] = 'attachment; filename="{}.opml"'.format(slugify(self.object.title))
-        return response
+        return self.serialized_response(exports.stream_outline_opml(self.object), 'text/xml', 'opml')
 
     def not_implemented(self, context, **response_kwargs):
         '''
@@ -1293,50 +1408,30 @@ class OutlineExport(LoginRequiredMixin, PermissionRequiredMixin, SelectRelatedMi
 
     def return_json_response(self, context, **request_kwargs):
         '''
-        Returns detailed outline structure as :class:`django.http.JsonResponse`.
+        Returns detailed outline structure as :class:`django.http.JsonResponse`, or
+        as a :class:`django.http.StreamingHttpResponse` of the same document if
+        ``streaming_export`` is set.
         '''
-        outline_dict = model_to_dict(self.object)
-        logger.debug(str(outline_dict))
-        logger.debug("Attepting to switch tags from queryset to name...")
-        logger.debug(str(self.object.tags.names()))
-        outline_dict.pop('tags')
-        outline_dict['tags'] = list(self.object.tags.names())
-        logger.debug(str(outline_dict))
-        if self.object.series:
-            outline_dict['series'] = model_to_dict(self.object.series)
-            outline_dict['series']['tags'] = list(self.object.series.tags.names())
-            logger.debug('Adding series... {}'.format(outline_dict['series']))
-        if self.object.characterinstance_set.count():
-            outline_dict['characters'] = []
-            for cint in self.object.characterinstance_set.all():
-                character_dict = model_to_dict(cint.character)
-                character_dict['outline_key'] = cint.pk
-                character_dict['tags'] = list(cint.character.tags.names())
-                character_dict['role_properties'] = {
-                    'main_character': cint.main_character,
-                    'pov_character': cint.pov_character,
-                    'protagonist': cint.protagonist,
-                    'antagonist': cint.antagonist,
-                    'villain': cint.villain,
-                    'obstacle': cint.obstacle,
-                }
-                outline_dict['characters'].append(character_dict)
-        if self.object.locationinstance_set.count():
-            outline_dict['locations'] = []
-            for lint in self.object.locationinstance_set.all():
-                location_dict = model_to_dict(lint.location)
-                location_dict['tags'] = list(lint.location.tags.names())
-                location_dict['outline_key'] = lint.pk
-                outline_dict['locations'].append(location_dict)
-        if self.object.arc_set.count():
-            outline_dict['arcs'] = []
-            for arc in self.object.arc_set.all():
-                arc_dict = model_to_dict(arc)
-                arc_dict['nodes'] = ArcElementNode.dump_bulk(parent=arc.arc_root_node)
-                outline_dict['arcs'].append(arc_dict)
-        outline_dict['story_tree'] = StoryElementNode.dump_bulk(parent=self.object.story_tree_root)
-        logger.debug("Sending response via JSON: {}".format(outline_dict))
-        response = JsonResponse(outline_dict)
+        if self.streaming_export:
+            response = StreamingHttpResponse(exports.stream_outline_json(self.object),
+                                             content_type='application/json')
+        else:
+            with span('export'):
+                outline_dict = exports.outline_to_dict(self.object)
+                if self.object.characterinstance_set.count():
+                    outline_dict['characters'] = [exports.character_instance_to_dict(cint)
+                                                  for cint in self.object.characterinstance_set.all()]
+                if self.object.locationinstance_set.count():
+                    outline_dict['locations'] = [exports.location_instance_to_dict(lint)
+                                                 for lint in self.object.locationinstance_set.all()]
+                if self.object.arc_set.count():
+                    outline_dict['arcs'] = []
+                    for arc in self.object.arc_set.all():
+                        arc_dict = model_to_dict(arc)
+                        arc_dict['nodes'] = exports.dump_tree(ArcElementNode, arc.arc_root_node)
+                        outline_dict['arcs'].append(arc_dict)
+                outline_dict['story_tree'] = exports.dump_tree(StoryElementNode, self.object.story_tree_root)
+                response = JsonResponse(outline_dict)
         response['Content-Disposition'] = 'attachment; filename="{}.json"'.format(slugify(self.object.title))
         return response
 
@@ -1344,11 +1439,8 @@ class OutlineExport(LoginRequiredMixin, PermissionRequiredMixin, SelectRelatedMi
         '''
         Returns the outline as a single markdown file.
         '''
-        self.template_name = 'fiction_outlines/outline.md'
-        response = super().render_to_response(context, content_type='text/markdown; charset="UTF-8"',
-                                              **response_kwargs)
-        response['Content-Disposition'] = 'attachment; filename="{}.md"'.format(slugify(self.object.title))
-        return response
+        return self.serialized_response(exports.stream_outline_markdown(self.object),
+                                        'text/markdown; charset="UTF-8"', 'md')
 
     def render_to_response(self, context, **response_kwargs):
         '''
@@ -1366,3 +1458,59 @@ class OutlineExport(LoginRequiredMixin, PermissionRequiredMixin, SelectRelatedMi
         if self.format not in switcher.keys():
             return self.not_implemented(context, **response_kwargs)
         return switcher[self.format](context, **response_kwargs)
+
+
+class OutlineExportJobView(LoginRequiredMixin, PermissionRequiredMixin, generic.DetailView):
+    '''
+    Starts a background export of an outline, and reports on its progress.
+
+    Takes url kwargs of ``outline`` and ``format``, as with :class:`OutlineExport`.
+    A ``POST`` enqueues the export, and a ``GET`` returns its status. Both respond with
+    JSON containing the ``status`` and, once the export is ready, a ``download_url``.
+    '''
+    model = Outline
+    permission_required = 'fiction_outlines.view_outline'
+    pk_url_kwarg = 'outline'
+    context_object_name = 'outline'
+
+    def status_response(self, status):
+        download_url = None
+        if status == jobs.READY:
+            download_url = str(reverse_lazy('fiction_outlines:outline_export_download',
+                                            kwargs={'outline': self.object.pk, 'format': self.kwargs['format']}))
+        return JsonResponse({'status': status, 'download_url': download_url},
+                            status=202 if status == jobs.PENDING else 200)
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        if kwargs['format'] not in jobs.EXPORT_JOB_FORMATS:
+            raise Http404
+        return self.status_response(jobs.get_export_status(self.object, kwargs['format']))
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        if kwargs['format'] not in jobs.EXPORT_JOB_FORMATS:
+            raise Http404
+        return self.status_response(jobs.enqueue_export(self.object, kwargs['format']))
+
+
+class OutlineExportDownloadView(LoginRequiredMixin, PermissionRequiredMixin, generic.DetailView):
+    '''
+    Serves the export created by :class:`OutlineExportJobView`, if it is ready and the
+    outline hasn't changed since. Otherwise, returns a 404.
+    '''
+    model = Outline
+    permission_required = 'fiction_outlines.view_outline'
+    pk_url_kwarg = 'outline'
+    context_object_name = 'outline'
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        if kwargs['format'] not in jobs.EXPORT_JOB_FORMATS:
+            raise Http404
+        artifact = jobs.get_export_artifact(self.object, kwargs['format'])
+        if artifact is None:
+            raise Http404
+        response = HttpResponse(artifact['content'], content_type=artifact['content_type'])
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(artifact['filename'])
+        return response
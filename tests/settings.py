@@ -39,6 +39,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.middleware.locale.LocaleMiddleware',
+    'fiction_outlines.ownership.OwnershipCacheMiddleware',
+    'fiction_outlines.tracing.TracingMiddleware',
 ]
 
 AUTHENTICATION_BACKENDS = (
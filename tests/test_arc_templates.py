@@ -0,0 +1,80 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from test_plus.test import TestCase
+from fiction_outlines.arc_templates import ARC_TEMPLATES, ArcTemplate, get_arc_template, register_arc_template
+from fiction_outlines.models import Arc, ArcElementNode, ArcIntegrityError, Outline
+
+
+class ArcTemplateTest(TestCase):
+    '''
+    Tests for the arc template library.
+    '''
+
+    def setUp(self):
+        self.user1 = self.make_user('u1')
+        self.outline = Outline(title='Templated', user=self.user1)
+        self.outline.save()
+
+    def tree(self, arc):
+        return [(node.depth, node.arc_element_type, node.description)
+                for node in ArcElementNode.get_tree(arc.arc_root_node)][1:]
+
+    def test_registered_templates(self):
+        '''
+        Every registered template builds valid arcs matching its definition, with a number of
+        queries that doesn't depend on the number of arcs.
+        '''
+        for name, template in ARC_TEMPLATES.items():
+            with CaptureQueriesContext(connection) as single:
+                self.outline.create_arcs([('event', '%s 1' % name)], template=name)
+            with self.assertNumQueries(len(single.captured_queries)):
+                arcs = self.outline.create_arcs([('event', '%s %d' % (name, index)) for index in range(2, 6)],
+                                                template=name)
+            expected = [(depth, arc_element_type, str(description))
+                        for path, depth, numchild, arc_element_type, description in template.batch]
+            for arc in arcs:
+                assert self.tree(arc) == expected
+                assert not arc.current_errors
+        assert ArcElementNode.find_problems() == ([], [], [], [], [])
+
+    def test_invalid_templates(self):
+        '''
+        Templates that would break the arc structure rules are rejected when they are compiled.
+        '''
+        invalid = [
+            [('mile_hook', 'Start'), ('twist', 'Nope'), ('mile_reso', 'End')],
+            [('mile_hook', 'Start'), ('mile_mid', 'Middle'), ('mile_mid', 'Middle again'), ('mile_reso', 'End')],
+            [('tf', 'Start'), ('mile_reso', 'End')],
+            [('mile_hook', 'Start'), ('mile_reso', 'End'), ('beat', 'Epilogue')],
+            [('mile_hook', 'Start'), ('mile_pt2', 'Late'), ('mile_pt1', 'Early'), ('mile_reso', 'End')],
+            [('mile_hook', 'Start'), ('tf', 'Try', [('mile_mid', 'Middle')]), ('mile_reso', 'End')],
+            [('mile_hook', 'Start', [('beat', 'Hooked')]), ('mile_reso', 'End')],
+            [],
+        ]
+        for elements in invalid:
+            with pytest.raises(ArcIntegrityError):
+                ArcTemplate('broken', 'Broken', elements)
+
+    def test_custom_template(self):
+        '''
+        A registered template can be applied by name to an existing arc.
+        '''
+        template = register_arc_template(ArcTemplate('house_style', 'House style', [
+            ('mile_hook', 'Open on the status quo.'),
+            ('tf', 'Complications.', [('beat', 'One thing goes wrong.'), ('tf', 'Then another.')]),
+            ('mile_reso', 'Close on the new status quo.'),
+        ]))
+        try:
+            assert get_arc_template('house_style') is template
+            arc = Arc(mace_type='milieu', outline=self.outline, name='House')
+            arc.save()
+            assert arc.generate_template_arc_tree(template='house_style') == 3
+            assert self.tree(arc) == [(2, 'mile_hook', 'Open on the status quo.'), (2, 'tf', 'Complications.'),
+                                      (3, 'beat', 'One thing goes wrong.'), (3, 'tf', 'Then another.'),
+                                      (2, 'mile_reso', 'Close on the new status quo.')]
+            assert not arc.current_errors
+            with pytest.raises(ArcIntegrityError):
+                arc.generate_template_arc_tree(template='house_style')
+        finally:
+            del ARC_TEMPLATES['house_style']
@@ -2,10 +2,17 @@ import io
 import json
 import re
 import django
+import pytest
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 import xml.etree.ElementTree as ET
 from test_plus import TestCase
-from fiction_outlines.models import Outline, StoryElementNode, Series
+from treebeard.exceptions import InvalidMoveToDescendant
+from fiction_outlines.models import Outline, StoryElementNode, ArcElementNode, Series
 from fiction_outlines.models import Character, CharacterInstance, Location, LocationInstance
+from fiction_outlines import exports, imports, jobs
+from fiction_outlines.receivers import flush_outline_touches
 
 
 class AbstractExportTestCase(TestCase):
@@ -95,13 +102,48 @@ class OPMLExportTestCase(AbstractExportTestCase):
         with self.login(username=self.user1.username):
             self.assertGoodView(self.view_string, **self.url_kwargs)
             assert self.last_response.get('Content-Disposition') == 'attachment; filename="dark-embrace.opml"'
-            assert self.get_context('outline') == self.o1
             print(self.last_response.content)
             try:
                 f = io.BytesIO(self.last_response.content)
-                ET.ElementTree(file=f)
+                tree = ET.ElementTree(file=f)
             except ET.ParseError as PE:
                 assert not str(PE)  # Failing the test a bit more gracefully.
+            assert tree.find('head/tags').text == 'sexy, vampire'
+            parts = tree.findall('body/outline/outline')
+            assert [part.get('text') for part in parts] == ['Part 1', 'Part 2', 'Part 3']
+            assert [chapter.get('text') for chapter in parts[0]] == ['Chapter 1', 'Chapter 2']
+            assert [scene.get('text') for scene in parts[0][0]] == ['A dark night', 'A chance meetings']
+            assert len(parts[1][0]) == 0  # Chapter 3 has no scenes.
+
+    def test_query_count(self):
+        '''
+        The number of queries does not depend on the size of the story tree.
+        '''
+        with self.login(username=self.user1.username):
+            counts = {}
+            for format in ['opml', 'md']:
+                with CaptureQueriesContext(connection) as queries:
+                    self.get(self.view_string, outline=self.o1.pk, format=format)
+                counts[format] = len(queries.captured_queries)
+            for x in range(5):
+                StoryElementNode.objects.get(pk=self.chap3.pk).add_child(
+                    name='Scene %d' % x, story_element_type='ss')
+            for format in ['opml', 'md']:
+                with CaptureQueriesContext(connection) as queries:
+                    self.get(self.view_string, outline=self.o1.pk, format=format)
+                assert len(queries.captured_queries) == counts[format]
+
+    def test_streaming(self):
+        '''
+        The streaming URL produces the same document.
+        '''
+        with self.login(username=self.user1.username):
+            for format in ['opml', 'md']:
+                self.get(self.view_string, outline=self.o1.pk, format=format)
+                expected = self.last_response.content
+                self.get('fiction_outlines:outline_export_stream', outline=self.o1.pk, format=format)
+                assert self.last_response.streaming
+                assert b''.join(self.last_response.streaming_content) == expected
 
 
 class JSONExportTestCase(AbstractExportTestCase):
@@ -148,6 +190,97 @@ class JSONExportTestCase(AbstractExportTestCase):
             assert len(data['story_tree']) > 0
 
 
+class StreamingJSONExportTestCase(AbstractExportTestCase):
+    '''
+    Tests for the streaming JSON export.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.view_string = 'fiction_outlines:outline_export_stream'
+        self.url_kwargs = {'outline': self.o1.pk, 'format': 'json'}
+        self.c1.tags.add('hero')
+        self.c2 = Character(name='Jane', user=self.user1)
+        self.c2.save()
+        self.c2int = CharacterInstance(character=self.c2, outline=self.o1, villain=True)
+        self.c2int.save()
+        self.scene1.assoc_characters.add(self.c1int, self.c2int)
+        self.scene7.assoc_locations.add(self.lint)
+        hook = self.arc1.arc_root_node.get_first_child()
+        hook.story_element_node = StoryElementNode.objects.get(pk=self.scene2.pk)
+        hook.save()
+        hook.add_child(arc_element_type='tf', description='A nested try/fail')
+
+    def test_login_required(self):
+        '''
+        You have to be logged in.
+        '''
+        self.assertLoginRequired(self.view_string, **self.url_kwargs)
+
+    def test_object_permissions(self):
+        '''
+        Ensure that unauthorized users cannot access the object.
+        '''
+        for user in self.bad_users:
+            with self.login(username=user.username):
+                self.get(self.view_string, **self.url_kwargs)
+                self.response_forbidden()
+
+    def test_matches_json_export(self):
+        '''
+        The streamed document should be identical to the in-memory one.
+        '''
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines:outline_export', **self.url_kwargs)
+            expected = self.last_response.content
+            self.get(self.view_string, **self.url_kwargs)
+            self.response_200()
+            assert self.last_response.streaming
+            assert self.last_response.get('Content-Disposition') == 'attachment; filename="dark-embrace.json"'
+            assert b''.join(self.last_response.streaming_content) == expected
+        # Small chunks exercise the boundaries between chunked reads of the trees.
+        assert ''.join(exports.stream_outline_json(self.o1, chunk_size=2)).encode() == expected
+        data = json.loads(expected)
+        assert len(data['characters']) == 2
+        assert len(data['arcs'][0]['nodes'][0]['children']) == 7
+
+    def test_export_schema(self):
+        '''
+        Fields the models derive from the rest of the outline are left out, so that nodes have
+        the same fields, in the same order, as before they were added.
+        '''
+        arc_node_fields = ['created', 'modified', 'arc_element_type', 'arc', 'headline', 'description',
+                           'story_element_node', 'assoc_characters', 'assoc_locations']
+        story_node_fields = ['created', 'modified', 'name', 'description', 'outline', 'story_element_type',
+                             'assoc_characters', 'assoc_locations']
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines:outline_export', **self.url_kwargs)
+            in_memory = json.loads(self.last_response.content)
+        streamed = json.loads(''.join(exports.stream_outline_json(self.o1)))
+        for data in (in_memory, streamed):
+            assert list(data) == ['title', 'description', 'series', 'user', 'tags', 'characters', 'locations',
+                                  'arcs', 'story_tree']
+            assert list(data['arcs'][0]) == ['mace_type', 'outline', 'name', 'nodes']
+            trees = [(arc_node_fields, data['arcs'][0]['nodes']), (story_node_fields, data['story_tree'])]
+            for fields, nodes in trees:
+                while nodes:
+                    node = nodes.pop()
+                    assert list(node['data']) == fields
+                    nodes.extend(node.get('children', []))
+
+    def test_empty_outline(self):
+        '''
+        An outline with nothing but its story root still matches.
+        '''
+        o2 = Outline(title='Nothing yet', user=self.user1)
+        o2.save()
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines:outline_export', outline=o2.pk, format='json')
+            expected = self.last_response.content
+            self.get(self.view_string, outline=o2.pk, format='json')
+            assert b''.join(self.last_response.streaming_content) == expected
+
+
 class MDExportTest(AbstractExportTestCase):
     '''
     Tests for exporting outline as markdown.
@@ -217,3 +350,264 @@ class TestBadFormat(AbstractExportTestCase):
                 self.url_kwargs['format'] = format
                 self.get(self.view_string, **self.url_kwargs)
                 self.response_404()
+
+
+@override_settings(FICTION_OUTLINES_EXPORT_JOBS_INLINE=True)
+class ExportJobTestCase(AbstractExportTestCase):
+    '''
+    Tests for background export jobs and their cached files.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.url_kwargs = {'outline': self.o1.pk, 'format': 'json'}
+
+    def test_login_required(self):
+        '''
+        You have to be logged in.
+        '''
+        self.assertLoginRequired('fiction_outlines:outline_export_job', **self.url_kwargs)
+        self.assertLoginRequired('fiction_outlines:outline_export_download', **self.url_kwargs)
+
+    def test_object_permissions(self):
+        '''
+        Ensure that unauthorized users cannot start or download an export.
+        '''
+        for user in self.bad_users:
+            with self.login(username=user.username):
+                self.post('fiction_outlines:outline_export_job', **self.url_kwargs)
+                self.response_forbidden()
+                self.get('fiction_outlines:outline_export_download', **self.url_kwargs)
+                self.response_forbidden()
+
+    def test_export_job(self):
+        '''
+        Run an export job and download the result.
+        '''
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines:outline_export', **self.url_kwargs)
+            expected = self.last_response.content
+            self.get('fiction_outlines:outline_export_job', **self.url_kwargs)
+            assert json.loads(self.last_response.content) == {'status': 'not_started', 'download_url': None}
+            self.get('fiction_outlines:outline_export_download', **self.url_kwargs)
+            self.response_404()
+            self.post('fiction_outlines:outline_export_job', **self.url_kwargs)
+            status = json.loads(self.last_response.content)
+            assert status['status'] == 'ready'
+            self.get(status['download_url'])
+            self.response_200()
+            assert self.last_response.content == expected
+            assert self.last_response.get('Content-Disposition') == 'attachment; filename="dark-embrace.json"'
+            # A cached file is served without running the export again.
+            with self.assertNumQueries(1):
+                assert jobs.enqueue_export(self.o1, 'json') == 'ready'
+            self.post('fiction_outlines:outline_export_job', outline=self.o1.pk, format='xlsx')
+            self.response_404()
+
+    def test_changes_invalidate_export(self):
+        '''
+        Editing anything in the outline means the cached export is out of date.
+        '''
+        jobs.enqueue_export(self.o1, 'md')
+        assert jobs.get_export_status(self.o1, 'md') == 'ready'
+        changes = [
+            lambda: StoryElementNode.objects.get(pk=self.scene1.pk).save(),
+            lambda: StoryElementNode.objects.get(pk=self.scene1.pk).assoc_characters.add(self.c1int),
+            lambda: StoryElementNode.objects.get(pk=self.scene7.pk).move(
+                StoryElementNode.objects.get(pk=self.chap1.pk), 'last-child'),
+            lambda: self.c1.tags.add('brooding'),
+            lambda: self.o1.tags.remove('sexy'),
+        ]
+        for change in changes:
+            change()
+            assert jobs.get_export_status(self.o1, 'md') == 'not_started'
+            assert jobs.enqueue_export(self.o1, 'md') == 'ready'
+        artifact = jobs.get_export_artifact(self.o1, 'md')
+        assert artifact['content'] == ''.join(exports.stream_outline_markdown(self.o1))
+
+    def test_touch_after_changes(self):
+        '''
+        The outline is marked as modified once for all the changes in a transaction, after they
+        have been written, and not for changes that are rolled back.
+        '''
+        hook = ArcElementNode.objects.get(arc=self.arc1, arc_element_type='mile_hook')
+        tf = hook.add_sibling(pos='right', arc_element_type='tf', description='Try')
+        beat = ArcElementNode.objects.get(pk=tf.pk).add_child(arc_element_type='beat', description='Fail')
+        flush_outline_touches()
+        modified = Outline.objects.get(pk=self.o1.pk).modified
+        with pytest.raises(InvalidMoveToDescendant):
+            with transaction.atomic():
+                ArcElementNode.objects.get(pk=tf.pk).move(ArcElementNode.objects.get(pk=beat.pk), 'first-child')
+        with self.assertNumQueries(0):
+            flush_outline_touches()
+        assert Outline.objects.get(pk=self.o1.pk).modified == modified
+        ArcElementNode.objects.get(pk=beat.pk).move(ArcElementNode.objects.get(pk=hook.pk), 'last-child')
+        for node in StoryElementNode.objects.filter(outline=self.o1):
+            node.save()
+        self.c1.save()
+        with self.assertNumQueries(1):
+            flush_outline_touches()
+        assert Outline.objects.get(pk=self.o1.pk).modified > modified
+
+    def test_delete_outline(self):
+        '''
+        Nothing is kept up to date for the records deleted along with an outline, so deleting a
+        larger outline takes no more queries.
+        '''
+        hook = ArcElementNode.objects.get(arc=self.arc1, arc_element_type='mile_hook')
+        hook.story_element_node = StoryElementNode.objects.get(pk=self.scene1.pk)
+        hook.save()
+        larger = self.o1.clone()
+        chapter = StoryElementNode.objects.get(outline=larger, name='Chapter 5')
+        for index, arc_node in enumerate(ArcElementNode.objects.filter(outline=larger, depth=2)):
+            arc_node.story_element_node = chapter.add_child(name='Scene %d' % index, story_element_type='ss')
+            arc_node.save()
+            chapter = StoryElementNode.objects.get(pk=chapter.pk)
+        flush_outline_touches()
+        with CaptureQueriesContext(connection) as queries:
+            Outline.objects.get(pk=self.o1.pk).delete()
+        assert not [query for query in queries.captured_queries if query['sql'].startswith(
+            ('UPDATE "fiction_outlines_outline"', 'UPDATE "fiction_outlines_storyelementnode"'))]
+        with self.assertNumQueries(len(queries.captured_queries)):
+            Outline.objects.get(pk=larger.pk).delete()
+        with self.assertNumQueries(0):
+            flush_outline_touches()
+
+
+def normalized_export(outline):
+    '''
+    Returns the JSON export of an outline with keys and timestamps replaced by names,
+    so that exports of equivalent outlines compare equal.
+    '''
+    data = json.loads(''.join(exports.stream_outline_json(outline)))
+    names = {}
+    for item in data.get('characters', []) + data.get('locations', []):
+        names[item.pop('outline_key')] = item.pop('name')
+        item.pop('user')
+    for node, parent, depth, position in imports.walk_tree(data['story_tree']):
+        names[node['id']] = node['data']['name']
+    trees = [data['story_tree']] + [arc['nodes'] for arc in data.get('arcs', [])]
+    for tree in trees:
+        for node, parent, depth, position in imports.walk_tree(tree):
+            node.pop('id')
+            for key in ('created', 'modified', 'outline', 'arc'):
+                node['data'].pop(key, None)
+            for field in ('assoc_characters', 'assoc_locations'):
+                node['data'][field] = sorted(names[key] for key in node['data'][field])
+            if node['data'].get('story_element_node'):
+                node['data']['story_element_node'] = names[node['data']['story_element_node']]
+    for arc in data.get('arcs', []):
+        arc.pop('outline')
+    data.pop('user')
+    if data.get('series'):
+        data['series'].pop('user')
+    return data
+
+
+class OutlineImportTestCase(AbstractExportTestCase):
+    '''
+    Tests for importing outlines from the JSON export.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.c1.tags.add('hero')
+        self.c2 = Character(name='Jane', user=self.user1)
+        self.c2.save()
+        self.c2int = CharacterInstance(character=self.c2, outline=self.o1, villain=True)
+        self.c2int.save()
+        self.scene1.assoc_characters.add(self.c1int)
+        self.scene7.assoc_locations.add(self.lint)
+        hook = self.arc1.arc_root_node.get_first_child()
+        hook.story_element_node = StoryElementNode.objects.get(pk=self.scene2.pk)
+        hook.save()
+        hook.assoc_characters.add(self.c2int)
+        tf = hook.add_child(arc_element_type='tf', description='A nested try/fail')
+        tf.story_element_node = StoryElementNode.objects.get(pk=self.scene2.pk)
+        tf.save()
+        self.export = ''.join(exports.stream_outline_json(self.o1))
+
+    def test_round_trip(self):
+        '''
+        Importing an export creates an equivalent outline for the importing user.
+        '''
+        imported = imports.import_outline(self.export, self.user2)
+        assert imported.pk != self.o1.pk
+        assert imported.user == self.user2
+        assert imported.series.user == self.user2
+        assert normalized_export(imported) == normalized_export(self.o1)
+        assert Character.objects.filter(user=self.user2).count() == 2
+        assert Location.objects.filter(user=self.user2).count() == 1
+        assert imported.story_tree_root.get_descendant_count() == self.o1.story_tree_root.get_descendant_count()
+        assert all(not problems for problems in StoryElementNode.find_problems())
+        assert all(not problems for problems in ArcElementNode.find_problems())
+        # Characters of an arc element are also added to its story node.
+        scene = StoryElementNode.objects.get(outline=imported, name='A chance meetings')
+        assert [cint.character.name for cint in scene.assoc_characters.all()] == ['Jane']
+        assert imported.validate_all_arcs().keys() == set(imported.arc_set.values_list('pk', flat=True))
+
+    def test_query_count(self):
+        '''
+        The number of queries does not grow with the size of the outline.
+        '''
+        data = json.loads(self.export)
+        with CaptureQueriesContext(connection) as small_import:
+            imports.import_outline(data, self.user2)
+        chapter = data['story_tree'][0]['children'][0]['children'][0]
+        for index in range(20):
+            scene = json.loads(json.dumps(chapter['children'][0]))
+            scene['id'] = 'extra-%d' % index
+            chapter['children'].append(scene)
+        with CaptureQueriesContext(connection) as large_import:
+            imported = imports.import_outline(data, self.user2)
+        assert len(large_import) == len(small_import)
+        assert imported.story_tree_root.get_descendant_count() == self.o1.story_tree_root.get_descendant_count() + 20
+
+    def test_invalid_data(self):
+        '''
+        Invalid data is rejected with every problem listed, and nothing is written.
+        '''
+        outline_count = Outline.objects.count()
+        data = json.loads(self.export)
+        part = data['story_tree'][0]['children'][0]
+        part['children'][0]['data']['story_element_type'] = 'book'
+        hook = data['arcs'][0]['nodes'][0]['children'][0]
+        hook['children'][0]['data']['arc_element_type'] = 'mile_pt1'
+        hook['data']['assoc_locations'] = [data['characters'][0]['outline_key']]
+        with self.assertRaises(imports.OutlineImportError) as context:
+            imports.import_outline(data, self.user2)
+        assert len(context.exception.errors) == 4
+        assert Outline.objects.count() == outline_count
+        del data['story_tree'][0]
+        with self.assertRaises(imports.OutlineImportError):
+            imports.import_outline(data, self.user2)
+        assert Outline.objects.count() == outline_count
+
+    def test_clone(self):
+        '''
+        A clone is an equivalent outline for the same user, made in a number of queries that
+        doesn't grow with the size of the outline, and leaves the original untouched.
+        '''
+        original = normalized_export(self.o1)
+        with CaptureQueriesContext(connection) as small_clone:
+            clone = self.o1.clone()
+        for index in range(10):
+            StoryElementNode.objects.get(pk=self.chap1.pk).add_child(name='Extra %d' % index, story_element_type='ss')
+        with self.assertNumQueries(len(small_clone)):
+            larger_clone = self.o1.clone(title='Dark Embrace, revised')
+        assert clone.pk != self.o1.pk
+        assert clone.user == self.user1
+        assert clone.series == self.s1
+        assert normalized_export(clone) == original
+        assert normalized_export(larger_clone) == dict(normalized_export(self.o1), title='Dark Embrace, revised')
+        assert sorted(clone.tags.names()) == ['sexy', 'vampire']
+        assert all(not problems for problems in StoryElementNode.find_problems())
+        assert all(not problems for problems in ArcElementNode.find_problems())
+        assert not ArcElementNode.objects.filter(outline=clone).exclude(story_element_node__outline=clone).exclude(
+            story_element_node__isnull=True).exists()
+        assert clone.compute_impact_ratings() == dict(
+            StoryElementNode.objects.filter(outline=clone).values_list('pk', 'impact_rating'))
+        assert clone.validate_all_arcs().keys() == set(clone.arc_set.values_list('pk', flat=True))
+        assert CharacterInstance.objects.filter(character=self.c2).count() == 3
+        self.o1.delete()
+        assert normalized_export(Outline.objects.get(pk=clone.pk)) == original
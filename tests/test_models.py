@@ -3,11 +3,15 @@ Tests for Outline models
 '''
 import pytest
 from test_plus.test import TestCase
-from django.db import transaction
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.db.utils import IntegrityError
 from django.forms.models import model_to_dict
 from fiction_outlines.models import Arc, Character, CharacterInstance, Location, LocationInstance, ArcIntegrityError
 from fiction_outlines.models import ArcElementNode, Outline, StoryElementNode, ARC_NODE_ELEMENT_DEFINITIONS
+from fiction_outlines.models import IMPACT_VALUES
+from fiction_outlines.headlines import generate_headline, generate_headlines
+from fiction_outlines.receivers import flush_outline_touches
 from .models import TimeStamp
 
 
@@ -66,6 +70,29 @@ class ArcModelTest(TestCase):
         self.loc3_int = LocationInstance(location=self.loc3, outline=self.ms2)
         self.loc3_int.save()
 
+    def test_arc_node_outline_kept_in_sync(self):
+        '''
+        Arc nodes carry the outline of their arc, which follows the arc if it moves.
+        '''
+        arc = self.ms1.create_arc(mace_type='event', name='I ate something gross')
+        assert set(ArcElementNode.objects.filter(arc=arc).values_list('outline', flat=True)) == {self.ms1.pk}
+        node = ArcElementNode.objects.filter(arc=arc, depth=2).first()
+        with self.assertNumQueries(0):
+            node.get_absolute_url()
+        story_node = StoryElementNode.objects.get(outline=self.ms2).add_child(story_element_type='chapter')
+        node.story_element_node_id = story_node.pk
+        with pytest.raises(IntegrityError):
+            with transaction.atomic():
+                node.save()
+        arc = Arc.objects.get(pk=arc.pk)
+        arc.outline = self.ms2
+        arc.save()
+        assert set(ArcElementNode.objects.filter(arc=arc).values_list('outline', flat=True)) == {self.ms2.pk}
+        node = ArcElementNode.objects.get(pk=node.pk)
+        node.story_element_node = story_node
+        node.save()
+        assert ArcElementNode.objects.get(pk=node.pk).story_element_node_id == story_node.pk
+
     def test_arc_initial_tree_created(self):
         '''
         Ensure that creating an Arc also creates the root element of the tree.
@@ -86,6 +113,38 @@ class ArcModelTest(TestCase):
         with pytest.raises(ArcIntegrityError):
             arc_sample.generate_template_arc_tree()
 
+    def test_create_arcs_in_bulk(self):
+        '''
+        Arcs created together get the same trees as those created one at a time, with a
+        number of queries that doesn't depend on the number of arcs.
+        '''
+        with CaptureQueriesContext(connection) as single:
+            single_arc = self.ms1.create_arcs([('event', 'Alone')])[0]
+        with self.assertNumQueries(len(single.captured_queries)):
+            arcs = self.ms1.create_arcs([('milieu', 'Town'), ('character', 'Growing up'), ('answer', 'Whodunnit')])
+        assert [arc.name for arc in Arc.objects.filter(outline=self.ms1).order_by('name')] == [
+            'Alone', 'Growing up', 'Town', 'Whodunnit']
+        expected = [(node.depth, node.arc_element_type, node.description, node.headline)
+                    for node in ArcElementNode.get_tree(single_arc.arc_root_node)][1:]
+        for arc in arcs:
+            assert arc.arc_root_node.numchild == 7
+            assert not arc.current_errors
+            assert [(node.depth, node.arc_element_type, node.description, node.headline)
+                    for node in ArcElementNode.get_tree(arc.arc_root_node)][1:] == expected
+        for node in ArcElementNode.objects.filter(arc__in=arcs):
+            headline = node.headline
+            node.headline = None
+            node.save()
+            assert node.headline == headline
+        # An arc with an empty root gets its milestones beneath that root.
+        arc = Arc(mace_type='event', outline=self.ms1, name='Rootless')
+        arc.save()
+        root = ArcElementNode.add_root(arc_element_type='root', description='root of arc Rootless', arc=arc)
+        assert arc.generate_template_arc_tree() == 7
+        assert arc.arc_root_node.pk == root.pk
+        assert arc.arc_root_node.get_children().count() == 7
+        assert ArcElementNode.find_problems() == ([], [], [], [], [])
+
     def test_arcelement_headline_generated(self):
         '''
         Ensure a headline is generated appropriately.
@@ -108,6 +167,40 @@ class ArcModelTest(TestCase):
         arc_hook.save()
         assert arc_hook.headline == "I ate some clams."
 
+    def test_headlines_for_bulk_writes(self):
+        '''
+        Bulk inserts and updates of arc elements get the same headlines as single saves.
+        '''
+        descriptions = [
+            'I ate some clams.\n\nThey were yummy.',
+            ' '.join('word%d' % index for index in range(30)) + '\nSecond line',
+            'x' * 300,
+            '\nStarts with a blank line',
+            'A few words\tspread  out   oddly ',
+        ]
+        arc = self.ms1.create_arc(mace_type='event', name='Bulky')
+        root = ArcElementNode.objects.get(arc=arc, depth=1)
+        saved = []
+        for description in descriptions:
+            root = ArcElementNode.objects.get(pk=root.pk)
+            saved.append(root.add_child(arc_element_type='beat', description=description).headline)
+        assert saved == generate_headlines(descriptions)
+        assert saved[1] == ' '.join('word%d' % index for index in range(20)) + ' …'
+        assert len(saved[2]) == 250
+        nodes = [ArcElementNode(arc=arc, outline=self.ms1, arc_element_type='beat', description=description,
+                                path=ArcElementNode._get_path(root.path, 2, 20 + index), depth=2)
+                 for index, description in enumerate(descriptions)]
+        with self.assertNumQueries(1):
+            ArcElementNode.objects.bulk_create(nodes)
+        assert [node.headline for node in ArcElementNode.objects.filter(pk__in=[node.pk for node in nodes])] == saved
+        for node in nodes:
+            node.description = 'Rewritten %s' % node.description
+        ArcElementNode.objects.bulk_update(nodes, ['description'])
+        assert [node.headline for node in ArcElementNode.objects.filter(pk__in=[node.pk for node in nodes])] == [
+            generate_headline(node.description) for node in nodes]
+        ArcElementNode.objects.filter(pk=nodes[0].pk).update(description='Updated in place.\nMore.')
+        assert ArcElementNode.objects.get(pk=nodes[0].pk).headline == 'Updated in place.'
+
     def test_duplicate_milestones_blocked(self):
         '''
         Ensures that you can't add two of the same milestone type to an arc.
@@ -138,7 +231,8 @@ class ArcModelTest(TestCase):
         def get(node_id): return ArcElementNode.objects.get(pk=node_id)
         arc_sample = self.ms1.create_arc(mace_type='event', name='I ate something gross')
         assert arc_sample.current_errors == []
-        arc_errors = arc_sample.fetch_arc_errors()
+        with self.assertNumQueries(1):
+            arc_errors = arc_sample.fetch_arc_errors()
         assert arc_errors == []  # Default template should contain zero errors.
         # For readability's sake, let's extract all the milestones into named
         # python objects instead of positionals.
@@ -289,6 +383,13 @@ class ArcModelTest(TestCase):
         # but is otherwise valid.
         assert get(pt1.pk).get_descendants().count() == 3
         # All of the tf's children should have moved under this.
+        # Validating the whole outline matches validating each arc.
+        other_arc = self.ms1.create_arc(mace_type='milieu', name='A new city')
+        with self.assertNumQueries(1):
+            outline_errors = self.ms1.validate_all_arcs()
+        assert len(outline_errors[arc_sample.pk]) == 4
+        assert outline_errors[arc_sample.pk] == arc_sample.fetch_arc_errors()
+        assert outline_errors[other_arc.pk] == []
 
         def test_character_location_origin(self):
             '''
@@ -526,6 +627,109 @@ class StoryTreeModelTest(TestCase):
         except(IntegrityError):
             pass
 
+    def test_same_outline_validation_batched(self):
+        '''
+        Outline checks run one query however many instances are added, and report every
+        instance from another outline.
+        '''
+        char5 = Character(name='Lurker', user=self.user2)
+        char5.save()
+        char5_int = CharacterInstance(character=char5, outline=self.ms2)
+        char5_int.save()
+        story_root = StoryElementNode.objects.get(outline=self.ms1)
+        story_node = story_root.add_child(story_element_type='chapter', outline=self.ms1)
+        try:
+            with transaction.atomic():
+                with pytest.raises(IntegrityError) as error:
+                    story_node.assoc_characters.add(self.char1_int, self.char4_int, char5_int)
+        except(IntegrityError):
+            pass
+        assert str(self.char4_int.pk) in str(error.value)
+        assert str(char5_int.pk) in str(error.value)
+        assert str(self.char1_int.pk) not in str(error.value)
+        try:
+            with transaction.atomic():
+                with pytest.raises(IntegrityError):
+                    self.char4_int.arcelementnode_set.add(*self.arc_nodes)
+        except(IntegrityError):
+            pass
+        first_node = StoryElementNode.objects.get(pk=story_node.pk)
+        second_node = StoryElementNode.objects.get(pk=story_root.add_child(
+            story_element_type='chapter', outline=self.ms1).pk)
+        with CaptureQueriesContext(connection) as single_add:
+            first_node.assoc_characters.add(self.char1_int)
+        with CaptureQueriesContext(connection) as multiple_add:
+            second_node.assoc_characters.add(self.char1_int, self.char2_int, self.char3_int)
+        assert len(multiple_add) == len(single_add)
+
+    def test_arc_node_instances_propagated_in_bulk(self):
+        '''
+        Linking an arc node to a story node copies its characters and locations with a fixed
+        number of queries, and links added from the instance side reach every story node.
+        '''
+        story_root = StoryElementNode.objects.get(outline=self.ms1)
+        first_node = story_root.add_child(story_element_type='chapter', outline=self.ms1)
+        second_node = StoryElementNode.objects.get(pk=story_root.pk).add_child(
+            story_element_type='chapter', outline=self.ms1)
+        first_arc_node = ArcElementNode.objects.select_related('arc').get(pk=self.arc_nodes[0].pk)
+        second_arc_node = ArcElementNode.objects.select_related('arc').get(pk=self.arc_nodes[1].pk)
+        second_arc_node.assoc_characters.add(self.char1_int, self.char3_int)
+        second_arc_node.assoc_locations.add(self.loc1_int, self.loc3_int)
+        first_arc_node.story_element_node = first_node
+        with CaptureQueriesContext(connection) as single_links:
+            first_arc_node.save()
+        second_arc_node.story_element_node = second_node
+        with CaptureQueriesContext(connection) as multiple_links:
+            second_arc_node.save()
+        assert len(multiple_links) == len(single_links)
+        assert set(first_node.assoc_characters.all()) == {self.char1_int}
+        assert set(second_node.assoc_characters.all()) == {self.char1_int, self.char2_int, self.char3_int}
+        assert set(second_node.assoc_locations.all()) == {self.loc1_int, self.loc2_int, self.loc3_int}
+        char5 = Character(name='Bystander', user=self.user1)
+        char5.save()
+        char5_int = CharacterInstance(character=char5, outline=self.ms1)
+        char5_int.save()
+        char5_int.arcelementnode_set.add(first_arc_node, second_arc_node)
+        assert char5_int in first_node.assoc_characters.all()
+        assert char5_int in second_node.assoc_characters.all()
+
+    def test_dirty_field_tracking(self):
+        '''
+        Nodes know which tracked fields changed since they were loaded, so that saving only
+        a new description skips the receivers that depend on other fields.
+        '''
+        story_root = StoryElementNode.objects.get(outline=self.ms1)
+        story_node = story_root.add_child(story_element_type='chapter', outline=self.ms1)
+        arc_node = ArcElementNode.objects.get(pk=self.arc_nodes[0].pk)
+        assert arc_node.get_dirty_fields() == set()
+        arc_node.description = 'Everything changes.\nFor everyone.'
+        assert arc_node.get_dirty_fields() == {'description'}
+        flush_outline_touches()
+        modified = Outline.objects.get(pk=self.ms1.pk).modified
+        # A single update for the node. The outline is marked as modified when the transaction commits.
+        with self.assertNumQueries(1):
+            arc_node.save()
+        with self.assertNumQueries(1):
+            flush_outline_touches()
+        assert Outline.objects.get(pk=self.ms1.pk).modified > modified
+        assert arc_node.headline == 'Everything changes.'
+        assert arc_node.get_dirty_fields() == set()
+        arc_node.headline = 'A custom headline'
+        arc_node.save()
+        assert ArcElementNode.objects.get(pk=arc_node.pk).headline == 'A custom headline'
+        arc_node.story_element_node = story_node
+        assert arc_node.get_dirty_fields() == {'story_element_node_id'}
+        arc_node.save()
+        assert set(story_node.assoc_characters.all()) == {self.char1_int}
+        assert StoryElementNode.objects.get(pk=story_node.pk).impact_rating > IMPACT_VALUES['base']
+        deferred = ArcElementNode.objects.only('pk', 'description').get(pk=arc_node.pk)
+        assert deferred.get_dirty_fields() == {'arc_element_type', 'story_element_node_id', 'arc_id'}
+        # Loading a deferred field records its value too.
+        assert deferred.arc_element_type == arc_node.arc_element_type
+        deferred.refresh_from_db(fields=['story_element_node', 'arc'])
+        assert deferred.get_dirty_fields() == set()
+        assert ArcElementNode(arc=self.arc, description='new').get_dirty_fields() == set(ArcElementNode.tracked_fields)
+
     def test_story_node_on_descendant_updated(self):
         '''
         Test that a parent story node returns the values for characters, locations,
@@ -593,6 +797,16 @@ class StoryTreeModelTest(TestCase):
         assert get(part1.pk).all_locations.count() == 2
         assert get(act1.pk).all_locations.count() == 2
         assert get(book1.pk).all_locations.count() == 2
+        book1 = get(book1.pk)
+        with self.assertNumQueries(1):
+            assert set(book1.all_characters) == {self.char1_int, self.char2_int}
+        # The outline wide map agrees with every node.
+        with self.assertNumQueries(3):
+            instances = self.ms1.compute_story_tree_instances()
+        for node in StoryElementNode.objects.filter(outline=self.ms1):
+            assert instances[node.pk]['characters'] == {c.pk for c in node.all_characters}
+            assert instances[node.pk]['locations'] == {loc.pk for loc in node.all_locations}
+        assert instances[book1.pk]['locations'] == {self.loc1_int.pk, self.loc2_int.pk}
 
     def test_story_element_generation_rules_for_move(self):
         '''
@@ -940,7 +1154,8 @@ class MACENestTest(TestCase):
         arc1pt2 = ArcElementNode.objects.get(arc=arc1, arc_element_type='mile_pt2')
         arc1pt2.story_element_node = get_st(scenes['scene 5'].pk)
         arc1pt2.save()
-        error_dict = self.ms1.validate_nesting()
+        with self.assertNumQueries(2):
+            error_dict = self.ms1.validate_nesting()
         assert error_dict['nest_arc_seq']['error_message'] == "Arc element milestones are out of sequence"
         assert (list(error_dict['nest_arc_seq']['offending_arcs'][0]['offending_nodes']) ==
                 [
@@ -948,6 +1163,21 @@ class MACENestTest(TestCase):
                     get_st(scenes['scene 5'].pk),
                     get_st(scenes['scene 8'].pk),
                     get_st(scenes['scene 15'].pk)])
+        # Each arc out of sequence gets its own entry.
+        arc2pt1 = ArcElementNode.objects.get(arc=arc2, arc_element_type='mile_pt1')
+        arc2pt1.story_element_node = get_st(scenes['scene 13'].pk)
+        arc2pt1.save()
+        arc2pnch1 = ArcElementNode.objects.get(arc=arc2, arc_element_type='mile_pnch1')
+        arc2pnch1.story_element_node = get_st(scenes['scene 4'].pk)
+        arc2pnch1.save()
+        error_dict = self.ms1.validate_nesting()
+        assert len(error_dict['nest_arc_seq']['offending_arcs']) == 2
+        assert (error_dict['nest_arc_seq']['offending_arcs'][1]['offending_nodes'] ==
+                [
+                    get_st(scenes['scene 2'].pk),
+                    get_st(scenes['scene 4'].pk),
+                    get_st(scenes['scene 13'].pk),
+                    get_st(scenes['scene 14'].pk)])
 
     def testStoryImpactCalculation(self):
         '''
@@ -1044,3 +1274,30 @@ class MACENestTest(TestCase):
         assert get_st(chap3.pk).impact_rating == 3.75
         assert get_st(part2.pk).impact_rating == 2.0625
         assert get_st(part1.pk).impact_rating == 2.0625
+        # The outline-level engine should agree with the per-node property everywhere.
+        with self.assertNumQueries(2):
+            ratings = self.ms1.compute_impact_ratings()
+        story_nodes = StoryElementNode.objects.filter(outline=self.ms1)
+        assert len(ratings) == story_nodes.count()
+        for node in story_nodes:
+            assert ratings[node.pk] == node.impact_rating == node.calculate_impact_rating()
+        # Moving a scene and deleting a chapter keeps the stored ratings current.
+        get_st(scenes['scene 3'].pk).move(get_st(chap4.pk), 'first-child')
+        get_st(chap1.pk).delete()
+        ratings = self.ms1.compute_impact_ratings()
+        for node in StoryElementNode.objects.filter(outline=self.ms1):
+            assert ratings[node.pk] == node.impact_rating == node.calculate_impact_rating()
+        assert get_st(chap4.pk).impact_rating > 0.5  # Picked up the bleed from scene 3.
+        assert self.ms1.refresh_impact_ratings() == 0  # Nothing should be stale.
+        # Moving beat 1 out from under the midpoint loses scene 5 the milestone bonus.
+        scene5_rating = get_st(scenes['scene 5'].pk).impact_rating
+        get_ae(beat1.pk).move(get_ae(arc1mid.pk), 'right')
+        assert get_st(scenes['scene 5'].pk).impact_rating < scene5_rating
+        # Deleting several scenes at once takes their bleed away from the chapter.
+        chap3_rating = get_st(chap3.pk).impact_rating
+        StoryElementNode.objects.filter(pk__in=[scenes['scene 5'].pk, scenes['scene 6'].pk]).delete()
+        assert get_st(chap3.pk).impact_rating == 2.5 < chap3_rating
+        ratings = self.ms1.compute_impact_ratings()
+        for node in StoryElementNode.objects.filter(outline=self.ms1):
+            assert ratings[node.pk] == node.impact_rating == node.calculate_impact_rating()
+        assert self.ms1.refresh_impact_ratings() == 0
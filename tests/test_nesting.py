@@ -0,0 +1,66 @@
+import random
+from itertools import combinations
+from django.test import SimpleTestCase
+from fiction_outlines.nesting import find_conflicting_arcs, find_conflicting_pairs
+
+
+def brute_force_pairs(intervals):
+    '''
+    Compare every pair of arcs directly.
+    '''
+    pairs = []
+    for a, b in combinations(intervals.keys(), 2):
+        (a_entry, a_exit), (b_entry, b_exit) = intervals[a], intervals[b]
+        if a_entry == b_entry or a_exit == b_exit:
+            continue
+        if a_entry > b_entry:
+            a, b, a_exit, b_exit = b, a, b_exit, a_exit
+        if a_exit < b_exit:
+            pairs.append((a, b))
+    return pairs
+
+
+class NestingAnalysisTest(SimpleTestCase):
+    '''
+    Tests for the database independent arc nesting checks.
+    '''
+
+    def test_nested_arcs(self):
+        intervals = {'outer': (0, 10), 'middle': (1, 9), 'inner': (2, 3)}
+        assert find_conflicting_arcs(intervals) == []
+        assert find_conflicting_pairs(intervals) == []
+
+    def test_shared_points_are_ignored(self):
+        intervals = {'a': (0, 10), 'b': (0, 12), 'c': (2, 10)}
+        assert find_conflicting_arcs(intervals) == []
+        assert find_conflicting_pairs(intervals) == []
+
+    def test_every_pair_reported(self):
+        intervals = {'a': (0, 5), 'b': (1, 6), 'c': (2, 7), 'd': (3, 4), 'e': (8, 9)}
+        assert find_conflicting_arcs(intervals) == ['a', 'b', 'c', 'd', 'e']
+        assert find_conflicting_pairs(intervals) == [
+            ('a', 'b'), ('a', 'c'), ('a', 'e'), ('b', 'c'), ('b', 'e'), ('c', 'e'), ('d', 'e')]
+
+    def test_resolving_in_introduction_order(self):
+        intervals = {'first': (0, 2), 'second': (4, 6)}
+        assert find_conflicting_arcs(intervals) == ['first', 'second']
+        assert find_conflicting_pairs(intervals) == [('first', 'second')]
+
+    def test_empty(self):
+        assert find_conflicting_arcs({}) == []
+        assert find_conflicting_pairs({}) == []
+
+    def test_matches_pairwise_comparison(self):
+        rng = random.Random(42)
+        for trial in range(50):
+            intervals = {}
+            for key in range(rng.randint(1, 40)):
+                entry = rng.randint(0, 30)
+                intervals[key] = (entry, entry + rng.randint(0, 30))
+            expected = brute_force_pairs(intervals)
+            pairs = find_conflicting_pairs(intervals)
+            assert sorted(pairs) == sorted(expected)
+            order = {key: index for index, key in enumerate(sorted(intervals, key=intervals.get))}
+            assert pairs == sorted(pairs, key=lambda pair: (order[pair[0]], order[pair[1]]))
+            assert (sorted(find_conflicting_arcs(intervals)) ==
+                    sorted({key for pair in expected for key in pair}))
@@ -0,0 +1,135 @@
+from test_plus.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from fiction_outlines.models import Outline, Character, CharacterInstance, Location, LocationInstance
+from fiction_outlines.models import Arc, ArcElementNode, StoryElementNode
+from fiction_outlines import ownership
+
+
+class OwnershipTestCase(TestCase):
+    '''
+    Sets up an outline with objects of every kind for a single owner.
+    '''
+
+    def setUp(self):
+        self.user1 = self.make_user('u1')
+        self.user2 = self.make_user('u2')
+        self.o1 = Outline(title='Dark Embrace', user=self.user1)
+        self.o1.save()
+        self.c1 = Character(name='John', user=self.user1)
+        self.c1.save()
+        self.c1int = CharacterInstance(character=self.c1, outline=self.o1)
+        self.c1int.save()
+        self.l1 = Location(name='Bar', user=self.user1)
+        self.l1.save()
+        self.l1int = LocationInstance(location=self.l1, outline=self.o1)
+        self.l1int.save()
+        self.arc = self.o1.create_arc(mace_type='event', name='dragon invasion')
+        story_root = self.o1.story_tree_root
+        for index in range(10):
+            StoryElementNode.objects.get(pk=story_root.pk).add_child(
+                name='Chapter %d' % index, story_element_type='chapter')
+
+
+class OwnershipResolverTest(OwnershipTestCase):
+    '''
+    Tests for resolving and remembering the owners of objects.
+    '''
+
+    def test_permissions(self):
+        '''
+        Every kind of object resolves to its owner.
+        '''
+        objects = [Outline.objects.get(pk=self.o1.pk), Character.objects.get(pk=self.c1.pk),
+                   CharacterInstance.objects.get(pk=self.c1int.pk), LocationInstance.objects.get(pk=self.l1int.pk),
+                   Arc.objects.get(pk=self.arc.pk), ArcElementNode.objects.filter(arc=self.arc).first(),
+                   StoryElementNode.objects.filter(outline=self.o1).last()]
+        for obj in objects:
+            assert ownership.get_resolver().owner_id(obj) == self.user1.pk
+            assert ownership.is_owner(self.user1, obj)
+            assert not ownership.is_owner(self.user2, obj)
+        assert not ownership.is_owner(self.user1, None)
+
+    def test_prime(self):
+        '''
+        Priming resolves a page of objects with one query per model, after which
+        permission checks are free.
+        '''
+        arc_nodes = list(ArcElementNode.objects.filter(arc=self.arc))
+        story_nodes = list(StoryElementNode.objects.filter(outline=self.o1))
+        with ownership.ownership_cache():
+            with self.assertNumQueries(2):
+                ownership.prime(arc_nodes + story_nodes)
+            with self.assertNumQueries(0):
+                for node in arc_nodes:
+                    assert self.user1.has_perm('fiction_outlines.edit_arc_node', node)
+                    assert not self.user2.has_perm('fiction_outlines.edit_arc_node', node)
+                for node in story_nodes:
+                    assert self.user1.has_perm('fiction_outlines.edit_story_node', node)
+                # The owners of parents are learned along the way.
+                assert self.user1.has_perm('fiction_outlines.view_arc', Arc(pk=self.arc.pk, outline_id=self.o1.pk))
+
+    def test_cache_scope(self):
+        '''
+        Owners are only remembered within a request or an ownership_cache block.
+        '''
+        story_node = StoryElementNode.objects.filter(outline=self.o1).last()
+        with self.assertNumQueries(2):
+            ownership.is_owner(self.user1, story_node)
+            ownership.is_owner(self.user1, story_node)
+        with ownership.ownership_cache():
+            with self.assertNumQueries(1):
+                ownership.is_owner(self.user1, story_node)
+                with ownership.ownership_cache():
+                    ownership.is_owner(self.user1, story_node)
+        with self.assertNumQueries(1):
+            ownership.is_owner(self.user1, story_node)
+
+    def test_unsaved_objects(self):
+        '''
+        Unsaved objects resolve through their parent without being remembered.
+        '''
+        with ownership.ownership_cache():
+            assert ownership.is_owner(self.user1, CharacterInstance(character=self.c1, outline=self.o1))
+            c2 = Character(name='Jane', user=self.user2)
+            c2.save()
+            assert ownership.is_owner(self.user2, CharacterInstance(character_id=c2.pk, outline=self.o1))
+
+
+class OwnedQuerySetTest(OwnershipTestCase):
+    '''
+    Tests for filtering querysets by permission.
+    '''
+
+    def test_querysets_match_rules(self):
+        '''
+        The queryset filters agree with the permission rules for every model.
+        '''
+        Outline(title='Other', user=self.user2).save()
+        Character(name='Jane', user=self.user2).save()
+        checks = [(Outline, 'outline'), (Character, 'character'), (CharacterInstance, 'character_instance'),
+                  (Location, 'location'), (LocationInstance, 'location_instance'), (Arc, 'arc'),
+                  (ArcElementNode, 'arc_node'), (StoryElementNode, 'story_node')]
+        for model, perm in checks:
+            for user in (self.user1, self.user2):
+                for method, action in (('visible_to', 'view'), ('editable_by', 'edit'), ('deletable_by', 'delete')):
+                    expected = {obj.pk for obj in model.objects.all()
+                                if user.has_perm('fiction_outlines.%s_%s' % (action, perm), obj)}
+                    assert set(getattr(model.objects, method)(user).values_list('pk', flat=True)) == expected
+
+    def test_anonymous_user(self):
+        '''
+        Anonymous users get nothing, without a query.
+        '''
+        with self.assertNumQueries(0):
+            assert list(Outline.objects.visible_to(AnonymousUser())) == []
+
+    def test_tree_order(self):
+        '''
+        Tree nodes still come back in tree order, and can be deleted as a queryset.
+        '''
+        paths = list(StoryElementNode.objects.visible_to(self.user1).values_list('path', flat=True))
+        assert paths == sorted(paths)
+        assert not StoryElementNode.objects.visible_to(self.user2).exists()
+        StoryElementNode.objects.editable_by(self.user1).filter(depth=2).delete()
+        assert StoryElementNode.objects.filter(outline=self.o1).count() == 1
+        assert StoryElementNode.objects.get(outline=self.o1).numchild == 0
@@ -0,0 +1,79 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from test_plus.test import TestCase
+from fiction_outlines.models import Character, CharacterInstance, Outline
+from fiction_outlines.pagination import decode_cursor, encode_cursor, paginate_keyset
+
+
+class KeysetPaginationTest(TestCase):
+    '''
+    Tests for paging through records by cursor.
+    '''
+
+    def setUp(self):
+        self.user1 = self.make_user('u1')
+        self.user2 = self.make_user('u2')
+        # Repeated names, so that pages have to break ties on pk.
+        Character.objects.bulk_create([Character(name='Extra %d' % (index % 4), user=self.user1)
+                                       for index in range(23)])
+        Character(name='Someone else', user=self.user2).save()
+
+    def page_through(self, ordering, page_size):
+        records, cursor = [], None
+        while True:
+            page = paginate_keyset(Character.objects.filter(user=self.user1), ordering, page_size, cursor)
+            assert len(page) <= page_size
+            records.extend(page)
+            if not page.has_next():
+                return records
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_record_once(self):
+        '''
+        Paging in either direction visits every record exactly once, in order.
+        '''
+        for ordering in ('name', '-modified'):
+            expected = list(Character.objects.filter(user=self.user1).order_by(
+                ordering, '-pk' if ordering.startswith('-') else 'pk'))
+            for page_size in (1, 5, 23, 50):
+                assert self.page_through(ordering, page_size) == expected
+
+    def test_cursors(self):
+        '''
+        Cursors round trip their values, and malformed cursors are rejected.
+        '''
+        character = Character.objects.first()
+        fields = [Character._meta.get_field('modified'), Character._meta.pk]
+        cursor = encode_cursor([character.modified, character.pk])
+        assert decode_cursor(cursor, fields) == [character.modified, character.pk]
+        for bad_cursor in ['nonsense!', encode_cursor([1]), encode_cursor(['yesterday', 'nobody'])]:
+            with pytest.raises(ValueError):
+                decode_cursor(bad_cursor, fields)
+
+    def test_list_view(self):
+        '''
+        The list views page by cursor, with a query count that doesn't depend on the page.
+        '''
+        outline = Outline(title='Crowded', user=self.user1)
+        outline.save()
+        CharacterInstance.objects.bulk_create([CharacterInstance(character=character, outline=outline)
+                                               for character in Character.objects.filter(user=self.user1)[:7]])
+        Character.objects.bulk_create([Character(name='Crowd %d' % index, user=self.user1) for index in range(60)])
+        seen = []
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as first_page:
+                self.get('fiction_outlines:character_list', data={'order': 'title'})
+            while True:
+                self.response_200()
+                page = self.get_context('page_obj')
+                seen.extend(page)
+                if not page.has_next():
+                    break
+                with self.assertNumQueries(len(first_page.captured_queries)):
+                    self.get('fiction_outlines:character_list', data={'order': 'title', 'cursor': page.next_cursor})
+            self.get('fiction_outlines:character_list', data={'cursor': 'nonsense!'})
+            self.response_404()
+        assert len(seen) == 83
+        assert seen == list(Character.objects.filter(user=self.user1).order_by('name', 'pk'))
+        assert sum(character.num_outlines for character in seen) == 7
@@ -0,0 +1,78 @@
+import logging
+from django.test import override_settings
+from test_plus.test import TestCase
+from fiction_outlines import tracing
+from fiction_outlines.models import Arc, Outline
+
+
+class TracingTest(TestCase):
+    '''
+    Tests for timing the outline engines.
+    '''
+
+    def setUp(self):
+        self.user1 = self.make_user('u1')
+        self.user2 = self.make_user('u2')
+        self.user2.is_staff = True
+        self.user2.save()
+        self.outline = Outline(title='Timed', user=self.user1)
+        self.outline.save()
+        self.arc = self.outline.create_arc('mystery', 'Whodunnit')
+        self.url_kwargs = {'outline': self.outline.pk, 'format': 'json'}
+
+    def test_spans(self):
+        '''
+        Spans are only recorded inside a trace, and nested spans of the same name count once.
+        '''
+        self.outline.validate_nesting()
+        with tracing.tracing() as trace:
+            self.outline.refresh_impact_ratings()
+            self.outline.validate_nesting()
+            self.outline.validate_all_arcs()
+            with tracing.tracing() as inner:
+                assert inner is trace
+                Arc.objects.get(pk=self.arc.pk).fetch_arc_errors()
+            with tracing.span('export'):
+                with tracing.span('export'):
+                    pass
+        assert [name for name, seconds in trace.spans] == ['impact', 'nesting', 'arc_validation', 'arc_validation',
+                                                           'export']
+        assert trace.totals()['arc_validation'][0] == 2
+        assert 'impact;dur=' in trace.server_timing()
+        assert tracing._current_trace.get() is None
+
+    def test_no_formatting_when_disabled(self):
+        '''
+        Debug messages aren't formatted unless debug logging is enabled.
+        '''
+        class Unformattable(object):
+            def __str__(self):
+                raise AssertionError('Formatted a disabled debug message')
+
+        logger = logging.getLogger('MS_Models')
+        assert not logger.isEnabledFor(logging.DEBUG)
+        logger.debug('Found an node of type %s', Unformattable())
+        node = self.outline.story_tree_root.add_child(name='Chapter 1', story_element_type='chapter')
+        with self.assertNumQueries(1):
+            node._local_impact_rating()
+
+    def test_middleware(self):
+        '''
+        The timings are reported for staff users who ask for them, or for everyone when tracing is on.
+        '''
+        with self.login(username='u1'):
+            response = self.get('fiction_outlines:outline_export', data={'trace': ''}, **self.url_kwargs)
+            self.response_200(response)
+            assert 'Server-Timing' not in response
+        self.outline.user = self.user2
+        self.outline.save()
+        with self.login(username='u2'):
+            response = self.get('fiction_outlines:outline_export', **self.url_kwargs)
+            assert 'Server-Timing' not in response
+            response = self.get('fiction_outlines:outline_export', data={'trace': ''}, **self.url_kwargs)
+            self.response_200(response)
+            assert response['Server-Timing'].startswith('export;dur=')
+            with override_settings(FICTION_OUTLINES_TRACING=True):
+                response = self.get('fiction_outlines:arc_list', outline=self.outline.pk)
+                self.response_200(response)
+                assert response['Server-Timing'].startswith('arc_validation;dur=')
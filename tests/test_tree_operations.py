@@ -0,0 +1,128 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from test_plus.test import TestCase
+from fiction_outlines.models import ArcElementNode, Outline, StoryElementNode
+from fiction_outlines.receivers import flush_outline_touches
+from fiction_outlines.tree_operations import TreeOperationError, apply_story_tree_operations
+
+
+class StoryTreeOperationsTest(TestCase):
+    '''
+    Tests for applying batches of changes to the story tree.
+    '''
+
+    def setUp(self):
+        self.user1 = self.make_user('u1')
+        self.outline = Outline(title='Restructured', user=self.user1)
+        self.outline.save()
+        self.other = Outline(title='Untouched', user=self.user1)
+        self.other.save()
+        self.other.story_tree_root.add_child(story_element_type='chapter', name='Elsewhere')
+        self.refs = apply_story_tree_operations(self.outline, [
+            {'op': 'add', 'parent': self.outline.story_tree_root.pk, 'story_element_type': 'part', 'name': 'Part 1',
+             'ref': 'part1'},
+            {'op': 'add', 'parent': 'part1', 'story_element_type': 'chapter', 'name': 'Chapter 1', 'ref': 'chap1'},
+            {'op': 'add', 'parent': 'part1', 'story_element_type': 'chapter', 'name': 'Chapter 2', 'ref': 'chap2'},
+            {'op': 'add', 'parent': 'chap1', 'name': 'Scene 1', 'ref': 'scene1'},
+            {'op': 'add', 'parent': 'chap1', 'name': 'Scene 2', 'ref': 'scene2'},
+            {'op': 'add', 'parent': 'chap2', 'name': 'Scene 3', 'ref': 'scene3'},
+        ])
+
+    def tree(self):
+        root = StoryElementNode.objects.get(outline=self.outline, depth=1)
+        return [(node.depth, node.name) for node in StoryElementNode.get_tree(root)]
+
+    def snapshot(self):
+        return list(StoryElementNode.objects.order_by('path').values_list('pk', 'path', 'depth', 'numchild'))
+
+    def test_operations(self):
+        '''
+        Adds, moves and deletes end up in the same tree as the single node operations would build.
+        '''
+        assert self.tree() == [(1, None), (2, 'Part 1'), (3, 'Chapter 1'), (4, 'Scene 1'), (4, 'Scene 2'),
+                               (3, 'Chapter 2'), (4, 'Scene 3')]
+        apply_story_tree_operations(self.outline, [
+            {'op': 'add', 'parent': self.refs['part1'], 'story_element_type': 'chapter', 'name': 'Prologue',
+             'index': 0, 'ref': 'prologue'},
+            {'op': 'move', 'node': self.refs['scene2'], 'parent': 'prologue'},
+            {'op': 'move', 'node': self.refs['scene3'], 'parent': self.refs['chap1'], 'index': 0},
+            {'op': 'delete', 'node': self.refs['chap2']},
+            {'op': 'move', 'node': self.refs['chap1'], 'parent': self.outline.story_tree_root.pk},
+        ])
+        assert self.tree() == [(1, None), (2, 'Part 1'), (3, 'Prologue'), (4, 'Scene 2'), (2, 'Chapter 1'),
+                               (3, 'Scene 3'), (3, 'Scene 1')]
+        assert StoryElementNode.find_problems() == ([], [], [], [], [])
+        assert not StoryElementNode.objects.filter(pk=self.refs['chap2']).exists()
+        assert StoryElementNode.objects.get(outline=self.other, depth=2).name == 'Elsewhere'
+
+    def test_invalid_operations(self):
+        '''
+        An invalid operation anywhere in the batch leaves the tree untouched.
+        '''
+        before = self.snapshot()
+        root = self.outline.story_tree_root.pk
+        invalid = [
+            {'op': 'add', 'parent': self.refs['scene1'], 'story_element_type': 'chapter'},
+            {'op': 'add', 'parent': root, 'story_element_type': 'root'},
+            {'op': 'add', 'parent': self.other.story_tree_root.pk},
+            {'op': 'add', 'parent': root, 'ref': 'part1'},
+            {'op': 'add', 'parent': root, 'index': 5},
+            {'op': 'move', 'node': self.refs['part1'], 'parent': self.refs['chap1']},
+            {'op': 'move', 'node': self.refs['chap1'], 'parent': self.refs['chap2']},
+            {'op': 'move', 'node': root, 'parent': self.refs['part1']},
+            {'op': 'delete', 'node': root},
+            {'op': 'delete', 'node': 'nonsense'},
+            {'op': 'rename', 'node': self.refs['scene1']},
+        ]
+        for operation in invalid:
+            with pytest.raises(TreeOperationError) as error:
+                apply_story_tree_operations(self.outline, [
+                    {'op': 'add', 'parent': root, 'story_element_type': 'part', 'ref': 'part1'},
+                    {'op': 'delete', 'node': self.refs['chap2']},
+                    operation,
+                ])
+            assert error.value.index == 2
+            assert self.snapshot() == before
+
+    def test_query_count(self):
+        '''
+        The number of queries does not depend on the number of operations.
+        '''
+        def operations(count):
+            added = [{'op': 'add', 'parent': self.refs['chap2'], 'name': 'Extra %d' % index, 'ref': index}
+                     for index in range(count)]
+            moved = [{'op': 'move', 'node': index, 'parent': self.refs['chap1'], 'index': 0} for index in range(count)]
+            return added + moved + [
+                {'op': 'delete', 'node': 0},
+                {'op': 'move', 'node': self.refs['scene1'], 'parent': self.refs['chap2']},
+            ]
+
+        with CaptureQueriesContext(connection) as small:
+            apply_story_tree_operations(self.outline, operations(2))
+        with self.assertNumQueries(len(small.captured_queries)):
+            apply_story_tree_operations(self.outline, operations(20))
+        assert StoryElementNode.objects.get(pk=self.refs['chap1']).numchild == 21
+        assert StoryElementNode.find_problems() == ([], [], [], [], [])
+
+    def test_impact_and_modified(self):
+        '''
+        Stored impact ratings are refreshed, and the outline is marked as modified.
+        '''
+        arc = self.outline.create_arc(mace_type='event', name='Disaster')
+        hook = ArcElementNode.objects.get(arc=arc, arc_element_type='mile_hook')
+        hook.story_element_node_id = self.refs['scene1']
+        hook.save()
+        flush_outline_touches()
+        modified = Outline.objects.get(pk=self.outline.pk).modified
+        apply_story_tree_operations(self.outline, [
+            {'op': 'move', 'node': self.refs['scene1'], 'parent': self.refs['chap2']},
+            {'op': 'add', 'parent': self.refs['chap2'], 'name': 'Scene 4'},
+        ])
+        ratings = self.outline.compute_impact_ratings()
+        stored = StoryElementNode.objects.filter(outline=self.outline).values_list('pk', 'impact_rating')
+        assert dict(stored) == ratings
+        assert StoryElementNode.objects.get(pk=self.refs['chap2']).impact_rating > 0.5
+        assert StoryElementNode.objects.get(pk=self.refs['chap1']).impact_rating == 0.5
+        flush_outline_touches()
+        assert Outline.objects.get(pk=self.outline.pk).modified > modified
@@ -4,7 +4,8 @@ Tests for outline views
 import pytest
 import django
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from test_plus.test import TestCase
 from fiction_outlines.models import Series, Character, CharacterInstance, Outline
 from fiction_outlines.models import Location, LocationInstance, Arc
@@ -96,6 +97,18 @@ class FictionOutlineViewTestCase(TestCase):
             return self.response_302()
         return self.response_403()
 
+    def assertConstantQueries(self, url_name, grow, **kwargs):
+        '''
+        Renders a view before and after calling ``grow`` to add content, and asserts that
+        both renders make the same number of queries.
+        '''
+        with CaptureQueriesContext(connection) as before:
+            self.assertGoodView(url_name, **kwargs)
+        grow()
+        with CaptureQueriesContext(connection) as after:
+            self.assertGoodView(url_name, **kwargs)
+        assert len(after.captured_queries) == len(before.captured_queries)
+
 
 class SeriesViewTest(FictionOutlineViewTestCase):
     """
@@ -942,6 +955,22 @@ class OutlineDetailTestCase(FictionOutlineViewTestCase):
             self.assertInContext("outline")
             assert self.o1 == self.get_context("outline")
 
+    def test_query_count(self):
+        """
+        The number of queries does not depend on how many characters, locations, and arcs there are.
+        """
+        def grow():
+            for x in range(3):
+                CharacterInstance(outline=self.o1, character=Character.objects.create(
+                    name="Extra %d" % x, user=self.user1)).save()
+                LocationInstance(outline=self.o1, location=Location.objects.create(
+                    name="Place %d" % x, user=self.user1)).save()
+                self.o1.create_arc(name="Subplot %d" % x, mace_type="event")
+
+        with self.login(username=self.user1.username):
+            self.assertConstantQueries("fiction_outlines:outline_detail", grow, outline=self.o1.pk)
+            self.assertResponseContains("Extra 2", html=False)
+
 
 class OutlineCreateTestCase(FictionOutlineViewTestCase):
     """
@@ -1622,6 +1651,7 @@ class ArcListViewTestCase(FictionOutlineViewTestCase):
             assert self.arc2 in arcs
             for arc in arcs:
                 assert arc.arcelementnode_set.filter(depth__gt=1).count() == 7
+                assert arc.__dict__['current_errors'] == []
             self.assertGoodView("fiction_outlines:arc_list", outline=self.o2.pk)
             self.get("fiction_outlines:arc_list", outline=self.o2.pk)
             arcs = self.get_context("arc_list")
@@ -1685,6 +1715,29 @@ class ArcDetailTest(FictionOutlineViewTestCase):
             self.assertInContext("arc")
             assert self.arc1 == self.get_context("arc")
 
+    def test_annotated_counts(self):
+        """
+        Each node shows its number of characters and locations, and the number of queries does
+        not depend on the size of the arc.
+        """
+        hook = ArcElementNode.objects.get(arc=self.arc1, arc_element_type="mile_hook")
+        hook.assoc_characters.add(self.c1int, self.c2int)
+        hook.assoc_locations.add(self.l1int)
+
+        def grow():
+            for x in range(3):
+                beat = ArcElementNode.objects.get(pk=hook.pk).add_child(
+                    arc_element_type="beat", description="Beat %d" % x)
+                beat.assoc_characters.add(self.c1int)
+
+        with self.login(username=self.user1.username):
+            self.assertConstantQueries("fiction_outlines:arc_detail", grow, outline=self.o1.pk, arc=self.arc1.pk)
+            counts = {item.pk: (item.num_characters, item.num_locations)
+                      for item, info in self.get_context("annotated_list")}
+        assert counts[hook.pk] == (2, 1)
+        assert len(counts) == ArcElementNode.objects.filter(arc=self.arc1).count()
+        assert sorted(counts.values()).count((1, 0)) == 3
+
 
 class ArcCreateTest(FictionOutlineViewTestCase):
     """
@@ -2196,6 +2249,23 @@ class ArcNodeMoveTest(ArcNodeAbstractTestCase):
                 self.node_to_test.path == ArcElementNode.objects.get(pk=self.node_to_test.pk).path
             )
 
+    def test_choices(self):
+        """
+        Arc nodes get choices from their own arc only.
+        """
+        with self.login(username=self.user1.username):
+            self.get(
+                "fiction_outlines:arcnode_move_choices",
+                outline=self.o1.pk,
+                arc=self.arc1.pk,
+                arcnode=self.node_to_test.pk,
+            )
+            self.response_200()
+            results = self.last_response.json()["results"]
+        assert [node["id"] for node in results] == [
+            str(node.pk) for node in self.arc1.arc_root_node.get_children()]
+        assert results[0]["label"].startswith("Milestone: Hook: ")
+
 
 class ArcNodeDeleteTest(ArcNodeAbstractTestCase):
     """
@@ -2821,6 +2891,83 @@ class StoryNodeMoveTest(ArcNodeAbstractTestCase):
                 == StoryElementNode.objects.get(pk=self.o1_valid_storynode.pk).path
             )
 
+    def choices(self, **data):
+        self.get(
+            "fiction_outlines:storynode_move_choices",
+            outline=self.o1.pk,
+            storynode=self.o1_scene1.pk,
+            data=data,
+        )
+        self.response_200()
+        return self.last_response.json()
+
+    def test_move_form_is_lazy(self):
+        """
+        The move form doesn't list the tree, but still only accepts nodes from it.
+        """
+        with self.login(username=self.user1.username):
+            self.assertGoodView(
+                "fiction_outlines:storynode_move",
+                outline=self.o1.pk,
+                storynode=self.o1_scene1.pk,
+            )
+            self.assertResponseContains("data-choices-url", html=False)
+            self.assertResponseNotContains("Part 1", html=False)
+            for target in ["nonsense", self.o1_invalid_node.pk, self.o1.story_tree_root.pk]:
+                self.post(
+                    "fiction_outlines:storynode_move",
+                    outline=self.o1.pk,
+                    storynode=self.o1_scene1.pk,
+                    data={"_ref_node_id": target, "_position": "right"},
+                )
+                self.response_200()
+                assert "_ref_node_id" in self.get_context("form").errors
+            self.post(
+                "fiction_outlines:storynode_move",
+                outline=self.o1.pk,
+                storynode=self.o1_scene1.pk,
+                data={"_ref_node_id": self.o1_scene2.pk, "_position": "right"},
+            )
+            self.response_302()
+            assert StoryElementNode.objects.get(pk=self.o1_scene1.pk).get_prev_sibling() == self.o1_scene2
+
+    def test_choices(self):
+        """
+        The picker loads one level at a time, or search results, in a fixed number of queries.
+        """
+        for user in [self.user2, self.user3]:
+            with self.login(username=user.username):
+                self.get(
+                    "fiction_outlines:storynode_move_choices",
+                    outline=self.o1.pk,
+                    storynode=self.o1_scene1.pk,
+                )
+                self.response_forbidden()
+        with self.login(username=self.user1.username):
+            top = self.choices()
+            assert [node["id"] for node in top["results"]] == [str(self.part1.pk)]
+            assert top["results"][0]["has_children"]
+            assert top["next"] is None
+            with CaptureQueriesContext(connection) as queries:
+                chapters = self.choices(parent=top["results"][0]["path"])
+            assert [node["label"] for node in chapters["results"]] == ["Chapter: Chapter One", "Chapter: chapter2"]
+            for x in range(5):
+                self.part1.refresh_from_db()
+                self.part1.add_child(name="Chapter %d" % x, story_element_type="chapter")
+            with self.assertNumQueries(len(queries.captured_queries)):
+                chapters = self.choices(parent=top["results"][0]["path"])
+            assert len(chapters["results"]) == 7
+            found = self.choices(q="MIRROR")
+            assert [node["id"] for node in found["results"]] == [str(self.o1_scene1.pk)]
+            assert not self.choices(q="totally different")["results"]
+            self.get(
+                "fiction_outlines:storynode_move_choices",
+                outline=self.o1.pk,
+                storynode=self.o1_scene1.pk,
+                data={"parent": self.o1_invalid_node.path[:5] + "00001"},
+            )
+            self.response_404()
+
 
 class StoryNodeDeleteTest(ArcNodeAbstractTestCase):
     """